@@ -0,0 +1 @@
+'''Benchmarks for the spotifest web app, see bench_routes.'''
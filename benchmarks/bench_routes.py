@@ -0,0 +1,224 @@
+'''
+End-to-end benchmark of festival creation and playlist generation.
+
+Drives /festival/create_new, /festival/<slug> (then reloads it with its
+ETag), /festival/<slug>/results and the job status poll that follows it
+through the Flask test client, with spotipy, Echonest (catalogs and song
+search), the OAuth token endpoint and redis replaced by the deterministic
+fakes in benchmarks.fakes, and MySQL by a temporary sqlite database behind
+the regular connection pool. Every request is timed, and calls to each
+external dependency as well as db queries are counted per route.
+
+Run from the repository root (config.py still reads credentials.txt,
+placeholder values are fine):
+
+    python -m benchmarks.bench_routes -n 50 --spotify-latency 0.02
+
+'''
+import sys
+import json
+import time
+import argparse
+import mock
+
+from collections import defaultdict
+
+from .fakes import (Recorder, FakeSpotify, FakeCatalog, FakeSongModule,
+                    FakeRequests, FakeRedis, SQLiteMySQL)
+
+
+USER_ID = 'bench_user'
+ROUTES = ('create_new', 'festival', 'festival_reload', 'results',
+          'results_status')
+PARAMETERS = {'name': 'Bench Fest', 'hotttnesss': '0.2',
+              'danceability': '0.2', 'energy': '0.2', 'variety': '0.5',
+              'adventurousness': '0.5'}
+
+
+def percentile(samples, p):
+    ''' Nearest-rank percentile of a list of samples.'''
+    ordered = sorted(samples)
+    rank = max(int(round(p / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def install(recorder, redis_store, stream=True, preferences='redis'):
+    ''' Returns the patchers that swap every external dependency of the
+    app for a fake reporting to `recorder`.'''
+    from library import (app, auth, db, helpers, jobs, metrics,
+                         playlist_engine, spotify_client, tokens)
+    from library.pool import ConnectionPool
+    from library.cache_backends import (RedisPreferenceBackend,
+                                        LRUPreferenceBackend,
+                                        DatabasePreferenceBackend)
+
+    for fake in (FakeSpotify, FakeCatalog, FakeSongModule, FakeRequests):
+        fake.recorder = recorder
+    app.config.update(IS_ASYNC=False, TESTING=True, WTF_CSRF_ENABLED=False,
+                      STREAM_PREFERENCES=stream)
+    database = SQLiteMySQL(recorder)
+    pool = ConnectionPool(database)
+    backend = {'redis': lambda: RedisPreferenceBackend(redis_store),
+               'lru': LRUPreferenceBackend,
+               'mysql': lambda: DatabasePreferenceBackend(pool)}[preferences]()
+    patchers = [
+        mock.patch.object(spotify_client, 'RateLimitedSpotify', FakeSpotify),
+        mock.patch.object(helpers, 'Catalog', FakeCatalog),
+        mock.patch.object(db, 'Catalog', FakeCatalog),
+        mock.patch.object(playlist_engine, 'song', FakeSongModule()),
+        mock.patch.object(auth, 'requests', FakeRequests()),
+        mock.patch.object(tokens, 'requests', FakeRequests()),
+        mock.patch.object(tokens.token_manager, 'store', redis_store),
+        mock.patch.object(db, 'db_pool', pool),
+        mock.patch.object(helpers.track_resolver, 'store', redis_store),
+        mock.patch.object(helpers.playlist_harvester, 'store', redis_store),
+        mock.patch.object(helpers.track_features, 'store', redis_store),
+        mock.patch.object(helpers, 'redis_store', redis_store),
+        mock.patch.object(helpers.artist_index, 'store', redis_store),
+        mock.patch.object(jobs.progress, 'store', redis_store),
+        mock.patch.object(metrics.metrics, 'store', redis_store),
+        mock.patch.object(auth.fragment_cache, 'store', redis_store),
+        mock.patch.object(auth.user_cache, 'backend', backend),
+        mock.patch.object(auth.user_cache, 'store', redis_store),
+        mock.patch.object(auth.festival_samplers, 'backend', backend),
+    ]
+    patchers.append(mock.patch.object(
+        helpers, 'stream_preferences',
+        recorder.timed('helpers.stream_preferences', helpers.stream_preferences)))
+    for name in ('get_user_preferences', 'populate_catalog'):
+        method = getattr(helpers.AsyncAdapter, name).__func__
+        patchers.append(mock.patch.object(
+            helpers.AsyncAdapter, name,
+            recorder.timed('adapter.' + name, method)))
+    return patchers, database
+
+
+def login(client):
+    from library import auth
+    auth.User(USER_ID, 'bench-token', 'bench-refresh', expires_in=3600)
+    with client.session_transaction() as sess:
+        sess['user_id'] = USER_ID
+        sess['_fresh'] = True
+
+
+class RouteStats(object):
+    def __init__(self):
+        self.samples = []
+        self.calls = defaultdict(int)
+        self.time = defaultdict(float)
+
+    def add(self, elapsed, calls, times):
+        self.samples.append(elapsed)
+        for name, count in calls.items():
+            self.calls[name] += count
+            self.time[name] += times.get(name, 0)
+
+    def report(self):
+        n = float(len(self.samples))
+        return {'requests': len(self.samples),
+                'p50_ms': percentile(self.samples, 50) * 1000,
+                'p95_ms': percentile(self.samples, 95) * 1000,
+                'p99_ms': percentile(self.samples, 99) * 1000,
+                'calls_per_request': {k: v / n for k, v in self.calls.items()},
+                'ms_per_request': {k: v * 1000 / n for k, v in self.time.items()}}
+
+
+def timed_request(recorder, stats, route, send):
+    recorder.reset()
+    started = time.time()
+    response = send()
+    elapsed = time.time() - started
+    calls, times = recorder.snapshot()
+    stats[route].add(elapsed, calls, times)
+    if response.status_code >= 400:
+        raise RuntimeError('{} answered {}'.format(route, response.status_code))
+    return response
+
+
+def run(iterations, latency, cold=False, stream=True, preferences='redis'):
+    from library import app
+
+    recorder = Recorder(latency)
+    redis_store = FakeRedis()
+    patchers, database = install(recorder, redis_store, stream, preferences)
+    stats = {route: RouteStats() for route in ROUTES}
+    for patcher in patchers:
+        patcher.start()
+    try:
+        client = app.test_client()
+        login(client)
+        for _ in xrange(iterations):
+            if cold:
+                redis_store.data.clear()
+                login(client)    # the access token lives in redis too
+            response = timed_request(recorder, stats, 'create_new',
+                                     lambda: client.get('/festival/create_new'))
+            url = response.headers['Location']
+            slug = url.rstrip('/').split('/')[-1]
+            response = timed_request(recorder, stats, 'festival',
+                                     lambda: client.get('/festival/' + slug))
+            etag = response.headers.get('ETag', '')
+            timed_request(recorder, stats, 'festival_reload',
+                          lambda: client.get('/festival/' + slug,
+                                             headers={'If-None-Match': etag}))
+            response = timed_request(
+                recorder, stats, 'results',
+                lambda: client.post('/festival/{}/results'.format(slug),
+                                    data=PARAMETERS))
+            job_id = response.headers['Location'].split('job=')[-1]
+            response = timed_request(
+                recorder, stats, 'results_status',
+                lambda: client.get('/festival/{}/results/{}'.format(slug, job_id)))
+            state = json.loads(response.data)['state']
+            if state != 'done':
+                raise RuntimeError('playlist job ended as {}'.format(state))
+    finally:
+        for patcher in reversed(patchers):
+            patcher.stop()
+        database.close()
+    return {route: stats[route].report() for route in ROUTES}
+
+
+def print_report(report):
+    for route in ROUTES:
+        r = report[route]
+        print '{:<15} n={:<4} p50={:8.2f}ms  p95={:8.2f}ms  p99={:8.2f}ms'.format(
+            route, r['requests'], r['p50_ms'], r['p95_ms'], r['p99_ms'])
+        for name in sorted(r['calls_per_request']):
+            print '    {:<42} {:8.1f} calls  {:8.2f}ms'.format(
+                name, r['calls_per_request'][name], r['ms_per_request'][name])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', '--iterations', type=int, default=20)
+    parser.add_argument('--spotify-latency', type=float, default=0.0,
+                        help='seconds added to every Spotify API call')
+    parser.add_argument('--echonest-latency', type=float, default=0.0,
+                        help='seconds added to every Echonest API call')
+    parser.add_argument('--db-latency', type=float, default=0.0,
+                        help='seconds added to every db query')
+    parser.add_argument('--cold', action='store_true',
+                        help='empty the redis caches before every iteration')
+    parser.add_argument('--no-stream', action='store_true',
+                        help='harvest all artists before seeding the catalog')
+    parser.add_argument('--preferences', choices=('redis', 'lru', 'mysql'),
+                        default='redis',
+                        help='artist preference backend (USER_CACHE_BACKEND)')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args(argv)
+
+    latency = {'spotify': args.spotify_latency,
+               'echonest': args.echonest_latency,
+               'db': args.db_latency}
+    report = run(args.iterations, latency, cold=args.cold,
+                 stream=not args.no_stream, preferences=args.preferences)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,514 @@
+'''
+Deterministic stand-ins for the external services spotifest talks to.
+Every call is counted (and timed) by a shared Recorder, and can be given
+an artificial latency to model the real round trip.
+'''
+import os
+import re
+import time
+import sqlite3
+import tempfile
+import itertools
+import requests
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class Recorder(object):
+    ''' Counts calls and accumulated time per dependency, e.g.
+    'spotify.search', 'echonest.catalog.update' or 'db.query'.'''
+
+    def __init__(self, latency=None):
+        self.latency = latency or {}
+        self.reset()
+
+    def reset(self):
+        self.calls = defaultdict(int)
+        self.time = defaultdict(float)
+
+    @contextmanager
+    def call(self, name):
+        started = time.time()
+        delay = self.latency.get(name, self.latency.get(name.split('.')[0], 0))
+        if delay:
+            time.sleep(delay)
+        try:
+            yield
+        finally:
+            self.calls[name] += 1
+            self.time[name] += time.time() - started
+
+    def timed(self, name, func):
+        ''' Wraps func so each call is recorded under name.'''
+        def wrapper(*args, **kwargs):
+            with self.call(name):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        return wrapper
+
+    def snapshot(self):
+        return dict(self.calls), dict(self.time)
+
+
+def _artist(i):
+    return u'Artist {}'.format(i)
+
+
+class FakeSpotify(object):
+    '''
+    spotipy.Spotify replacement serving a synthetic library of
+    `saved_tracks` saved tracks, `playlists` playlists of
+    `playlist_tracks` tracks each and `followed` followed artists.
+    '''
+
+    recorder = None
+    library = {'saved_tracks': 500, 'playlists': 20,
+               'playlist_tracks': 60, 'followed': 80, 'artists': 300}
+    created = {}
+
+    def __init__(self, auth=None, **kwargs):
+        self.auth = auth
+
+    def _call(self, name):
+        return self.recorder.call('spotify.' + name)
+
+    def _page(self, items, limit, offset, total, url):
+        page = {'items': items, 'total': total, 'limit': limit,
+                'offset': offset, 'next': None}
+        if offset + limit < total:
+            page['next'] = '{}?offset={}&limit={}'.format(url, offset + limit, limit)
+        return page
+
+    def _tracks(self, count, limit, offset, seed):
+        artists = self.library['artists']
+        return [{'track': {'id': 'track{}'.format(seed + i),
+                           'artists': [{'name': _artist((seed + i) % artists)}]}}
+                for i in xrange(offset, min(offset + limit, count))]
+
+    def me(self):
+        with self._call('me'):
+            return {'id': 'bench_user'}
+
+    current_user = me
+
+    def current_user_saved_tracks(self, limit=20, offset=0):
+        with self._call('current_user_saved_tracks'):
+            total = self.library['saved_tracks']
+            return self._page(self._tracks(total, limit, offset, 0),
+                              limit, offset, total, 'saved')
+
+    def user_playlists(self, user, limit=50, offset=0):
+        with self._call('user_playlists'):
+            total = self.library['playlists'] + len(self.created)
+            # like Spotify, most recently created playlists come first
+            playlists = [{'id': pid, 'name': name, 'snapshot_id': pid,
+                          'owner': {'id': user}}
+                         for name, pid in self.created.items()]
+            playlists += [{'id': 'pl{}'.format(i), 'name': 'Playlist {}'.format(i),
+                           'snapshot_id': 'snap{}'.format(i),
+                           'owner': {'id': user}}
+                          for i in xrange(self.library['playlists'])]
+            return self._page(playlists[offset:offset + limit], limit,
+                              offset, total, 'playlists')
+
+    def user_playlist_tracks(self, user, playlist_id=None, fields=None,
+                             limit=100, offset=0):
+        with self._call('user_playlist_tracks'):
+            total = self.library['playlist_tracks']
+            seed = int(re.sub(r'\D', '', playlist_id) or 0) * 7
+            return self._page(self._tracks(total, limit, offset, seed),
+                              limit, offset, total, 'tracks/' + playlist_id)
+
+    def current_user_followed_artists(self, limit=20, after=None):
+        with self._call('current_user_followed_artists'):
+            return {'artists': self._followed(limit, 0)}
+
+    def _followed(self, limit, offset):
+        total = self.library['followed']
+        page = self._page([{'name': _artist(i)}
+                           for i in xrange(offset, min(offset + limit, total))],
+                          limit, offset, total, 'following')
+        page['cursors'] = {'after': page['next'] and str(offset + limit)}
+        return page
+
+    def next(self, result):
+        with self._call('next'):
+            url = result['next']
+            path, query = url.split('?')
+            params = dict(p.split('=') for p in query.split('&'))
+            offset, limit = int(params['offset']), int(params['limit'])
+        if path == 'following':
+            return {'artists': self._followed(limit, offset)}
+        if path == 'saved':
+            return self.current_user_saved_tracks(limit, offset)
+        if path == 'playlists':
+            return self.user_playlists('bench_user', limit, offset)
+        return self.user_playlist_tracks('bench_user', path.split('/')[1],
+                                         limit=limit, offset=offset)
+
+    def search(self, q, limit=10, offset=0, type='track'):
+        with self._call('search'):
+            if 'nomatch' in q:
+                return {'tracks': {'items': []}}
+            return {'tracks': {'items': [{'id': 'id-' + str(abs(hash(q)))}]}}
+
+    def user_playlist_create(self, user, name, public=True):
+        with self._call('user_playlist_create'):
+            self.created[name] = 'created{}'.format(len(self.created))
+            return {'id': self.created[name]}
+
+    def user_playlist_add_tracks(self, user, playlist_id, tracks, position=None):
+        with self._call('user_playlist_add_tracks'):
+            return {'snapshot_id': 'x'}
+
+
+class FakeCatalog(object):
+    ''' pyechonest.catalog.Catalog replacement, kept in memory.'''
+
+    recorder = None
+    catalogs = {}
+    ids = itertools.count(1)
+
+    def __init__(self, id, type=None, **kwargs):
+        with self.recorder.call('echonest.catalog.create'):
+            if id in self.catalogs:
+                self.id = id
+            else:
+                self.id = 'CA{}'.format(next(self.ids))
+                self.catalogs[self.id] = {}
+                self.catalogs[id] = self.catalogs[self.id]
+
+    @property
+    def items(self):
+        return self.catalogs[self.id]
+
+    def update(self, items):
+        with self.recorder.call('echonest.catalog.update'):
+            for item in items:
+                data = item['item']
+                self.items[data.get('item_id', data['artist_name'])] = data
+            return 'ticket-{}'.format(self.id)
+
+    def status(self, ticket):
+        with self.recorder.call('echonest.catalog.status'):
+            return {'ticket_status': 'complete', 'items_updated': len(self.items)}
+
+    def get_item_dicts(self, results=15, start=0):
+        with self.recorder.call('echonest.catalog.read'):
+            return [{'artist_name': d['artist_name']}
+                    for d in self.items.values()][start:start + results]
+
+    def delete(self):
+        with self.recorder.call('echonest.catalog.delete'):
+            self.catalogs.pop(self.id, None)
+
+
+class FakeSong(object):
+    def __init__(self, artist, i):
+        self.title = u'{} song {}'.format(artist, i)
+        self.artist_name = artist
+        rank = (hash(self.title) % 1000) / 1000.0
+        self.audio_summary = {'danceability': rank, 'energy': 1 - rank / 2}
+        self.song_hotttnesss = rank
+        self.artist_hotttnesss = 0.6
+        self.artist_familiarity = (hash(artist) % 100) / 100.0
+
+
+class FakeSongModule(object):
+    ''' Stands in for pyechonest.song.'''
+
+    recorder = None
+
+    def search(self, artist=None, buckets=None, results=15, **kwargs):
+        with self.recorder.call('echonest.song.search'):
+            return [FakeSong(artist, i) for i in xrange(results)]
+
+
+class FakeResponse(object):
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+
+    def json(self):
+        return self.payload
+
+
+class FakeRequests(object):
+    ''' Stands in for the requests module used by the OAuth flow.'''
+
+    recorder = None
+    RequestException = requests.RequestException
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        with self.recorder.call('spotify.token'):
+            return FakeResponse({'access_token': 'bench-token',
+                                 'expires_in': 3600})
+
+    def get(self, url, params=None):
+        with self.recorder.call('spotify.authorize'):
+            return type('Response', (object,), {'url': url})()
+
+
+class FakeRedis(object):
+    ''' The subset of redis.StrictRedis used by the application caches.'''
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value)
+        return True
+
+    def setex(self, key, ttl, value):
+        self.data[key] = str(value)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def expire(self, key, ttl):
+        return key in self.data
+
+    def incr(self, key, amount=1):
+        self.data[key] = str(int(self.data.get(key, 0)) + amount)
+        return int(self.data[key])
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = str(value)
+
+    def hsetnx(self, key, field, value):
+        entry = self.data.setdefault(key, {})
+        if field in entry:
+            return 0
+        entry[field] = str(value)
+        return 1
+
+    def hmget(self, key, fields):
+        entry = self.data.get(key, {})
+        return [entry.get(field) for field in fields]
+
+    def hmset(self, key, mapping):
+        self.data.setdefault(key, {}).update((k, str(v)) for k, v in mapping.items())
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.data.get(key, {}).pop(field, None)
+
+    def hincrby(self, key, field, amount=1):
+        entry = self.data.setdefault(key, {})
+        entry[field] = str(int(entry.get(field, 0)) + amount)
+        return int(entry[field])
+
+    def hincrbyfloat(self, key, field, amount=1.0):
+        entry = self.data.setdefault(key, {})
+        entry[field] = repr(float(entry.get(field, 0)) + amount)
+        return float(entry[field])
+
+    def sadd(self, key, *members):
+        self.data.setdefault(key, set()).update(members)
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def scard(self, key):
+        return len(self.data.get(key, set()))
+
+    def incrby(self, key, amount=1):
+        return self.incr(key, amount)
+
+    def zadd(self, key, *pairs):
+        entry = self.data.setdefault(key, {})
+        for score, member in zip(pairs[::2], pairs[1::2]):
+            entry[member] = float(score)
+
+    def zrangebyscore(self, key, low, high, start=None, num=None,
+                      withscores=False):
+        def bound(value):
+            value = str(value)
+            if value.startswith('('):
+                return float(value[1:]), True
+            return float(value.replace('inf', 'Infinity')), False
+        (low, low_open), (high, _) = bound(low), bound(high)
+        rows = sorted((score, member) for member, score
+                      in self.data.get(key, {}).items()
+                      if (score > low if low_open else score >= low)
+                      and score <= high)
+        rows = rows[start or 0:(start or 0) + num if num is not None else None]
+        if withscores:
+            return [(member, score) for score, member in rows]
+        return [member for _, member in rows]
+
+    def zremrangebyrank(self, key, start, stop):
+        entry = self.data.get(key, {})
+        ranked = sorted(entry, key=entry.get)
+        stop = len(ranked) + stop if stop < 0 else stop
+        for member in ranked[start:max(stop + 1, 0)]:
+            del entry[member]
+
+    def register_script(self, script):
+        ''' Only the artist index's script, run as the redis commands it
+        is made of.'''
+        from library.artist_index import SHARE_SCRIPT
+        if script != SHARE_SCRIPT:
+            raise NotImplementedError('Unknown script.')
+
+        def share(keys, args):
+            limit, names = int(args[0]), args[1:]
+            last = self.incrby(keys[1], len(names))
+            for i, name in enumerate(names):
+                self.zadd(keys[0], last - len(names) + 1 + i, name)
+            self.zremrangebyrank(keys[0], 0, -limit - 1)
+            return last
+        return share
+
+
+class FakePipeline(object):
+    def __init__(self, store):
+        self.store = store
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+
+    def execute(self):
+        results = [getattr(self.store, name)(*args, **kwargs)
+                   for name, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+SCHEMA = '''
+CREATE TABLE sessions (
+    festivalId INTEGER PRIMARY KEY AUTOINCREMENT,
+    festivalName varchar(100),
+    userId varchar(30) NOT NULL,
+    playlistId varchar(30),
+    playlistURL varchar(512),
+    catalogId varchar(30) NOT NULL,
+    urlSlug varchar(512) NOT NULL,
+    createTime DATETIME DEFAULT CURRENT_TIMESTAMP,
+    version int NOT NULL DEFAULT 0
+);
+CREATE TABLE contributors (
+    festivalId int NOT NULL REFERENCES sessions(festivalId) ON DELETE CASCADE,
+    userId varchar(30) NOT NULL,
+    ready boolean DEFAULT 0 NOT NULL,
+    hotness decimal(4,3),
+    danceability decimal(4,3),
+    energy decimal(4,3),
+    variety decimal(4,3),
+    adventurousness decimal(4,3),
+    organizer boolean DEFAULT 0 NOT NULL,
+    CONSTRAINT festival_user UNIQUE (festivalId, userId)
+);
+CREATE TABLE festival_stats (
+    festivalId int NOT NULL PRIMARY KEY
+        REFERENCES sessions(festivalId) ON DELETE CASCADE,
+    contributors int NOT NULL DEFAULT 0,
+    ready int NOT NULL DEFAULT 0,
+    rated int NOT NULL DEFAULT 0,
+    hotness decimal(12,3) NOT NULL DEFAULT 0,
+    danceability decimal(12,3) NOT NULL DEFAULT 0,
+    energy decimal(12,3) NOT NULL DEFAULT 0,
+    variety decimal(12,3) NOT NULL DEFAULT 0,
+    adventurousness decimal(12,3) NOT NULL DEFAULT 0
+);
+CREATE TABLE artists (
+    artistId INTEGER PRIMARY KEY AUTOINCREMENT,
+    name varchar(1024) NOT NULL,
+    nameHash char(32) NOT NULL UNIQUE
+);
+CREATE TABLE preferences (
+    urlSlug varchar(64) NOT NULL,
+    userId varchar(30) NOT NULL,
+    artistId int NOT NULL REFERENCES artists(artistId),
+    PRIMARY KEY (urlSlug, userId, artistId)
+);
+CREATE INDEX preferences_userId ON preferences (userId);
+CREATE UNIQUE INDEX sessions_urlSlug ON sessions (urlSlug);
+CREATE INDEX sessions_createTime ON sessions (createTime);
+CREATE INDEX contributors_userId ON contributors (userId);
+'''
+
+
+class CountingCursor(object):
+    ''' Translates the MySQL paramstyle to sqlite's and records queries.'''
+
+    def __init__(self, cursor, recorder):
+        self.cursor = cursor
+        self.recorder = recorder
+
+    def _translate(self, query):
+        # sqlite locks the whole database on write, no row locks needed
+        return (query.replace('%s', '?').replace(' FOR UPDATE', '')
+                .replace('INSERT IGNORE', 'INSERT OR IGNORE'))
+
+    def execute(self, query, args=None):
+        query = self._translate(query)
+        with self.recorder.call('db.query'):
+            return self.cursor.execute(query, args or ())
+
+    def executemany(self, query, args):
+        query = self._translate(query)
+        with self.recorder.call('db.query'):
+            return self.cursor.executemany(query, args)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class SQLiteConnection(object):
+    def __init__(self, path, recorder):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.recorder = recorder
+
+    def cursor(self):
+        return CountingCursor(self.connection.cursor(), self.recorder)
+
+    def ping(self, reconnect=True):
+        return True
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+
+class SQLiteMySQL(object):
+    ''' Flask-MySQL stand-in handing out connections to a temporary
+    sqlite database created with the spotifest schema.'''
+
+    def __init__(self, recorder, schema=SCHEMA):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.recorder = recorder
+        connection = sqlite3.connect(self.path)
+        connection.executescript(schema)
+        connection.close()
+
+    def connect(self):
+        with self.recorder.call('db.connect'):
+            return SQLiteConnection(self.path, self.recorder)
+
+    def close(self):
+        os.remove(self.path)
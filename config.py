@@ -16,6 +16,15 @@ SECRET_KEY = 'this_is_a_secret'
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 CELERY_TASK_RESULT_EXPIRES = 3600
+# task messages carry user IDs, artist names and (title, artist) pairs
+# only, never spotipy clients or pyechonest objects
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_SERIALIZER = 'json'
+CELERY_ACCEPT_CONTENT = ['json']
+# one in TASK_PAYLOAD_SAMPLE_EVERY task messages is measured; those larger
+# than TASK_PAYLOAD_WARN_BYTES are logged (see library.task_payloads)
+TASK_PAYLOAD_WARN_BYTES = 64 * 1024
+TASK_PAYLOAD_SAMPLE_EVERY = 10
 CELERYBEAT_SCHEDULE = {
     'add-every-hour': {
         'task': 'routine_deletion_expired',
@@ -23,6 +32,77 @@ CELERYBEAT_SCHEDULE = {
     },
 }
 IS_ASYNC = True
+# longest a web request waits on background work before going on with
+# the partial result
+ASYNC_REQUEST_TIMEOUT = 10
+# longest a harvest of a user's artists is waited for in the background;
+# reloading the festival page doesn't start another one meanwhile
+HARVEST_TIMEOUT = 300
+# longest a playlist job waits for the festival's catalog updates to land
+# before seeding from the catalog as it is
+CATALOG_SEED_TIMEOUT = 60
+
+# festivals are deleted this many hours after creation, in batches
+FESTIVAL_LIFETIME_HOURS = 48
+EXPIRY_BATCH_SIZE = 500
+CATALOG_DELETE_CONCURRENCY = 8
+
+# Application caches
+REDIS_URL = 'redis://localhost:6379/1'
+TRACK_CACHE_TTL = 7 * 24 * 3600
+TRACK_CACHE_NEGATIVE_TTL = 24 * 3600
+PLAYLIST_CACHE_TTL = 30 * 24 * 3600
+TRACK_FEATURES_TTL = 7 * 24 * 3600
+TRACK_FEATURES_CONCURRENCY = 8
+# names of the artists sent to each festival catalog, so that seeding a
+# playlist doesn't read the catalog back from Echonest
+CATALOG_ARTISTS_TTL = FESTIVAL_LIFETIME_HOURS * 3600
+
+# Spotify API request rates (requests/second and burst size), shared by
+# all web and celery workers through redis
+SPOTIFY_APP_RATE = 20
+SPOTIFY_APP_BURST = 40
+SPOTIFY_USER_RATE = 5
+SPOTIFY_USER_BURST = 10
+SPOTIFY_MAX_RETRIES = 5
+# seconds before a Spotify request times out, and longest a request waits
+# for the rate limiter before failing
+SPOTIFY_REQUEST_TIMEOUT = 10
+SPOTIFY_MAX_WAIT = 30
+
+# OAuth access tokens are refreshed this many seconds before they expire;
+# concurrent refreshes of a user's token wait for the first one
+TOKEN_REFRESH_MARGIN = 300
+TOKEN_REFRESH_LOCK_TIMEOUT = 10
+TOKEN_REFRESH_TIMEOUT = 10
+# tokens that weren't refreshed for this long (their users left) are
+# dropped from the shared token store
+TOKEN_STORE_TTL = 7 * 24 * 3600
+
+# background playlist generation
+PLAYLIST_JOB_TTL = 3600
+PLAYLIST_JOB_CHUNK_SIZE = 10
+
+# artist preferences of users per festival: 'redis' (shared by all workers),
+# 'lru' (in-process, single node only) or 'mysql' (persistent, artists
+# interned in the artists table; needs schema migrations 4 to 6)
+USER_CACHE_BACKEND = 'redis'
+USER_CACHE_TTL = 48 * 3600
+USER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# artist names each process keeps of the dictionary shared by the 'redis'
+# and 'mysql' backends ('lru' counts its own names in USER_CACHE_MAX_BYTES)
+USER_CACHE_DICTIONARY_SIZE = 100000
+
+# max. concurrent page requests per paginated Spotify endpoint
+SPOTIFY_PAGE_CONCURRENCY = 8
+
+# new festivals harvest the organizer's artists in streaming mode: the page
+# renders once STREAM_FIRST_ARTISTS are seeded into the festival catalog,
+# the rest of the harvest carries on in the background
+STREAM_PREFERENCES = True
+STREAM_FIRST_ARTISTS = 10
+# artists seeded into a festival catalog (streamed or sampled)
+CATALOG_SEED_ARTISTS = 15
 
 
 class BaseConfig(object):
@@ -49,5 +129,39 @@ MYSQL_DATABASE_USER = 'root'
 MYSQL_DATABASE_DB = 'spotifest'
 MYSQL_DATABASE_HOST = 'localhost'
 MYSQL_DATABASE_PASSWORD = BaseConfig.MYSQL_PASSWORD
+# artist names may hold 4-byte UTF-8 (emoji, rarer CJK): see migration 6
+MYSQL_DATABASE_CHARSET = 'utf8mb4'
+
+# connection pool (per process: each gunicorn/celery worker has its own)
+MYSQL_POOL_SIZE = 10
+MYSQL_POOL_TIMEOUT = 5
+MYSQL_POOL_IDLE_CHECK = 30
+
+# local artist index behind the festival search box: seeded with the
+# suggested artists (and ARTIST_SEED_FILE, one name per line, if set),
+# grown with every harvested artist up to ARTIST_INDEX_MAX_NAMES names;
+# workers pick up each other's additions every ARTIST_INDEX_REFRESH seconds
+ARTIST_SEED_FILE = None
+ARTIST_INDEX_REFRESH = 30
+ARTIST_INDEX_MAX_NAMES = 200000
+ARTIST_SEARCH_LIMIT = 10
+
+# alias-table samplers over the contributors' merged artists, per festival
+FESTIVAL_SAMPLER_CACHE_SIZE = 256
+# artists shared by the most contributors always seeded into the catalog
+CATALOG_COMMON_GROUND = 5
+# festival page panels rendered once per festival / preference version
+FRAGMENT_CACHE_TTL = 3600
 
+# /metrics: every process flushes its counters and histograms to redis at
+# most every METRICS_FLUSH_INTERVAL seconds; broker queues whose length is
+# reported
+METRICS_FLUSH_INTERVAL = 10
+METRICS_CELERY_QUEUES = ['celery']
 
+# app log (APP_LOG_PATH): records below LOG_LEVEL are not even created,
+# records of the levels in LOG_SAMPLE_EVERY are kept one in N per call
+# site; at most LOG_QUEUE_SIZE records wait for the background writer
+LOG_LEVEL = 'INFO'
+LOG_SAMPLE_EVERY = {'DEBUG': 10}
+LOG_QUEUE_SIZE = 10000
@@ -6,6 +6,8 @@ import logging
 from flask import Flask
 from flask.ext.login import LoginManager
 from flask.ext.mysql import MySQL
+from .pool import ConnectionPool
+from .logs import BackgroundHandler, SamplingFilter
 import os
 import sys
 
@@ -27,16 +29,23 @@ if not app.debug is True:
     if not file_loc:
         raise IOError("Please specify path for app_error.logs")
     file_handler = logging.FileHandler(file_loc)
-    file_handler.setLevel(logging.INFO)
     formatter = logging.Formatter('%(asctime)s -- %(levelname)s'
                                   '< line %(lineno)d %(module)s.%(funcName)s >: %(message)s')
     file_handler.setFormatter(formatter)
-    app.logger.addHandler(file_handler)
+    # formatted and written by a background thread (see logs.py)
+    log_handler = BackgroundHandler([file_handler],
+                                    capacity=app.config['LOG_QUEUE_SIZE'])
+    log_handler.addFilter(SamplingFilter(app.config['LOG_SAMPLE_EVERY']))
+    app.logger.addHandler(log_handler)
+    app.logger.setLevel(app.config['LOG_LEVEL'])
 
 # celery setup
 celery = celery.Celery(app.name, broker=app.config['CELERY_BROKER_URL'])
 celery.conf.update(app.config)
 
+# redis setup (application caches, separate db from the celery broker)
+redis_store = redis.StrictRedis.from_url(app.config['REDIS_URL'])
+
 # flask-login setup
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -44,5 +53,14 @@ login_manager.init_app(app)
 # mysql setup
 mysql = MySQL()
 mysql.init_app(app)
+# flask-mysql connects to the database before every request; all queries
+# go through db_pool instead, so its per-request connection is dropped.
+app.before_request_funcs[None].remove(mysql.before_request)
+app.teardown_request_funcs[None].remove(mysql.teardown_request)
+db_pool = ConnectionPool(mysql, size=app.config['MYSQL_POOL_SIZE'],
+                         timeout=app.config['MYSQL_POOL_TIMEOUT'],
+                         idle_check=app.config['MYSQL_POOL_IDLE_CHECK'])
 
+from . import metrics
+from . import task_payloads
 from . import auth
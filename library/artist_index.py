@@ -0,0 +1,234 @@
+import os
+import re
+import math
+import time
+import bisect
+import logging
+import eventlet
+import threading
+import unicodedata
+
+from collections import defaultdict
+from redis import RedisError
+
+
+logger = logging.getLogger('library')
+
+
+def normalize(name):
+    ''' Lowercases name and strips its accents and punctuation:
+    u"Sigur R\xf3s!" -> u"sigur ros".'''
+    if not isinstance(name, unicode):
+        name = name.decode('utf-8', 'ignore')
+    name = unicodedata.normalize('NFKD', name.lower())
+    name = u''.join(c for c in name if not unicodedata.combining(c))
+    return u' '.join(re.findall(r'\w+', name, re.UNICODE))
+
+
+def read_seed_list(path):
+    ''' Artist names from a text file, one per line.'''
+    with open(path) as f:
+        return [line.strip().decode('utf-8') for line in f if line.strip()]
+
+
+# Appends ARGV (names) to the shared sorted set KEYS[1], scored by a
+# sequence number taken from KEYS[2] in the same step, so that readers
+# going by score never miss names written concurrently; keeps the newest
+# `limit` names only. ARGV: limit, then the names.
+SHARE_SCRIPT = '''
+local limit = tonumber(ARGV[1])
+local last = redis.call('INCRBY', KEYS[2], #ARGV - 1)
+for i = 2, #ARGV do
+    redis.call('ZADD', KEYS[1], last - #ARGV + i, ARGV[i])
+end
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -limit - 1)
+return last
+'''
+
+
+def trigrams(key):
+    padded = u'  {} '.format(key)
+    return frozenset(padded[i:i + 3] for i in xrange(len(padded) - 2))
+
+
+class ArtistIndex(object):
+    '''
+    In-memory index of artist names for search as you type:
+
+        - prefix matches on the whole name or on any of its words
+          ("beat" finds "The Beatles"), through a sorted list of keys
+        - typo tolerant matches ("radiohaed" finds "Radiohead"), scored by
+          the Jaccard similarity of the query's and the names' trigrams
+
+    Names are added incrementally with add(...), up to `max_names` of
+    them. They are also appended to a redis sorted set shared by every web
+    and celery worker, scored by the order they were added in; a green
+    thread of each searching process reads the names added elsewhere
+    since its last look, every `refresh` seconds and `batch` names at a
+    time. The shared set keeps the newest `max_names` names.
+    '''
+
+    def __init__(self, store=None, key='artists:indexed', refresh=30,
+                 max_names=200000, batch=5000, min_similarity=0.35):
+        self.store = store
+        self.key = key
+        self.refresh = refresh
+        self.max_names = max_names
+        self.batch = batch
+        self.min_similarity = min_similarity
+        self.names = []          # display names, by artist number
+        self.known = set()       # display names, to skip them quickly
+        self.numbers = {}        # normalized name -> artist number
+        self.grams = []          # trigrams, by artist number
+        self.keys = []           # sorted (key, artist number, whole name?)
+        self.postings = defaultdict(list)
+        self._lock = threading.Lock()
+        self._script = None
+        self._script_store = None
+        self._read = 0           # score of the last shared name read
+        self._pid = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, names, share=True):
+        ''' Adds names to the index (and to the shared set, with share).
+        Returns the number of names that were new. Once the index holds
+        max_names names, new ones are left out.'''
+        added = []
+        with self._lock:
+            keys = []
+            for name in names:
+                if name in self.known:
+                    continue
+                if len(self.names) >= self.max_names:
+                    break
+                self.known.add(name)
+                normalized = normalize(name)
+                if not normalized or normalized in self.numbers:
+                    continue
+                number = len(self.names)
+                self.numbers[normalized] = number
+                self.names.append(name)
+                grams = trigrams(normalized)
+                self.grams.append(grams)
+                for gram in grams:
+                    self.postings[gram].append(number)
+                words = normalized.split(u' ')
+                keys.append((normalized, number, True))
+                keys.extend((u' '.join(words[i:]), number, False)
+                            for i in xrange(1, len(words)))
+                added.append(name)
+            if len(keys) > len(self.keys) // 10:
+                self.keys.extend(keys)
+                self.keys.sort()
+            else:
+                for key in keys:
+                    bisect.insort(self.keys, key)
+        if share and added and self.store is not None:
+            self._share(added)
+        return len(added)
+
+    def _share(self, names):
+        if self._script_store is not self.store:
+            self._script = self.store.register_script(SHARE_SCRIPT)
+            self._script_store = self.store
+        try:
+            self._script(keys=[self.key, self.key + ':seq'],
+                         args=[self.max_names] + [
+                             n.encode('utf-8') if isinstance(n, unicode) else n
+                             for n in names])
+        except RedisError:
+            logger.warning("Artist index store unavailable, %d names not "
+                           "shared.", len(names))
+
+    def sync(self):
+        ''' Loads the names added to the shared set since the last sync,
+        `batch` at a time. Returns the number of names read.'''
+        if self.store is None:
+            return 0
+        read = 0
+        while True:
+            try:
+                rows = self.store.zrangebyscore(
+                    self.key, '({}'.format(self._read), '+inf',
+                    start=0, num=self.batch, withscores=True)
+            except RedisError:
+                logger.warning("Artist index store unavailable, not synced.")
+                return read
+            if not rows:
+                return read
+            self._read = int(rows[-1][1])
+            self.add([name.decode('utf-8') for name, _ in rows], share=False)
+            read += len(rows)
+            if len(rows) < self.batch:
+                return read
+            # let requests through between batches
+            eventlet.sleep(0)
+
+    def _refresh(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error("Artist index sync failed: %s", e)
+            time.sleep(self.refresh)
+
+    def start(self):
+        ''' Starts syncing in a green thread of this process, unless it
+        already is.'''
+        if self._pid != os.getpid() and self.store is not None:
+            self._pid = os.getpid()
+            eventlet.spawn_n(self._refresh)
+
+    def prefix(self, query, limit=10):
+        ''' Names with a word starting with query, whole name matches
+        first, shorter names first.'''
+        key = normalize(query)
+        if not key:
+            return []
+        found = {}
+        for i in xrange(bisect.bisect_left(self.keys, (key,)), len(self.keys)):
+            indexed, number, whole = self.keys[i]
+            if not indexed.startswith(key):
+                break
+            if whole or number not in found:
+                found[number] = whole
+            if len(found) >= limit * 5:
+                break
+        ranked = sorted(found, key=lambda n: (not found[n], len(self.names[n]),
+                                              self.names[n]))
+        return [self.names[n] for n in ranked[:limit]]
+
+    def fuzzy(self, query, limit=10):
+        ''' Names whose trigrams are most similar to the query's.'''
+        key = normalize(query)
+        if len(key) < 3:
+            return []
+        grams = trigrams(key)
+        # a name as similar as min_similarity shares at least `needed` of
+        # the query's trigrams, so it is in one of the rarest
+        # len(grams) - needed + 1 postings: only those are read
+        needed = int(math.ceil(self.min_similarity * len(grams)))
+        rarest = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        candidates = set()
+        for posting in rarest[:len(grams) - needed + 1]:
+            candidates.update(posting)
+        scored = []
+        for number in candidates:
+            shared = len(grams & self.grams[number])
+            similarity = float(shared) / (len(grams) + len(self.grams[number]) - shared)
+            if similarity >= self.min_similarity:
+                scored.append((-similarity, len(self.names[number]), number))
+        scored.sort()
+        return [self.names[number] for _, _, number in scored[:limit]]
+
+    def search(self, query, limit=10):
+        ''' Prefix matches, topped up with fuzzy matches.'''
+        self.start()
+        results = self.prefix(query, limit)
+        if len(results) < limit:
+            seen = set(results)
+            results.extend(name for name in self.fuzzy(query, limit)
+                           if name not in seen)
+        return results[:limit]
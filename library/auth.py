@@ -1,4 +1,10 @@
-from . import app, celery, login_manager
+from . import app, celery, login_manager, redis_store, db_pool
+from .cache_backends import preference_backend
+from .sampler import FestivalSamplers
+from .spotify_client import spotify_client, user_client
+from .tokens import token_manager
+from .metrics import metrics
+from .fragments import FragmentCache, template_revision
 from .helpers import (suggested_artists, random_catalog, seed_playlist)
 from . import frontend_helpers
 from config import BaseConfig
@@ -11,13 +17,17 @@ from flask import session, flash
 from flask.ext.login import login_user, logout_user, login_required, UserMixin
 from flask.ext.wtf import Form
 from flask import render_template, request, redirect, url_for, session, flash
+from flask import jsonify, abort, Response, make_response
+from redis import RedisError
 
+import time
+import hashlib
 import spotipy
 import spotipy.util as util
-import base64
 import requests
 import helpers
 import db
+import jobs
 
 
 def oauth_prep(config=None, scope=['user-library-read']):
@@ -39,24 +49,35 @@ oauth = oauth_prep(BaseConfig, scope)
 
 class User(UserMixin):
     ''' User class used by Flask-Login to manage/track user's within 
-    session cookie. Primary ID is the user's Spotify ID.'''
+    session cookie. Primary ID is the user's Spotify ID.
+
+    OAuth tokens are kept by the token manager, shared by every worker;
+    `access` always returns a token that is not about to expire.'''
 
     users = {}
 
-    def __init__(self, spotify_id, access_token, refresh_token, artists=set(),
-                 search_results=None):
+    def __init__(self, spotify_id, access_token=None, refresh_token=None,
+                 expires_in=3600, artists=set(), search_results=None):
         self.id = unicode(spotify_id)
-        self.access = access_token
-        self.refresh = refresh_token
+        if access_token:
+            token_manager.save(self.id, access_token, refresh_token, expires_in)
         self.users[self.id] = self
 
+    @property
+    def access(self):
+        return token_manager.access_token(self.id)
+
     @classmethod
     def get(cls, user_id):
-        if cls.users:
-            if user_id in cls.users:
-                return cls.users[user_id]
-        else:
+        if user_id is None:
             return None
+        user_id = unicode(user_id)
+        if user_id in cls.users:
+            return cls.users[user_id]
+        # logged in through another worker
+        if token_manager.get(user_id):
+            return cls(user_id)
+        return None
 
 
 @login_manager.user_loader
@@ -71,18 +92,24 @@ class UserCache():
     and festival search results. A temporary data structure that will be replaced
     in the future with a sturdier MySQL schema.
 
-    includes CRUD functions for storage of user preference's by festival. '''
+    includes CRUD functions for storage of user preference's by festival.
+    Preferences live in a pluggable backend (see cache_backends) chosen
+    by the USER_CACHE_BACKEND config key. Harvests still running are
+    marked in `store` (redis) for at most `harvest_timeout` seconds, so
+    that reloading a festival doesn't start another one. '''
     def __init__(self, artists=set(), hotness=None, danceability=None, enery=None,
                  energy=None, variety=None, adventurousness=None, organizer=0,
-                 search_results=list(), festival_name=None):
-        self.artists = {}
+                 festival_name=None, backend=None, store=None,
+                 harvest_timeout=300):
+        self.backend = backend
+        self.store = store
+        self.harvest_timeout = harvest_timeout
         self.hotness = hotness
         self.danceability = danceability
         self.energy = energy
         self.variety = variety
         self.adventurousness = adventurousness
         self.organizer = organizer
-        self.search_results = search_results
         self.festival_name = festival_name
         self.user_id = None
         self.user_festivals = None
@@ -93,35 +120,67 @@ class UserCache():
         if not isinstance(artists, set):
             raise TypeError('Artist data not a set object.')
         _current_user = str(session.get('user_id'))
-        if not self.artists.get(_current_user):
-            self.artists[_current_user] = {}
-        self.artists[_current_user][urlSlug] = artists
+        self.backend.set(_current_user, urlSlug, artists)
         return
 
     def retrieve_preferences(self, urlSlug):
         _current_user = str(session.get('user_id'))
-        if not self.artists.get(_current_user):
-            return None
-        elif not self.artists[_current_user].get(urlSlug):
-            return None
-        else:
-            return self.artists[_current_user][urlSlug]
+        return self.backend.get(_current_user, urlSlug) or None
 
     def update_preferences(self, artists, urlSlug):
         _current_user = str(session.get('user_id'))
         if not isinstance(artists, set):
             raise TypeError('Artist data not a set object.')
-        cur_preferences = self.artists[_current_user][urlSlug]
-        app.logger.warning("Update pref - length before...{}".format(len(cur_preferences)))
-        app.logger.warning("Update pref - {} about to be added to cur_preferences..".format(artists))
-        self.artists[_current_user][urlSlug] = cur_preferences | artists
-        app.logger.warning("Update pref -  length after...{}".format(
-                           len(self.artists[_current_user][urlSlug])))
+        app.logger.debug("Update pref - %d artists added to '%s' preferences "
+                         "of '%s'", len(artists), urlSlug, _current_user)
+        self.backend.add(_current_user, urlSlug, artists)
         return
 
+    def _harvest_key(self, user_id, urlSlug):
+        return 'harvest:{}:{}'.format(user_id, urlSlug)
+
+    def start_harvest(self, urlSlug):
+        ''' Marks a harvest of the current user's artists for urlSlug as in
+        flight. False if one already is.'''
+        _current_user = str(session.get('user_id'))
+        try:
+            return bool(self.store.set(self._harvest_key(_current_user, urlSlug),
+                                       1, ex=self.harvest_timeout, nx=True))
+        except RedisError:
+            return True
+
+    def _finish_harvest(self, user_id, urlSlug):
+        try:
+            self.store.delete(self._harvest_key(user_id, urlSlug))
+        except RedisError:
+            pass
+
+    def save_harvest(self, handle, urlSlug, timeout=None):
+        ''' Saves the artists of a preferences handle (see AsyncAdapter),
+        waiting for them at most `timeout` seconds; artists harvested after
+        that are added once the harvest is done, or given up on after
+        harvest_timeout seconds. The harvest's in flight mark (see
+        start_harvest) is cleared then. Returns the artists saved.'''
+        _current_user = str(session.get('user_id'))
+        artists = handle.get(timeout, partial=True)
+        if artists:
+            self.save_preferences(artists, urlSlug)
+        if handle.ready():
+            self._finish_harvest(_current_user, urlSlug)
+            return artists
+
+        def harvested(artists):
+            try:
+                if artists:
+                    self.backend.add(_current_user, urlSlug, artists)
+            finally:
+                self._finish_harvest(_current_user, urlSlug)
+        handle.on_done(harvested, timeout=self.harvest_timeout)
+        return artists
+
     def delete_preferences(self):
         _current_user = str(session.get('user_id'))
-        del self.artists[_current_user]
+        self.backend.delete(_current_user)
         return
 
 
@@ -130,43 +189,46 @@ def spotifest_logout():
     logout_user function. User preferences are deleted from user_cache.'''
     if load_user(session.get('user_id')):
         user_cache.delete_preferences()
+        token_manager.delete(session.get('user_id'))
+        User.users.pop(session.get('user_id'), None)
     logout_user()
     return
 
-user_cache = UserCache()
+user_cache = UserCache(backend=preference_backend(app.config, redis_store,
+                                                  db_pool),
+                       store=redis_store,
+                       harvest_timeout=app.config['HARVEST_TIMEOUT'])
+festival_samplers = FestivalSamplers(user_cache.backend,
+                                     size=app.config['FESTIVAL_SAMPLER_CACHE_SIZE'])
+fragment_cache = FragmentCache(redis_store, ttl=app.config['FRAGMENT_CACHE_TTL'])
+festival_revision = template_revision(app, 'base.html', 'festival.html',
+                                      'festival_contributors.html',
+                                      'festival_parameters.html')
 
 
 @login_manager.needs_refresh_handler
 def refresh():
-    ''' Manages exchange of refresh_token for a new access_token, if
-    a user is logged in, allowing user to stay logged in for a long time.
+    ''' Makes sure the logged in user has a valid access_token, exchanging
+    their refresh_token for a new one if it is about to expire, allowing
+    user to stay logged in for a long time.
     '''
     current_user = load_user(session.get('user_id'))
-    if current_user:
-        re_auth_in = BaseConfig.CLIENT_ID + ':' + BaseConfig.CLIENT_SECRET
-        re_auth = base64.b64encode(re_auth_in)
-        headers = {'Authorization': 'Basic {}'.format(str(re_auth))}
-        payload = {'grant_type': 'refresh_token',
-                   'refresh_token': current_user.refresh}
-        r = requests.post(oauth.OAUTH_TOKEN_URL, data=payload, headers=headers)
-        new_access = r.json()['access_token']
-        current_user.access = new_access
-        for u in User.users.values():
-            app.logger.warning(u.__dict__)
-            #app.logger.warning("Current user:{}, {}".format(u.id, u.access))
-    else:
+    if not current_user or not current_user.access:
         return redirect(url_for('home'))
     return
 
 
 @app.before_request
 def before_request():
-    ''' Attempts to refresh user OAuth login by exchanging refresh token
-    for new_access auth token. If login has gone stale, will simply logout. '''
-    refresh()
-    if session.get('user_id') and not load_user(session.get('user_id')):
-        app.logger.warning("Refresh Failed; User '{}' not found "
-                           "- possibly invalid token. Logging out".format(session.get('user_id')))
+    ''' Checks that the user's OAuth login is still valid. Access tokens are
+    only refreshed when about to expire (see tokens.TokenManager). If login
+    has gone stale, will simply logout. '''
+    if request.endpoint == 'static' or not session.get('user_id'):
+        return
+    current_user = load_user(session.get('user_id'))
+    if not current_user or not current_user.access:
+        app.logger.info("Refresh Failed; User '%s' not found - possibly "
+                        "invalid token. Logging out", session.get('user_id'))
         spotifest_logout()
     return
 
@@ -211,22 +273,23 @@ def home(config=BaseConfig):
                 # log user to session (Flask-Login)
                 response = oauth.get_access_token(request.args['code'])
                 token = response['access_token']
-                s = spotipy.Spotify(auth=token)
+                s = spotify_client(token)
                 user_id = s.me()['id']
-                new_user = User(user_id, token, response['refresh_token'])
+                new_user = User(user_id, token, response['refresh_token'],
+                                response.get('expires_in', 3600))
                 login_user(new_user)
-                app.logger.warning("NEW user login '{}'".format(new_user.id))
+                app.logger.info("NEW user login '%s'", new_user.id)
             # at this point, user is logged in, so if you click "Create"
 
             current_user = load_user(session.get('user_id')).access
-            s = spotipy.Spotify(auth=current_user)
+            s = spotify_client(current_user)
 
     user_cache.user_festivals = db.get_user_festivals(user_cache.user_id)
 
     if request.method == 'POST':
         url_slug = request.form['festival_id']
         url_slug = helpers.sanitize_url_slug(url_slug)
-        app.logger.warning("ATTEMPTING JOIN Festival ID/urlSlug is '{}'".format(url_slug))
+        app.logger.debug("ATTEMPTING JOIN Festival ID/urlSlug is '%s'", url_slug)
         return redirect(url_for('join', url_slug=url_slug))
     return render_template('home.html', login=True,
                             user_festivals=user_cache.user_festivals,
@@ -240,19 +303,19 @@ def join(url_slug):
     url_slug. If user is a contributor, this information is
     saved to dB.
     '''
-    current_festival = db.get_info_from_database(url_slug)
+    current_festival = db.load_festival(url_slug)
     if not current_festival:
         flash(("Festival '{}' does not exist! Please check"
                " the code and try again.").format(url_slug))
         return redirect(url_for('home'))
     organizer = current_festival[2]
     _user = session.get('user_id')
-    app.logger.warning("User '{}' is joining festival '{}'".format(_user, url_slug))
+    app.logger.info("User '%s' is joining festival '%s'", _user, url_slug)
     if organizer != _user:
         try:
             db.save_contributor(current_festival[0], _user)
         except:
-            app.logger.warning("Contributor {} is already in the database.".format(_user))
+            app.logger.debug("Contributor '%s' is already in the database.", _user)
     else:
         flash("Welcome back to your own festival!")
     return redirect(url_for('festival', url_slug=url_slug))
@@ -268,19 +331,28 @@ def new():
     current_user = load_user(session.get('user_id'))
     new_url_slug = helpers.generate_urlslug(current_user.id)
     new_catalog = helpers.Catalog(new_url_slug, 'general')
-    s = spotipy.Spotify(auth=current_user.access)
-
-    processor = helpers.AsyncAdapter(app)
-    user_cache.save_preferences(processor.get_user_preferences(s), new_url_slug)
-    artists = user_cache.retrieve_preferences(new_url_slug)
-
-    if user_cache.retrieve_preferences(new_url_slug):
-        processor.populate_catalog(artists, 3, catalog=new_catalog)
+    s = user_client(current_user.id)
+
+    if app.config['STREAM_PREFERENCES']:
+        _user = str(current_user.id)
+        helpers.stream_preferences(
+            s, new_catalog,
+            lambda batch: user_cache.backend.add(_user, new_url_slug, batch),
+            first=app.config['STREAM_FIRST_ARTISTS'],
+            budget=app.config['CATALOG_SEED_ARTISTS'])
+    else:
+        processor = helpers.AsyncAdapter(app)
+        artists = user_cache.save_harvest(processor.get_user_preferences(s),
+                                          new_url_slug,
+                                          app.config['ASYNC_REQUEST_TIMEOUT'])
+        if artists:
+            helpers.catalog_seeding.add(new_url_slug, processor.populate_catalog(
+                artists, app.config['CATALOG_SEED_ARTISTS'], catalog=new_catalog))
 
     db.save_to_database(None, current_user.id, None, None,
                         new_catalog.id, new_url_slug)
 
-    current_festival = db.get_info_from_database(new_url_slug)
+    current_festival = db.load_festival(new_url_slug)
     festivalId = current_festival[0]
     userId = current_festival[2]
     if app.config['IS_ASYNC']:
@@ -288,10 +360,47 @@ def new():
                                         kwargs={'organizer': 1, 'ready': 1})
     else:
         db.save_contributor(festivalId, userId, organizer=1, ready=1)
-    app.logger.warning("NEW festival created at '{}'".format(new_url_slug))
+    app.logger.info("NEW festival created at '%s'", new_url_slug)
     return redirect(url_for('festival', url_slug=new_url_slug))
 
 
+def festival_versions(festival, user_id, current=False):
+    ''' Versions of what the festival page shows user_id: the templates,
+    the festival (db.Festival.version) and its contributors' artists. None
+    if the preference backend can't tell (the page is then not cached).
+    A backend bumping the festival's version with its changes is not
+    asked, unless `current`: changes since festival was loaded count.'''
+    backend = user_cache.backend
+    if backend.bumps_festival_version and not current:
+        preferences = festival.version
+    else:
+        try:
+            preferences = backend.version(festival.urlSlug)
+        except Exception as e:
+            app.logger.warning("Preference version of '%s' unavailable: %s",
+                               festival.urlSlug, e)
+            return None
+    version = preferences if backend.bumps_festival_version else festival.version
+    return (festival_revision, festival.urlSlug, version, preferences, user_id)
+
+
+def festival_etag(versions):
+    ''' ETag of the festival page at versions (see festival_versions). It
+    also changes with the session's CSRF secret, and before the CSRF
+    tokens of a page the browser holds expire.'''
+    limit = app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    window = int(time.time() // (limit / 2)) if limit else 0
+    return hashlib.md5(repr(versions + (session.get('csrf_token'), window))).hexdigest()
+
+
+def revalidated(response, etag):
+    ''' Lets browsers keep the page, as long as they check its etag.'''
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
 @app.route('/festival/<url_slug>', methods=['GET', 'POST'])
 @login_required
 def festival(url_slug):
@@ -301,17 +410,23 @@ def festival(url_slug):
      - retrieve artist preferences of current user from dB or cache
      - prepares page forms that populate page
     '''
-    current_festival = db.get_info_from_database(url_slug)
-    user_cache.cur_festival_id = current_festival[0]
+    current_festival = db.load_festival(url_slug)
     if not current_festival:
         flash(("Festival '{}' does not exist! Please check"
                "the code and try again.").format(url_slug))
         return redirect(url_for('home'))
+    user_cache.cur_festival_id = current_festival[0]
 
     organizer = current_festival[2]
     _user = session.get('user_id')
-    app.logger.warning("User '{}' accessing festival '{}'".format(_user,
-                                                                   url_slug))
+    # the browser's copy is current: no harvest, no forms, no render
+    if request.method == 'GET' and not session.get('_flashes'):
+        versions = festival_versions(current_festival, _user)
+        if versions is not None:
+            etag = festival_etag(versions)
+            if request.if_none_match.contains(etag):
+                return revalidated(app.response_class(status=304), etag)
+    app.logger.debug("User '%s' accessing festival '%s'", _user, url_slug)
     is_org = True
     # check if organizer & if so, find name
     if organizer != _user:
@@ -325,48 +440,46 @@ def festival(url_slug):
         festival_name = None
     # fetch contributors: the 0th term = the main organizer!
     try:
-        all_users = db.get_contributors(current_festival[0])
-        app.logger.warning("All users in this festival -- '{}'".format(all_users))
+        all_users = current_festival.all_users()
         if all_users is None:
             flash(("Festival '{}' is having problems. Please check with the "
                    "organizer. Try again later or create a new festival!").format(url_slug))
             return redirect(url_for('home'))
     except:
-        app.logger.warning("Couldn't find contributors - check DB functions or app code.")
+        app.logger.error("Couldn't find contributors - check DB functions or app code.")
         flash(("Festival '{}' is having problems. Please check with the "
                "organizer. Try again later or create a new festival!.").format(url_slug))
         return redirect(url_for('home'))
 
     new = None
     new_artist = None
+    search_results = list()
 
-    current_user = load_user(session.get('user_id')).access
-    s = spotipy.Spotify(auth=current_user)
+    s = user_client(_user)
     try:
         if not user_cache.retrieve_preferences(url_slug):
-            processor = helpers.AsyncAdapter(app)
-            artists = processor.get_user_preferences(s)
-            user_cache.save_preferences(artists, url_slug)
+            # unless an earlier visit's harvest is still running
+            if user_cache.start_harvest(url_slug):
+                processor = helpers.AsyncAdapter(app)
+                user_cache.save_harvest(processor.get_user_preferences(s),
+                                        url_slug,
+                                        app.config['ASYNC_REQUEST_TIMEOUT'])
         else:
-            app.logger.warning("Current # of artists for "
-                               "user '{}' - '{}'".format(_user, len(user_cache.retrieve_preferences(url_slug))))
+            app.logger.debug("Current # of artists for user '%s' - %d", _user,
+                             len(user_cache.retrieve_preferences(url_slug)))
     except:
-        app.logger.warning("No artists followed found in the user's Spotify account.")
+        app.logger.info("No artists followed found in the user's Spotify account.")
 
     # prep forms
     searchform = frontend_helpers.SearchForm()
     suggested_pl_butt = frontend_helpers.SuggestedPlaylistButton()
     art_select = frontend_helpers.ArtistSelect(request.form)
-    params_form = frontend_helpers.ParamsForm()
-
-    saved_params = db.get_parameters(_user, url_slug)
-    frontend_helpers.populate_params(params_form, saved_params)
 
     if searchform.validate_on_submit():
         s_artist = searchform.artist_search.data
-        user_cache.search_results = helpers.search_artist_echonest(s_artist)
-        art_select.artist_display.choices = user_cache.search_results
-        app.logger.warning("Search results '{}'".format(user_cache.search_results))
+        search_results = helpers.search_artists(s_artist)
+        art_select.artist_display.choices = search_results
+        app.logger.debug("Search results %s", search_results)
 
     if request.form.get("selectartist"):
         chosen_art = request.form.get("selectartist")
@@ -374,29 +487,64 @@ def festival(url_slug):
         new_artist = chosen_art
 
         if not cur_user_preferences or chosen_art not in cur_user_preferences:
-            app.logger.warning("Adding chosen artist.. {}".format(chosen_art))
+            app.logger.debug("Adding chosen artist.. %s", chosen_art)
             user_cache.update_preferences(set([chosen_art]), url_slug)
             new_artist = chosen_art
             new = 1
         else:
             new = 0
-        user_cache.search_results = list()
 
     if suggested_pl_butt.validate_on_submit():
         if request.form.get("add_button"):
             user_cache.update_preferences(helpers.suggested_artists, url_slug)
             new = True
 
-    return render_template('festival.html', url_slug=url_slug,
-                           s_results=user_cache.search_results,
-                           art_select=art_select, searchform=searchform,
-                           suggested_pl_butt=suggested_pl_butt,
-                           artists=user_cache.artists,
-                           params_form=params_form,
-                           all_users=all_users,
-                           festival_name=festival_name,
-                           user=_user,
-                           new=new, new_artist=new_artist, is_org=is_org)
+    def contributors_context():
+        overlap = festival_samplers.overlap(
+            url_slug, [c.userId for c in current_festival.contributors])
+        return dict(all_users=all_users,
+                    common_ground=overlap.common_ground(10),
+                    taste_match=overlap.similarity(_user))
+
+    def parameters_context():
+        params_form = frontend_helpers.ParamsForm()
+        frontend_helpers.populate_params(params_form,
+                                         current_festival.parameters(_user))
+        return dict(all_users=all_users, params_form=params_form,
+                    festival_name=festival_name, url_slug=url_slug,
+                    user=_user, is_org=is_org)
+
+    # read after this request's changes to the preferences
+    versions = festival_versions(current_festival, _user, current=True)
+    if versions is not None:
+        key = hashlib.md5(repr(versions)).hexdigest()
+        contributors_panel = fragment_cache.render(
+            'festival:contributors:' + key, 'festival_contributors.html',
+            contributors_context)
+        # not shown preferences: cached across their changes
+        key = hashlib.md5(repr(versions[:3] + versions[4:])).hexdigest()
+        parameters_panel = fragment_cache.render(
+            'festival:parameters:' + key, 'festival_parameters.html',
+            parameters_context)
+    else:
+        contributors_panel = render_template('festival_contributors.html',
+                                             **contributors_context())
+        parameters_panel = render_template('festival_parameters.html',
+                                           **parameters_context())
+
+    # a page showing flash messages must not be kept
+    flashes = session.get('_flashes')
+    artists = user_cache.retrieve_preferences(url_slug)
+    response = make_response(render_template(
+        'festival.html', url_slug=url_slug, s_results=search_results,
+        contributors_panel=contributors_panel,
+        parameters_panel=parameters_panel, art_select=art_select,
+        searchform=searchform, suggested_pl_butt=suggested_pl_butt,
+        artists=artists, new=new, new_artist=new_artist))
+    # until the user has artists, every visit retries the harvest
+    if request.method == 'GET' and versions is not None and artists and not flashes:
+        revalidated(response, festival_etag(versions))
+    return response
 
 
 @app.route('/festival/<url_slug>/update_parameters', methods=['POST'])
@@ -407,15 +555,13 @@ def update_parameters(url_slug):
     Used by contributors after 'proposing vision'.
     '''
     _user = session.get('user_id')
-    current_festival = db.get_info_from_database(url_slug)
+    current_festival = db.load_festival(url_slug)
     festivalId = current_festival[0]
+    festival_org = current_festival[2]
     catalog_id = current_festival[5]
     catalog = helpers.Catalog(catalog_id)
     artists = user_cache.retrieve_preferences(url_slug)
 
-    get_festival = db.get_info_from_database(url_slug)
-    festivalId = get_festival[0]
-    festival_org = get_festival[2]
     h = request.form.get('hotttnesss')
     d = request.form.get('danceability')
     e = request.form.get('energy')
@@ -427,15 +573,22 @@ def update_parameters(url_slug):
     db.update_parameters(festivalId, _user, h, d, e, v, a)
 
     if artists:
+        # the catalog is seeded with the contributors' common ground, then
+        # from every contributor's artists, weighted by how many share them
+        contributors = [c.userId for c in current_festival.contributors]
+        overlap = festival_samplers.overlap(url_slug, contributors)
         processor = helpers.AsyncAdapter(app)
-        processor.populate_catalog(artists, 3, catalog=catalog)
+        helpers.catalog_seeding.add(url_slug, processor.populate_catalog(
+            artists, app.config['CATALOG_SEED_ARTISTS'], catalog=catalog,
+            sampler=festival_samplers.get(url_slug, contributors),
+            common=overlap.common_ground(app.config['CATALOG_COMMON_GROUND'])))
         flash_message = ("You've pitched the perfect festival to the organizer." +
                          " Now we wait.")
     else:
         flash_message = "You haven't contributed artists, but your style is pitched!"
     flash(flash_message)
-    app.logger.warning("VISION PROPOSED - '{}'' has saved"
-                       " parameters at festival '{}'".format(_user, festivalId))
+    app.logger.info("VISION PROPOSED - '%s' has saved parameters at "
+                    "festival '%s'", _user, festivalId)
     return redirect(url_for('festival', url_slug=url_slug))
 
 
@@ -443,33 +596,42 @@ def update_parameters(url_slug):
 def results(url_slug):
     ''' Based on all inputs (parameters, artist preferences) from
     all contributors in a festival, a new playlist is processed and
-    generated - leading user to a page with the embeddable Spotify playlist
+    generated in the background - leading user to a page that follows the
+    job's progress and then embeds the Spotify playlist
     '''
-    current_festival = db.get_info_from_database(url_slug)
+    if request.method == 'GET':
+        job_id = request.args.get('job')
+        if not job_id:
+            return redirect(url_for('festival', url_slug=url_slug))
+        return render_template('results.html', enough_data=True,
+                               status_url=url_for('results_status',
+                                                  url_slug=url_slug,
+                                                  job_id=job_id))
+
+    current_festival = db.load_festival(url_slug)
     festival_catalog = current_festival[5]
 
     if request.method == 'POST':
         # Did user click on join festival ?
         try:
             if request.form['festival_id']:
-                app.logger.warning('User selected join (Why is this here?)')
+                app.logger.debug('User selected join (Why is this here?)')
                 auth_url = login()
-                app.logger.warning("Just 'logged' in by generating festival?")
+                app.logger.debug("Just 'logged' in by generating festival?")
                 user_cache.festival_id = request.form['festival_id']
                 return redirect(auth_url)
         except:
             if user_cache.festival_id is None:
-                app.logger.warning('User did not click on join and selected parameter')
+                app.logger.debug('User did not click on join and selected parameter')
             else:
-                app.logger.warning('User selected parameters')
+                app.logger.debug('User selected parameters')
 
-        if not user_cache.artists:
+        if not user_cache.retrieve_preferences(url_slug):
             flash("You really should add some artists!"
                   " Maybe you can use our suggestions..")
             return redirect(url_for('home'))
 
         # parameters
-        enough_data = True
         name = request.form.get('name')
         h = request.form.get('hotttnesss')
         d = request.form.get('danceability')
@@ -477,43 +639,57 @@ def results(url_slug):
         v = request.form.get('variety')
         a = request.form.get('adventurousness')
         user_cache.did_user_sel_parameters = True
-        current_user = load_user(session.get('user_id')).access
-        # db.update_parameters(festivalId, _user, h, d, e, v, a)
-        s = spotipy.Spotify(auth=current_user)
-        user_id = s.me()['id']
-
-        # db.get_average_parameters(user_cache.current_festival)
-        processor = helpers.AsyncAdapter(app)
-        playlist = helpers.seed_playlist(catalog=festival_catalog, hotttnesss=h,
-                                         danceability=d, energy=e, variety=v,
-                                         adventurousness=a)
-        songs_id = processor.process_spotify_ids(50, 10, s, playlist)
+        current_user = load_user(session.get('user_id'))
+        parameters = {'hotttnesss': h, 'danceability': d, 'energy': e,
+                      'variety': v, 'adventurousness': a}
+        # parameters left blank default to the contributors' average
+        averages = current_festival.stats and current_festival.stats.averages()
+        if averages:
+            for key, average in zip(('hotttnesss', 'danceability', 'energy',
+                                     'variety', 'adventurousness'), averages):
+                if parameters[key] in (None, ''):
+                    parameters[key] = average
+        id_playlist = playlist_url = None
 
         if user_cache.festival_id is not None and user_cache.did_user_sel_parameters:
-
-            festival_information = db.get_info_from_database(user_cache.festival_id)
+            festival_information = db.load_festival(user_cache.festival_id)
             playlist_url = festival_information[4]
             id_playlist = festival_information[3]
-            helpers.add_songs_to_playlist(s, user_id, id_playlist, songs_id)
-            return render_template('results.html', playlist_url=playlist_url,
-                                   enough_data=enough_data)
-        else:
-            helpers.create_playlist(s, user_id, name)
-            id_playlist = helpers.get_id_from_playlist(s, user_id, name)
-            helpers.add_songs_to_playlist(s, user_id, id_playlist, songs_id)
-            u_id = str(user_id)
-            id_pl = str(id_playlist)
-            playlist_url = ('https://embed.spotify.com/?uri=spotify:user:'
-                            '{}:playlist:{}'.format(u_id, id_pl))
-            if app.config['IS_ASYNC'] is True:
-                db.update_festival.apply_async(args=[name, url_slug, id_playlist,
-                                               playlist_url])
-            else:
-                db.update_festival(name, url_slug, id_playlist, playlist_url)
-            app.logger.warning("Playlist for festival '{}'"
-                               "successfully generated".format(user_cache.festival_id))
-            return render_template('results.html', playlist_url=playlist_url,
-                                   enough_data=enough_data)
+
+        job_id = jobs.start_playlist_job(url_slug, festival_catalog,
+                                         current_user.id, name, parameters,
+                                         id_playlist, playlist_url)
+        app.logger.info("Playlist job '%s' started for festival '%s'",
+                        job_id, url_slug)
+        return redirect(url_for('results', url_slug=url_slug, job=job_id))
+
+
+@app.route('/festival/<url_slug>/results/<job_id>', methods=['GET'])
+def results_status(url_slug, job_id):
+    ''' Reports the progress of a playlist generation job as JSON. Polled
+    by the results page.'''
+    job = jobs.progress.get(job_id)
+    if not job or job.get('url_slug') != url_slug:
+        abort(404)
+    return jsonify(job)
+
+
+@app.route('/artists/search', methods=['GET'])
+@login_required
+def artist_search():
+    ''' Artists matching the query `q` (as you type), as JSON. Only the
+    local artist index is searched unless `remote=1` is given.'''
+    query = request.args.get('q', '').strip()
+    remote = request.args.get('remote') == '1'
+    artists = helpers.search_artists(query, remote=remote) if query else []
+    return jsonify(query=query, artists=artists or [])
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    ''' Request, function and external call metrics of every worker, in
+    the Prometheus text format.'''
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/about')
@@ -0,0 +1,555 @@
+import sys
+import time
+import array
+import hashlib
+import threading
+import logging
+
+from collections import OrderedDict
+
+
+logger = logging.getLogger('library')
+
+
+def _unicode(name):
+    return name if isinstance(name, unicode) else name.decode('utf-8')
+
+
+class ArtistDictionary(object):
+    '''
+    Interns artist names as integer IDs, so artist sets can be kept as
+    arrays of ints and every name is held once. This one numbers the names
+    itself and is local to the process: the artist sets holding IDs
+    retain(...) and release(...) them, and a name no set holds anymore is
+    forgotten. `bytes` estimates the memory its names take: their size
+    plus `entry_bytes` for the dict entries of each.
+    '''
+
+    entry_bytes = 200
+
+    def __init__(self):
+        self._ids = {}
+        self._names = {}
+        self._refs = {}
+        self._next_id = 1
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _remember(self, artistId, name):
+        if name in self._ids:
+            return
+        self._ids[name] = artistId
+        self._names[artistId] = name
+        self.bytes += sys.getsizeof(name) + self.entry_bytes
+
+    def _forget(self, artistId):
+        name = self._names.pop(artistId, None)
+        if name is not None:
+            del self._ids[name]
+            self.bytes -= sys.getsizeof(name) + self.entry_bytes
+
+    def _intern(self, names):
+        ''' {name: ID} of names not known to the process.'''
+        interned = {}
+        for name in names:
+            interned[name] = self._next_id
+            self._next_id += 1
+        return interned
+
+    def _fetch(self, ids):
+        ''' {ID: name} of IDs not known to the process.'''
+        return {}
+
+    def _hit(self, artistId):
+        ''' Called for every ID found in the process.'''
+        pass
+
+    def ids(self, names):
+        ''' Sorted array of the IDs of names, interning the new ones.'''
+        found = {}
+        missing = []
+        for name in set(_unicode(name) for name in names):
+            if name in self._ids:
+                found[name] = self._ids[name]
+                self._hit(found[name])
+            else:
+                missing.append(name)
+        if missing:
+            interned = self._intern(missing)
+            for name, artistId in interned.iteritems():
+                self._remember(artistId, name)
+            found.update(interned)
+        return array.array('i', sorted(found.itervalues()))
+
+    def lookup(self, ids):
+        ''' Names of ids, in order (None for an unknown ID).'''
+        ids = [int(i) for i in ids]
+        found = {}
+        for i in ids:
+            if i in self._names:
+                found[i] = self._names[i]
+                self._hit(i)
+        missing = set(ids).difference(found)
+        if missing:
+            fetched = self._fetch(missing)
+            for artistId, name in fetched.iteritems():
+                self._remember(artistId, name)
+            found.update(fetched)
+        return [found.get(i) for i in ids]
+
+    def names(self, ids):
+        ''' Set of the names of ids.'''
+        return {name for name in self.lookup(ids) if name is not None}
+
+    def retain(self, ids):
+        ''' Counts an artist set holding ids.'''
+        for i in ids:
+            self._refs[i] = self._refs.get(i, 0) + 1
+
+    def release(self, ids):
+        ''' Uncounts an artist set holding ids, forgetting the names no
+        set holds anymore.'''
+        for i in ids:
+            count = self._refs[i] - 1
+            if count:
+                self._refs[i] = count
+            else:
+                del self._refs[i]
+                self._forget(i)
+
+
+class SharedArtistDictionary(ArtistDictionary):
+    '''
+    Artist dictionary whose IDs are shared by every worker, kept in a store
+    by the _intern and _fetch of subclasses. The process only caches the
+    `cache_size` names it interned or looked up last (least recently used
+    out first).
+    '''
+
+    def __init__(self, cache_size=100000):
+        ArtistDictionary.__init__(self)
+        self.cache_size = cache_size
+        self._names = OrderedDict()
+
+    def _hit(self, artistId):
+        # to the most recently used end
+        self._names[artistId] = self._names.pop(artistId)
+
+    def _remember(self, artistId, name):
+        ArtistDictionary._remember(self, artistId, name)
+        while len(self._names) > self.cache_size:
+            self._forget(next(iter(self._names)))
+
+    def retain(self, ids):
+        pass
+
+    def release(self, ids):
+        pass
+
+
+class DatabaseArtistDictionary(SharedArtistDictionary):
+    '''
+    Artist dictionary of the `artists` table, names it doesn't know yet
+    being added to it. Names are looked up by the MD5 of their UTF-8
+    encoding (migration 6); ones longer than `max_name_length` characters
+    are left out.
+    '''
+
+    chunk_size = 500
+    max_name_length = 1024
+
+    def __init__(self, pool, cache_size=100000):
+        SharedArtistDictionary.__init__(self, cache_size)
+        self.pool = pool
+
+    def _chunks(self, values):
+        values = list(values)
+        for i in xrange(0, len(values), self.chunk_size):
+            yield values[i:i + self.chunk_size]
+
+    def _hash(self, name):
+        return hashlib.md5(name.encode('utf-8')).hexdigest()
+
+    def _select(self, cursor, column, values):
+        rows = []
+        for chunk in self._chunks(values):
+            cursor.execute("SELECT artistId, name FROM artists WHERE {} IN "
+                           "({})".format(column, ', '.join(['%s'] * len(chunk))),
+                           chunk)
+            rows.extend((int(artistId), _unicode(name))
+                        for artistId, name in cursor.fetchall())
+        return rows
+
+    def _lookup(self, cursor, names):
+        # a row of another name is a hash collision: that name is left out
+        names = set(names)
+        return {name: artistId for artistId, name in
+                self._select(cursor, 'nameHash', map(self._hash, names))
+                if name in names}
+
+    def _intern(self, names):
+        valid = [name for name in names if len(name) <= self.max_name_length]
+        if len(valid) < len(names):
+            logger.warning("Artist dictionary left out %s names longer than %s "
+                           "characters", len(names) - len(valid),
+                           self.max_name_length)
+        with self.pool.cursor() as cursor:
+            interned = self._lookup(cursor, valid)
+            new = [name for name in valid if name not in interned]
+            if new:
+                # IGNORE: another worker may add the same names meanwhile
+                cursor.executemany("INSERT IGNORE INTO artists (name, nameHash) "
+                                   "VALUES (%s, %s)",
+                                   [(name, self._hash(name)) for name in new])
+                interned.update(self._lookup(cursor, new))
+        return interned
+
+    def _fetch(self, ids):
+        with self.pool.cursor() as cursor:
+            return dict(self._select(cursor, 'artistId', ids))
+
+
+class RedisArtistDictionary(SharedArtistDictionary):
+    '''
+    Artist dictionary kept in two redis hashes (name -> ID and ID -> name),
+    IDs being taken from a counter.
+    '''
+
+    def __init__(self, store, prefix='artists', cache_size=100000):
+        SharedArtistDictionary.__init__(self, cache_size)
+        self.store = store
+        self.prefix = prefix
+
+    def _encode(self, name):
+        return name.encode('utf-8')
+
+    def _intern(self, names):
+        ids_key = self.prefix + ':ids'
+        names_key = self.prefix + ':names'
+        current = self.store.hmget(ids_key, [self._encode(n) for n in names])
+        interned = {name: int(artistId)
+                    for name, artistId in zip(names, current) if artistId}
+        new = [name for name in names if name not in interned]
+        if not new:
+            return interned
+        last = self.store.incrby(self.prefix + ':seq', len(new))
+        ids = range(last - len(new) + 1, last + 1)
+        # ID -> name first: whoever reads an ID can look it up
+        pipe = self.store.pipeline(transaction=False)
+        pipe.hmset(names_key, {artistId: self._encode(name)
+                               for artistId, name in zip(ids, new)})
+        for artistId, name in zip(ids, new):
+            pipe.hsetnx(ids_key, self._encode(name), artistId)
+        won = pipe.execute()[1:]
+        lost = [name for name, first in zip(new, won) if not first]
+        interned.update((name, artistId) for name, artistId, first
+                        in zip(new, ids, won) if first)
+        if lost:
+            # another worker interned these meanwhile: theirs are the IDs
+            pipe = self.store.pipeline(transaction=False)
+            pipe.hmget(ids_key, [self._encode(n) for n in lost])
+            pipe.hdel(names_key, *[artistId for artistId, first
+                                   in zip(ids, won) if not first])
+            interned.update((name, int(artistId)) for name, artistId
+                            in zip(lost, pipe.execute()[0]))
+        return interned
+
+    def _fetch(self, ids):
+        ids = list(ids)
+        names = self.store.hmget(self.prefix + ':names', ids)
+        return {artistId: name.decode('utf-8')
+                for artistId, name in zip(ids, names) if name is not None}
+
+
+class RedisPreferenceBackend(object):
+    '''
+    Keeps each user's artist preferences per festival as a redis set of
+    artist IDs, so they are shared by every web worker and the celery
+    processes. Artists are interned in a RedisArtistDictionary, each name
+    being stored once.
+    '''
+
+    bumps_festival_version = False
+
+    def __init__(self, store, ttl=172800, prefix='preferences',
+                 dictionary_size=100000):
+        self.store = store
+        self.ttl = ttl
+        self.prefix = prefix
+        self.dictionary = RedisArtistDictionary(store,
+                                                cache_size=dictionary_size)
+
+    def _key(self, user_id, url_slug):
+        return '{}:{}:{}:ids'.format(self.prefix, user_id, url_slug)
+
+    def _index(self, user_id):
+        return '{}:{}'.format(self.prefix, user_id)
+
+    def _version(self, url_slug):
+        return '{}:festival:{}:version'.format(self.prefix, url_slug)
+
+    def _bump(self, pipe, url_slug):
+        pipe.incr(self._version(url_slug))
+        pipe.expire(self._version(url_slug), self.ttl)
+
+    def version(self, url_slug):
+        ''' Changes whenever an artist set of the festival at url_slug
+        changes.'''
+        return int(self.store.get(self._version(url_slug)) or 0)
+
+    def get_ids(self, user_id, url_slug):
+        ''' Sorted array of the dictionary IDs of the user's artists.'''
+        members = self.store.smembers(self._key(user_id, url_slug))
+        if not members:
+            return None
+        return array.array('i', sorted(int(member) for member in members))
+
+    def get(self, user_id, url_slug):
+        ids = self.get_ids(user_id, url_slug)
+        if ids is None:
+            return None
+        return self.dictionary.names(ids)
+
+    def set(self, user_id, url_slug, artists):
+        ids = self.dictionary.ids(artists) if artists else ()
+        key = self._key(user_id, url_slug)
+        pipe = self.store.pipeline()
+        pipe.delete(key)
+        if ids:
+            pipe.sadd(key, *ids)
+        pipe.expire(key, self.ttl)
+        pipe.sadd(self._index(user_id), url_slug)
+        pipe.expire(self._index(user_id), self.ttl)
+        self._bump(pipe, url_slug)
+        pipe.execute()
+
+    def add(self, user_id, url_slug, artists):
+        ids = self.dictionary.ids(artists) if artists else ()
+        key = self._key(user_id, url_slug)
+        pipe = self.store.pipeline()
+        if ids:
+            pipe.sadd(key, *ids)
+        pipe.expire(key, self.ttl)
+        pipe.sadd(self._index(user_id), url_slug)
+        pipe.expire(self._index(user_id), self.ttl)
+        self._bump(pipe, url_slug)
+        pipe.execute()
+
+    def delete(self, user_id):
+        index = self._index(user_id)
+        slugs = self.store.smembers(index)
+        keys = [self._key(user_id, slug) for slug in slugs]
+        pipe = self.store.pipeline()
+        pipe.delete(index, *keys)
+        for slug in slugs:
+            self._bump(pipe, slug)
+        pipe.execute()
+
+
+class LRUPreferenceBackend(object):
+    '''
+    In-process preference store for single-node deployments. Entries
+    expire after `ttl` seconds, and the least recently used ones are
+    evicted once their estimated size, and that of the names of the
+    ArtistDictionary their arrays of IDs refer to, exceeds `max_bytes`.
+    A festival's version is kept (`festival_bytes`) while it has entries.
+    '''
+
+    bumps_festival_version = False
+    festival_bytes = 200
+
+    def __init__(self, ttl=172800, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.dictionary = ArtistDictionary()
+        self._entries = OrderedDict()
+        # url_slug: [entries, version]
+        self._festivals = {}
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    def _sizeof(self, ids):
+        return sys.getsizeof(ids)
+
+    @property
+    def total_bytes(self):
+        return (self.bytes + self.dictionary.bytes +
+                len(self._festivals) * self.festival_bytes)
+
+    def _bump(self, url_slug):
+        # versions come from one clock: a festival dropped, then written
+        # again, never gets back a version it had
+        self._clock += 1
+        self._festivals[url_slug][1] = self._clock
+
+    def _pop(self, key):
+        artists, _, size = self._entries.pop(key)
+        self.bytes -= size
+        self.dictionary.release(artists)
+        festival = self._festivals[key[1]]
+        festival[0] -= 1
+        if festival[0]:
+            self._bump(key[1])
+        else:
+            # version 0 again: no artists, as before the first entry
+            del self._festivals[key[1]]
+        return artists
+
+    def _put(self, key, artists):
+        # retained before the entry it replaces is released, so that the
+        # names both hold are kept
+        self.dictionary.retain(artists)
+        if key in self._entries:
+            self._pop(key)
+        size = self._sizeof(artists)
+        self._entries[key] = (artists, time.time() + self.ttl, size)
+        self.bytes += size
+        self._festivals.setdefault(key[1], [0, 0])[0] += 1
+        self._bump(key[1])
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            evicted = next(iter(self._entries))
+            self._pop(evicted)
+            logger.warning("User cache full, evicted preferences "
+                           "of '%s' at '%s'", *evicted)
+
+    def _get(self, key):
+        if key not in self._entries:
+            return None
+        ids, expires, size = self._entries[key]
+        if expires < time.time():
+            self._pop(key)
+            return None
+        # move to the most recently used end
+        del self._entries[key]
+        self._entries[key] = (ids, expires, size)
+        return ids
+
+    def get_ids(self, user_id, url_slug):
+        ''' Sorted array of the dictionary IDs of the user's artists.'''
+        with self._lock:
+            return self._get((user_id, url_slug))
+
+    def get(self, user_id, url_slug):
+        with self._lock:
+            ids = self._get((user_id, url_slug))
+            if ids is None:
+                return None
+            return self.dictionary.names(ids)
+
+    def version(self, url_slug):
+        with self._lock:
+            festival = self._festivals.get(url_slug)
+            return festival[1] if festival else 0
+
+    def set(self, user_id, url_slug, artists):
+        with self._lock:
+            self._put((user_id, url_slug), self.dictionary.ids(artists))
+
+    def add(self, user_id, url_slug, artists):
+        key = (user_id, url_slug)
+        with self._lock:
+            # expired artists are released first, not merged back
+            current = self._get(key) or ()
+            ids = self.dictionary.ids(artists)
+            self._put(key, array.array('i', sorted(set(current) | set(ids))))
+
+    def delete(self, user_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_id]:
+                self._pop(key)
+
+
+class DatabasePreferenceBackend(object):
+    '''
+    Keeps artist preferences in the database, so they survive restarts:
+    one row of the `preferences` table per (festival, user, artist), the
+    artist being an ID of the `artists` dictionary table. Rows are written
+    with executemany bulk inserts and deleted with their festival (see
+    db.delete_festivals). Every write bumps the version of the festivals
+    it changes (sessions.version, see db.Festival) in its transaction.
+    '''
+
+    bumps_festival_version = True
+
+    def __init__(self, pool, dictionary_size=100000):
+        self.pool = pool
+        self.dictionary = DatabaseArtistDictionary(pool,
+                                                   cache_size=dictionary_size)
+
+    def _insert(self, cursor, user_id, url_slug, ids):
+        cursor.executemany("INSERT IGNORE INTO preferences (urlSlug, userId, "
+                           "artistId) VALUES (%s, %s, %s)",
+                           [(url_slug, user_id, i) for i in ids])
+
+    def _bump(self, cursor, url_slug):
+        # first in the transaction, as db._bump_version
+        cursor.execute("UPDATE sessions SET version = version + 1 "
+                       "WHERE urlSlug = %s", (url_slug,))
+
+    def get_ids(self, user_id, url_slug):
+        ''' Sorted array of the artistIds of the user's artists.'''
+        with self.pool.cursor() as cursor:
+            cursor.execute("SELECT artistId FROM preferences WHERE urlSlug = %s "
+                           "AND userId = %s ORDER BY artistId",
+                           (url_slug, user_id))
+            ids = array.array('i', (row[0] for row in cursor.fetchall()))
+        return ids or None
+
+    def get(self, user_id, url_slug):
+        ids = self.get_ids(user_id, url_slug)
+        if ids is None:
+            return None
+        return self.dictionary.names(ids)
+
+    def set(self, user_id, url_slug, artists):
+        ids = self.dictionary.ids(artists)
+        with self.pool.cursor() as cursor:
+            self._bump(cursor, url_slug)
+            cursor.execute("DELETE FROM preferences WHERE urlSlug = %s "
+                           "AND userId = %s", (url_slug, user_id))
+            if ids:
+                self._insert(cursor, user_id, url_slug, ids)
+
+    def add(self, user_id, url_slug, artists):
+        ids = self.dictionary.ids(artists)
+        if ids:
+            with self.pool.cursor() as cursor:
+                self._bump(cursor, url_slug)
+                self._insert(cursor, user_id, url_slug, ids)
+
+    def delete(self, user_id):
+        with self.pool.cursor() as cursor:
+            cursor.execute("UPDATE sessions SET version = version + 1 "
+                           "WHERE urlSlug IN (SELECT urlSlug FROM preferences "
+                           "WHERE userId = %s)", (user_id,))
+            cursor.execute("DELETE FROM preferences WHERE userId = %s",
+                           (user_id,))
+
+    def version(self, url_slug):
+        ''' Changes whenever an artist set of the festival at url_slug
+        changes: the festival's version.'''
+        with self.pool.cursor() as cursor:
+            cursor.execute("SELECT version FROM sessions WHERE urlSlug = %s",
+                           (url_slug,))
+            row = cursor.fetchone()
+        return int(row[0]) if row else 0
+
+
+def preference_backend(config, store=None, pool=None):
+    ''' Builds the backend named by config['USER_CACHE_BACKEND'].'''
+    name = config['USER_CACHE_BACKEND']
+    if name == 'redis':
+        return RedisPreferenceBackend(
+            store, ttl=config['USER_CACHE_TTL'],
+            dictionary_size=config['USER_CACHE_DICTIONARY_SIZE'])
+    elif name == 'lru':
+        return LRUPreferenceBackend(ttl=config['USER_CACHE_TTL'],
+                                    max_bytes=config['USER_CACHE_MAX_BYTES'])
+    elif name == 'mysql':
+        return DatabasePreferenceBackend(
+            pool, dictionary_size=config['USER_CACHE_DICTIONARY_SIZE'])
+    raise KeyError("Unknown USER_CACHE_BACKEND '{}' "
+                   "(expected 'redis', 'lru' or 'mysql').".format(name))
@@ -1,7 +1,216 @@
+import time
 import base64
 import datetime
-from . import app, mysql, celery
+import eventlet
+from collections import namedtuple
+from flask import g, has_request_context
+from . import app, db_pool, celery
+from .metrics import instrument
 from pyechonest.catalog import Catalog
+from pyechonest.util import EchoNestAPIError
+
+
+_Contributor = namedtuple('Contributor', ['userId', 'ready', 'hotness',
+                                          'danceability', 'energy', 'variety',
+                                          'adventurousness', 'organizer'])
+
+_Festival = namedtuple('Festival', ['festivalId', 'festivalName', 'userId',
+                                    'playlistId', 'playlistURL', 'catalogId',
+                                    'urlSlug', 'contributors', 'stats',
+                                    'version'])
+
+_FestivalStats = namedtuple('FestivalStats', ['contributors', 'ready', 'rated',
+                                              'hotness', 'danceability', 'energy',
+                                              'variety', 'adventurousness'])
+
+PARAMETERS = ('hotness', 'danceability', 'energy', 'variety', 'adventurousness')
+
+
+def _decimal(value):
+    return None if value is None else float(value)
+
+
+class Contributor(_Contributor):
+    ''' Row of the contributors table (organizer included).'''
+    __slots__ = ()
+
+    @classmethod
+    def from_row(cls, row):
+        ''' Builds a record from (userId, ready, hotness, danceability,
+        energy, variety, adventurousness, organizer).'''
+        return cls(str(row[0]), int(row[1]), _decimal(row[2]),
+                   _decimal(row[3]), _decimal(row[4]), _decimal(row[5]),
+                   _decimal(row[6]), int(row[7]))
+
+    def as_dict(self):
+        return {'ready': self.ready,
+                'hotness': self.hotness,
+                'danceability': self.danceability,
+                'energy': self.energy,
+                'variety': self.variety,
+                'adventurousness': self.adventurousness}
+
+
+class FestivalStats(_FestivalStats):
+    ''' Row of the festival_stats table: number of contributors (organizer
+    excluded), how many of them are ready, how many rows have parameters
+    and the running sums of each parameter.'''
+    __slots__ = ()
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(int(row[0]), int(row[1]), int(row[2]), *map(float, row[3:8]))
+
+    @property
+    def all_ready(self):
+        return int(self.ready == self.contributors)
+
+    def averages(self):
+        ''' Average parameters, in the order of get_average_parameters(...).'''
+        if not self.rated:
+            return None
+        return [getattr(self, name) / self.rated for name in PARAMETERS]
+
+
+class Festival(_Festival):
+    ''' Session row of a festival together with all of its contributors.
+    The first six fields line up with get_info_from_database(...), so
+    festival[0] is still the festivalId, festival[5] the catalogId, etc.
+    version counts the changes to the festival's page: contributors
+    joining, their parameters, its name and playlist.
+    '''
+    __slots__ = ()
+
+    def contributor(self, userId):
+        for contributor in self.contributors:
+            if contributor.userId == userId:
+                return contributor
+        return None
+
+    def parameters(self, userId):
+        ''' Parameters saved by userId, in the order returned by
+        get_parameters(...), or None if they haven't set any.'''
+        contributor = self.contributor(userId)
+        if not contributor or contributor.hotness is None:
+            return None
+        return [contributor.hotness, contributor.danceability,
+                contributor.energy, contributor.variety,
+                contributor.adventurousness]
+
+    def all_users(self):
+        ''' Same structure as returned by get_contributors(...).'''
+        return _all_users(self.festivalId, self.contributors, self.stats)
+
+
+def _all_users(festivalId, contributors, stats=None):
+    ''' Arranges contributor records into the organizer/contributors
+    dict the festival page is rendered from. all_ready is read from the
+    festival's stats when given.'''
+    organizers = [c for c in contributors if c.organizer]
+    if not organizers:
+        app.logger.error("DB -- No organizer found for festival '%s'", festivalId)
+        return None
+    organizer = organizers[0]
+    all_users = {'organizer': dict(organizer.as_dict(), userId=organizer.userId)}
+    others = [c for c in contributors if not c.organizer]
+    if others:
+        contributors = {c.userId: c.as_dict() for c in others}
+        contributors['c_names'] = [c.userId for c in others]
+        if stats is not None:
+            all_ready = stats.all_ready
+        else:
+            all_ready = int(all(c.ready for c in others))
+        if not all_ready:
+            app.logger.debug("DB - At least 1 user isn't ready in festival '%s'",
+                             festivalId)
+        all_users.update({'contributors': contributors, 'all_ready': all_ready})
+    app.logger.debug("All users in festival '%s': %s", festivalId, all_users)
+    return all_users
+
+
+def _request_festivals():
+    ''' Per-request memo of festivals loaded by load_festival(...).
+    Outside of a request (celery tasks) nothing is memoized.'''
+    if not has_request_context():
+        return None
+    if not hasattr(g, 'festivals'):
+        g.festivals = {}
+    return g.festivals
+
+
+def forget_festivals():
+    ''' Drops festivals memoized for the current request, so that reads
+    following a write see the new rows.'''
+    if has_request_context():
+        g.festivals = {}
+
+
+def load_festival(urlSlug):
+    ''' Executes a single select query joining the sessions row at urlSlug
+    with all of its contributors rows. Returns a Festival record (or None)
+    that is memoized for the rest of the request.
+    '''
+    festivals = _request_festivals()
+    if festivals is not None and urlSlug in festivals:
+        return festivals[urlSlug]
+    with db_pool.cursor() as cursor:
+        cursor.execute("SELECT s.festivalId, s.festivalName, s.userId, "
+                       "s.playlistId, s.playlistURL, s.catalogId, s.urlSlug, "
+                       "c.userId, c.ready, c.hotness, c.danceability, c.energy, "
+                       "c.variety, c.adventurousness, c.organizer, "
+                       "f.contributors, f.ready, f.rated, f.hotness, "
+                       "f.danceability, f.energy, f.variety, f.adventurousness, "
+                       "s.version FROM sessions as s LEFT JOIN contributors as c "
+                       "on c.festivalId = s.festivalId LEFT JOIN festival_stats "
+                       "as f on f.festivalId = s.festivalId WHERE s.urlSlug = %s",
+                       (urlSlug,))
+        data = cursor.fetchall()
+    if not data:
+        return None
+    contributors = tuple(Contributor.from_row(row[7:15])
+                         for row in data if row[7] is not None)
+    first = data[0]
+    festival = Festival(int(first[0]), str(first[1]), str(first[2]),
+                        str(first[3]), str(first[4]), str(first[5]),
+                        str(first[6]), contributors,
+                        FestivalStats.from_row(first[15:23]) if first[15] is not None
+                        else None, int(first[23]))
+    if festivals is not None:
+        festivals[urlSlug] = festival
+    app.logger.debug("Festival '%s' loaded with %d contributors.", urlSlug,
+                     len(contributors))
+    return festival
+
+
+def _update_stats(cursor, festivalId, before=None, after=None):
+    ''' Applies the change of one contributors row from `before` to `after`
+    (Contributor records, None for a missing row) to the festival_stats
+    row of festivalId, within the caller's transaction.'''
+    def terms(c):
+        if c is None:
+            return [0, 0, 0] + [0.0] * len(PARAMETERS)
+        counted = 0 if c.organizer else 1
+        rated = 0 if c.hotness is None else 1
+        return ([counted, counted if c.ready else 0, rated] +
+                [getattr(c, name) or 0.0 for name in PARAMETERS])
+    delta = [a - b for a, b in zip(terms(after), terms(before))]
+    if not any(delta):
+        return
+    cursor.execute("UPDATE festival_stats SET contributors = contributors + %s, "
+                   "ready = ready + %s, rated = rated + %s, "
+                   "hotness = hotness + %s, danceability = danceability + %s, "
+                   "energy = energy + %s, variety = variety + %s, "
+                   "adventurousness = adventurousness + %s "
+                   "WHERE festivalId = %s", tuple(delta) + (festivalId,))
+
+
+def _bump_version(cursor, festivalId):
+    ''' Counts a change to the festival's page (see Festival.version).
+    Run first in the transaction: the row lock it takes serializes the
+    writes to a festival, where the shared lock an insert into
+    contributors takes on it first would deadlock two of them.'''
+    cursor.execute("UPDATE sessions SET version = version + 1 "
+                   "WHERE festivalId = %s", (festivalId,))
 
 
 @celery.task(name='save_festival')
@@ -15,15 +224,14 @@ def save_to_database(festivalName, userId, playlistId,
     playlistURL = str(playlistURL)
     catalogId = str(catalogId)
     values = (festivalName, userId, playlistId, playlistURL, catalogId, urlSlug)
-    with app.app_context():
-        connection = mysql.connect()
-        cursor = connection.cursor()
+    with db_pool.cursor() as cursor:
         cursor.execute("INSERT INTO sessions (festivalName, userId, playlistId,\
                         playlistURL, catalogId, urlSlug)\
                         VALUES (%s, %s, %s, %s, %s, %s)", values)
-        connection.commit()
-        app.logger.warning("DB -- Festival at '{}'"
-                           "saved to database".format(urlSlug))
+        cursor.execute("INSERT INTO festival_stats (festivalId) VALUES (%s)",
+                       (cursor.lastrowid,))
+        app.logger.info("DB -- Festival at '%s' saved to database", urlSlug)
+    forget_festivals()
     return
 
 
@@ -31,20 +239,19 @@ def save_to_database(festivalName, userId, playlistId,
 def update_festival(festivalName, urlSlug, playlistId=None, playlistURL=None):
     ''' Executes an update query for festival
     information on sessions table in dB.'''
-    with app.app_context():
-        connection = mysql.connect()
-        cursor = connection.cursor()
+    with db_pool.cursor() as cursor:
         if playlistId and playlistURL:
             values = (festivalName, playlistId, playlistURL, urlSlug)
             cursor.execute("UPDATE sessions SET festivalName=%s, playlistId=%s,\
-                           playlistURL=%s WHERE urlSlug=%s",
+                           playlistURL=%s, version = version + 1 WHERE urlSlug=%s",
                            (festivalName, playlistId, playlistURL, urlSlug))
         else:
             values = (festivalName, urlSlug)
-            cursor.execute("UPDATE sessions SET festivalName=%s, WHERE urlSlug=%s",
+            cursor.execute("UPDATE sessions SET festivalName=%s, "
+                           "version = version + 1 WHERE urlSlug=%s",
                            (festivalName, urlSlug))
-        connection.commit()
-        app.logger.warning("DB -- values saved to festival '{}'.".format(urlSlug))
+        app.logger.info("DB -- values saved to festival '%s'.", urlSlug)
+    forget_festivals()
     return
 
 
@@ -61,14 +268,23 @@ def update_parameters(festivalId, userId, hotttnesss, danceability,
     variety = float(variety)
     advent = float(advent)
     values = (hotttnesss, danceability, energy, variety, advent, festivalId, userId)
-    with app.app_context():
-        connection = mysql.connect()
-        cursor = connection.cursor()
+    with db_pool.cursor() as cursor:
+        _bump_version(cursor, festivalId)
+        cursor.execute("SELECT userId, ready, hotness, danceability, energy, "
+                       "variety, adventurousness, organizer FROM contributors "
+                       "WHERE festivalId=%s AND userId=%s FOR UPDATE",
+                       (festivalId, userId))
+        row = cursor.fetchone()
         cursor.execute("UPDATE contributors SET hotness=%s, danceability=%s, energy=%s,\
                         variety=%s, adventurousness=%s, ready=1 WHERE festivalId=%s AND userId=%s", values)
-        connection.commit()
-        app.logger.warning("DB -- parameter settings updated for "
-                           "user '{}' in festival '{}'".format(userId, festivalId))
+        if row:
+            before = Contributor.from_row(row)
+            _update_stats(cursor, festivalId, before, before._replace(
+                ready=1, hotness=hotttnesss, danceability=danceability,
+                energy=energy, variety=variety, adventurousness=advent))
+        app.logger.info("DB -- parameter settings updated for user '%s' in "
+                        "festival '%s'", userId, festivalId)
+    forget_festivals()
     return
 
 
@@ -76,9 +292,7 @@ def get_parameters(user_id, url_slug):
     ''' Executes a select query on contributors table,
     retrieving parameter for user at festival located at url_slug.
     '''
-    with app.app_context():
-        connection = mysql.connect()
-        cursor = connection.cursor()
+    with db_pool.cursor() as cursor:
         cursor.execute("SELECT c.hotness, c.danceability, c.energy, c.variety,"
             "c.adventurousness FROM contributors as c INNER JOIN sessions as s on "
             "c.festivalId = s.festivalId WHERE (c.userId = '{}' and s.urlSlug = '{}')"
@@ -94,8 +308,8 @@ def get_parameters(user_id, url_slug):
         a = int(data[0][4])
 
         values = [h, d, e, v, a]
-        app.logger.warning("DB - parameters retrieved for"
-                           "'{}' at '{}'".format(user_id, url_slug))
+        app.logger.debug("DB - parameters retrieved for '%s' at '%s'",
+                         user_id, url_slug)
         return values
 
 
@@ -111,82 +325,50 @@ def save_contributor(festivalId, userId, ready=0, hotness=None,
     values = (festivalId, userId, ready, hotness,
               danceability, energy, variety, advent, organizer)
 
-    with app.app_context():
-        connection = mysql.connect()
-        cursor = connection.cursor()
+    with db_pool.cursor() as cursor:
+        _bump_version(cursor, festivalId)
         cursor.execute("INSERT INTO contributors VALUES\
                        (%s, %s, %s, %s, %s, %s, %s, %s, %s)", values)
-        connection.commit()
-        app.logger.warning("DB - Saved contributor {} to"
-                           "festival {}".format(userId, festivalId))
+        _update_stats(cursor, festivalId, after=Contributor(
+            userId, int(ready), _decimal(hotness), _decimal(danceability),
+            _decimal(energy), _decimal(variety), _decimal(advent), int(organizer)))
+        app.logger.info("DB - Saved contributor '%s' to festival %s",
+                        userId, festivalId)
+    forget_festivals()
     return
 
 
 def get_contributors(festivalId):
-    ''' Executes select query on contributors table for
-    contributors for festival at festivalId (this includes the owner)
+    ''' Executes a single select query for the contributors of the festival
+    at festivalId (this includes the owner), joined with its running
+    aggregates in festival_stats.
     '''
-    connection = mysql.get_db()
-    cursor = connection.cursor()
     try:
-        cursor.execute("SELECT * FROM contributors WHERE\
-                       (festivalId = %s AND organizer = 1)", (festivalId,))
-        _org = cursor.fetchall()
+        with db_pool.cursor() as cursor:
+            cursor.execute("SELECT c.userId, c.ready, c.hotness, c.danceability, "
+                           "c.energy, c.variety, c.adventurousness, c.organizer, "
+                           "f.contributors, f.ready, f.rated, f.hotness, "
+                           "f.danceability, f.energy, f.variety, f.adventurousness "
+                           "FROM sessions as s LEFT JOIN contributors as c "
+                           "on c.festivalId = s.festivalId LEFT JOIN festival_stats "
+                           "as f on f.festivalId = s.festivalId "
+                           "WHERE s.festivalId = %s", (festivalId,))
+            data = cursor.fetchall()
     except:
         app.logger.error("SQL Query failed - check dB schema.")
         return None
-    else:
-        if not _org[0][0]:
-            app.logger.error("DB -- No organizer found"
-                             " for festival at'{}'".format(festivalId))
-            return None
-        all_users = {'organizer': {'userId': str(_org[0][1]),
-                                   'ready': int(_org[0][2]),
-                                   'hotness': (_org[0][3]),
-                                   'danceability': (_org[0][4]),
-                                   'energy': (_org[0][5]),
-                                   'variety': (_org[0][6]),
-                                   'adventurousness': (_org[0][7])}}
-    #fetching the contributors
-    try: 
-        cursor.execute("SELECT * FROM contributors WHERE\
-                       (festivalId = %s AND organizer = 0)", (festivalId,))
-        _ctbrs = cursor.fetchall()
-    except:
-        app.logger.error("DB -- No organizer found"
-                         " for festival at'{}'".format(festivalId))
-        return None
-    else:
-        if _ctbrs:
-            contributors = {str(user[1]): {'ready': int(user[2]),
-                                           'hotness': user[3],
-                                           'danceability': user[4],
-                                           'energy': user[5],
-                                           'variety': user[6],
-                                           'adventurousness': user[7]} for user in _ctbrs}
-            c_names = [c for c in contributors]
-            contributors['c_names'] = c_names
-            all_ready = 1
-            for contributor in contributors['c_names']:
-                if contributors[contributor]['ready'] == 0:
-                    all_ready = 0
-                    app.logger.warning("DB - At least 1 user isn't"
-                                       " ready in festival '{}'".format(festivalId))
-                    break
-
-            all_users.update({'contributors': contributors, 'all_ready': all_ready})
-        app.logger.warning("All users are in "
-                           "festival '{}' are '{}'".format(festivalId, all_users))
-        return all_users
+    stats = (FestivalStats.from_row(data[0][8:16])
+             if data and data[0][8] is not None else None)
+    return _all_users(festivalId, [Contributor.from_row(row[:8])
+                                   for row in data if row[0] is not None],
+                      stats)
 
 
 def get_info_from_database(urlSlug):
     ''' Executes select query on sessions table
     for festival information at urlSlug.
     '''
-    with app.app_context():
-        connection = mysql.connect()
-        cursor = connection.cursor()
+    with db_pool.cursor() as cursor:
         cursor.execute("SELECT * FROM sessions WHERE urlSlug = %s", (urlSlug,))
         data = cursor.fetchall()
         if not data:
@@ -199,59 +381,157 @@ def get_info_from_database(urlSlug):
         catalogId = str(data[0][5])
         values = [festivalId, festivalName, userId,
                   playlistId, playlistURL, catalogId]
-        app.logger.warning("Info for festival '{}' retrieved.".format(urlSlug))
+        app.logger.debug("Info for festival '%s' retrieved.", urlSlug)
         return values
 
 def get_user_festivals(user_id):
     ''' Executes select query on contributors table
     for festival info where user at user_id is a contributor.
     '''
-    connection = mysql.get_db()
-    cursor = connection.cursor()
     query = ("SELECT c.userId, s.festivalId, s.festivalName, s.urlSlug, "
         "c.organizer FROM sessions as s INNER JOIN contributors as c on "
         "s.festivalId = c.festivalId  where s.festivalId = c.festivalId "
         "and c.userId = '{}'".format(user_id))
 
-    cursor.execute(query)
-    d = cursor.fetchall()
+    with db_pool.cursor() as cursor:
+        cursor.execute(query)
+        d = cursor.fetchall()
     organized_festivals = {u[1]: {'festival_name': u[2], 'url_slug': u[3]}
                            for u in d if u[4] == 1}
     contributed_festivals = {u[1]: {'festival_name': u[2], 'url_slug': u[3], 'user_id': u[0]}
                              for u in d if u[4] == 0}
-    app.logger.warning("'{}' organized: '{}'".format(user_id, organized_festivals))
-    app.logger.warning("'{}' contributed: '{}'".format(user_id, contributed_festivals))
+    app.logger.debug("'%s' organized %s, contributed to %s", user_id,
+                     organized_festivals, contributed_festivals)
     user_festivals = {}
 
     if organized_festivals:
         user_festivals = {'organizer': organized_festivals}
     if contributed_festivals:
         user_festivals.update({'contributor': contributed_festivals})
-    app.logger.warning("All festivals involved in: '{}'".format(user_festivals))
     return user_festivals
 
 
+def get_festival_stats(festivalId):
+    ''' Executes a select query on festival_stats table for the running
+    aggregates of the festival at festivalId (a FestivalStats record).
+    '''
+    with db_pool.cursor() as cursor:
+        cursor.execute("SELECT contributors, ready, rated, hotness, danceability, "
+                       "energy, variety, adventurousness FROM festival_stats "
+                       "WHERE festivalId = %s", (festivalId,))
+        row = cursor.fetchone()
+    return FestivalStats.from_row(row) if row else None
+
+
 def get_average_parameters(festivalId):
-    ''' Executes average function for all parameter inputs
-    associated with a festival at festivalId.
+    ''' Average of all parameter inputs associated with a festival at
+    festivalId, read from its running sums in festival_stats.
     '''
-    with app.app_context():
-        connection = mysql.get_db()
-        cursor = connection.cursor()
+    try:
+        stats = get_festival_stats(festivalId)
+    except:
+        app.logger.error("Error while retrieving averages. Check dB schema.")
+        return None
+    average_parameters = stats.averages() if stats else None
+    app.logger.debug("Average parameters for festival '%s': %s", festivalId,
+                     average_parameters)
+    return average_parameters
+
+
+def expired_festivals(cutoff, after=0, limit=500):
+    ''' Returns (festivalId, catalogId, urlSlug) of up to `limit` festivals
+    created before cutoff, in festivalId order starting after festivalId
+    `after` (keyset pagination).'''
+    with db_pool.cursor() as cursor:
+        cursor.execute("SELECT festivalId, catalogId, urlSlug FROM sessions "
+                       "WHERE createTime < %s AND festivalId > %s "
+                       "ORDER BY festivalId LIMIT %s", (cutoff, after, limit))
+        return cursor.fetchall()
+
+
+def delete_festivals(festival_ids):
+    ''' Deletes the festivals in festival_ids in one transaction, their
+    contributors going with them through ON DELETE CASCADE, their artist
+    preferences explicitly when they are kept in the database
+    (USER_CACHE_BACKEND 'mysql', which needs migration 4). Returns the
+    number of (sessions, contributors) rows deleted.'''
+    if not festival_ids:
+        return 0, 0
+    ids = tuple(festival_ids)
+    placeholders = ', '.join(['%s'] * len(ids))
+    with db_pool.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM contributors WHERE festivalId "
+                       "IN ({})".format(placeholders), ids)
+        contributors = int(cursor.fetchone()[0])
+        if app.config['USER_CACHE_BACKEND'] == 'mysql':
+            cursor.execute("DELETE FROM preferences WHERE urlSlug IN (SELECT "
+                           "urlSlug FROM sessions WHERE festivalId IN ({}))".format(
+                               placeholders), ids)
+        cursor.execute("DELETE FROM sessions WHERE festivalId "
+                       "IN ({})".format(placeholders), ids)
+        sessions = cursor.rowcount
+    forget_festivals()
+    return sessions, contributors
+
+
+def delete_catalog(catalogId, urlSlug):
+    ''' Deletes a festival's Echonest catalog. A catalog that no longer
+    exists counts as deleted.'''
+    try:
+        # catalogs are named after their festival's urlSlug; passing the
+        # name spares pyechonest a profile request before the delete
+        Catalog(catalogId, name=urlSlug).delete()
+    except EchoNestAPIError as e:
+        if e.code != 5:  # 5: catalog does not exist
+            raise
+    return
+
+
+def delete_expired_festivals(hours=48, batch_size=500, concurrency=8):
+    ''' Deletes every festival older than `hours`, batch_size festivals at
+    a time. The catalogs of a batch are deleted concurrently (at most
+    `concurrency` at once), then the festivals whose catalog is gone are
+    deleted from the database in a single transaction. Festivals whose
+    catalog could not be deleted are left for the next run.
+
+    Returns a report: {'sessions', 'contributors', 'catalogs', 'batches',
+    'failed': [(urlSlug, error), ...], 'duration'}.
+    '''
+    started = time.time()
+    cutoff = datetime.datetime.now() - datetime.timedelta(hours=hours)
+    report = {'sessions': 0, 'contributors': 0, 'catalogs': 0,
+              'batches': 0, 'failed': []}
+    pool = eventlet.GreenPool(concurrency)
+
+    def delete(festival):
+        festivalId, catalogId, urlSlug = festival
         try:
-            cursor.execute("SELECT AVG(hotness), AVG(danceability), \
-                            AVG(energy), AVG(variety), AVG(adventurousness) \
-                            from contributors where festivalId = %s", (festivalId,))
-            data = cursor.fetchall()
-        except:
-            app.logger.error("Error while retrieving averages. Check dB schema.")
-            return None
-        average_parameters = [float(data[0][0]), float(data[0][1]),
-                              float(data[0][2]), float(data[0][3]),
-                              float(data[0][4])]
-        app.logger.warning("Average Parameters for"
-                           "festival '{}': {}".format(festivalId, average_parameters))
-        return average_parameters
+            delete_catalog(catalogId, urlSlug)
+        except Exception, e:
+            return festival, e
+        return festival, None
+
+    after = 0
+    while True:
+        batch = expired_festivals(cutoff, after, batch_size)
+        if not batch:
+            break
+        after = batch[-1][0]
+        deleted = []
+        for festival, error in pool.imap(delete, batch):
+            if error is None:
+                deleted.append(festival[0])
+            else:
+                report['failed'].append((festival[2], str(error)))
+        sessions, contributors = delete_festivals(deleted)
+        report['catalogs'] += len(deleted)
+        report['sessions'] += sessions
+        report['contributors'] += contributors
+        report['batches'] += 1
+        if len(batch) < batch_size:
+            break
+    report['duration'] = time.time() - started
+    return report
 
 
 @celery.task(name='delete_session', ignore_result=True)
@@ -259,35 +539,33 @@ def delete_session(urlSlug):
     ''' Celery task that removes festival and catalog object
     from database and API key, respectively.
     '''
-    with app.app_context():
-        connection = mysql.connect()
-        cursor = connection.cursor()
-        festival = get_info_from_database(urlSlug)
-        if not festival:
-            return None
-        festival_catalog = Catalog(festival[5])
-        festival_catalog.delete()
-        cursor.execute("DELETE FROM sessions WHERE urlSlug=%s", (urlSlug,))
-        connection.commit()
+    festival = get_info_from_database(urlSlug)
+    if not festival:
+        return None
+    delete_catalog(festival[5], urlSlug)
+    delete_festivals([festival[0]])
     return
 
 
 @celery.task(name='routine_deletion_expired', ignore_result=True)
 def delete_expired_session():
-    ''' Celery task that wraps around task.delete_session. This task
-    runs according to celery_beat_schedule defined in config.
+    ''' Celery task that deletes expired festivals in bulk (see
+    delete_expired_festivals). This task runs according to
+    celery_beat_schedule defined in config; festivals that could not be
+    deleted are retried by the next run.
     '''
     with app.app_context():
-        time_now = datetime.datetime.now()
-        connection = mysql.connect()
-        cursor = connection.cursor()
-        cursor.execute("SELECT urlSlug, createTime FROM sessions WHERE\
-                        TIMESTAMPDIFF(HOUR, createTime, CURRENT_TIMESTAMP()) > 48;")
-        all_sessions = cursor.fetchall()
-        for session in all_sessions:
-            try:
-                delete_session(session[0])
-            except Exception, e:
-                delete_session.retry(exc=e, countdown=5)
-        app.logger.warning("{} sessions have been deleted.".format(len(all_sessions)))
+        report = delete_expired_festivals(
+            hours=app.config['FESTIVAL_LIFETIME_HOURS'],
+            batch_size=app.config['EXPIRY_BATCH_SIZE'],
+            concurrency=app.config['CATALOG_DELETE_CONCURRENCY'])
+        app.logger.info("%d sessions (%d contributors, %d catalogs) have been "
+                        "deleted in %.2fs, %d failed.", report['sessions'],
+                        report['contributors'], report['catalogs'],
+                        report['duration'], len(report['failed']))
+        for urlSlug, error in report['failed']:
+            app.logger.error("Could not delete festival '%s': %s", urlSlug, error)
     return
+
+
+instrument(globals(), 'db')
@@ -0,0 +1,51 @@
+import os
+import hashlib
+import logging
+
+from flask import Markup, render_template
+from redis import RedisError
+
+
+logger = logging.getLogger('library')
+
+
+def template_revision(app, *names):
+    ''' Digest of the source of templates, so that whatever is cached from
+    them changes with a deploy that modifies them.'''
+    digest = hashlib.md5()
+    for name in names:
+        with open(os.path.join(app.root_path, app.template_folder, name)) as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:8]
+
+
+class FragmentCache(object):
+    '''
+    Rendered template fragments, shared by every web worker through redis
+    for `ttl` seconds. Keys carry the versions of whatever a fragment
+    shows, so fragments are never invalidated: a change makes for a new
+    key, and the old fragment expires.
+    '''
+
+    def __init__(self, store, ttl=3600, prefix='fragment'):
+        self.store = store
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def render(self, key, template, context):
+        ''' template rendered with context() as Markup, from the cache if
+        it holds key (context is only called on a miss).'''
+        key = '{}:{}'.format(self.prefix, key)
+        try:
+            cached = self.store.get(key)
+        except RedisError:
+            logger.warning("Fragment cache unavailable, rendering %s.", template)
+            cached = None
+        if cached is not None:
+            return Markup(cached.decode('utf-8'))
+        html = render_template(template, **context())
+        try:
+            self.store.set(key, html.encode('utf-8'), ex=self.ttl)
+        except RedisError:
+            pass
+        return Markup(html)
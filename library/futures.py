@@ -0,0 +1,127 @@
+import time
+import logging
+import eventlet
+
+
+logger = logging.getLogger('library')
+
+
+class TaskTimeout(Exception):
+    ''' Raised when a TaskHandle's work isn't done within the timeout.'''
+    pass
+
+
+class CeleryPart(object):
+    ''' One part of a TaskHandle: a celery task result.'''
+
+    def __init__(self, result):
+        self.result = result
+
+    def ready(self):
+        return self.result.ready()
+
+    def value(self):
+        return self.result.get(propagate=True)
+
+
+class GreenPart(object):
+    ''' One part of a TaskHandle: a function run on a green thread.'''
+
+    def __init__(self, func, *args, **kwargs):
+        self.thread = eventlet.spawn(func, *args, **kwargs)
+
+    def ready(self):
+        return self.thread.dead
+
+    def value(self):
+        return self.thread.wait()
+
+
+class DonePart(object):
+    ''' One part of a TaskHandle whose value is already known.'''
+
+    def __init__(self, value):
+        self._value = value
+
+    def ready(self):
+        return True
+
+    def value(self):
+        return self._value
+
+
+class TaskHandle(object):
+    '''
+    Handle on work started by AsyncAdapter, split into parts that run as
+    celery tasks or on green threads. Nothing blocks until asked to:
+
+        handle.ready()                   # poll
+        handle.get(timeout=5)            # wait, TaskTimeout if not done
+        handle.get(timeout=5, partial=True)
+                                         # whatever parts are done by then
+        handle.then(func)                # handle on func(handle.get())
+        handle.on_done(callback)         # callback(result) once done
+
+    The values of the parts are merged into the handle's result by
+    `combine`. With partial=True, unfinished and failed parts are left out.
+    '''
+
+    poll_interval = 0.05
+
+    def __init__(self, parts, combine=list):
+        self.parts = list(parts)
+        self.combine = combine
+
+    @classmethod
+    def done(cls, value):
+        return cls([DonePart(value)], lambda values: values[0])
+
+    def ready(self):
+        return all(part.ready() for part in self.parts)
+
+    def progress(self):
+        ''' Returns (parts done, parts).'''
+        return sum(1 for part in self.parts if part.ready()), len(self.parts)
+
+    def wait(self, timeout=None):
+        ''' Waits (green-thread friendly) until every part is done, or
+        `timeout` seconds. Returns whether every part is done.'''
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.ready():
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    def get(self, timeout=None, partial=False):
+        if not self.wait(timeout) and not partial:
+            done, total = self.progress()
+            raise TaskTimeout('{} of {} parts done after {}s'.format(
+                done, total, timeout))
+        values = []
+        for part in self.parts:
+            if not part.ready():
+                continue
+            try:
+                values.append(part.value())
+            except Exception as e:
+                if not partial:
+                    raise
+                logger.warning("Part of a background job failed: %s", e)
+        return self.combine(values)
+
+    def then(self, func):
+        ''' Returns a handle on func(result of this handle).'''
+        combine = self.combine
+        return TaskHandle(self.parts, lambda values: func(combine(values)))
+
+    def on_done(self, callback, timeout=None):
+        ''' Calls callback(result) on a green thread once every part is done
+        (or with the partial result after `timeout` seconds).'''
+        def watch():
+            try:
+                callback(self.get(timeout, partial=True))
+            except Exception as e:
+                logger.error("Background job callback failed: %s", e)
+        eventlet.spawn_n(watch)
+        return self
@@ -0,0 +1,200 @@
+import json
+import logging
+import eventlet
+import eventlet.queue
+
+from functools import partial
+from redis import RedisError
+
+
+logger = logging.getLogger('library')
+
+
+def iterate_pages(spotipy, page):
+    '''
+    Yields every item of a Spotify paging object, following its 'next'
+    links until the last page.
+    '''
+    while page:
+        for item in page['items']:
+            yield item
+        page = spotipy.next(page) if page.get('next') else None
+
+
+def offset_pages(fetch, limit=50, concurrency=8, **kwargs):
+    '''
+    Yields every page of an offset-paginated Spotify endpoint, in order.
+    `fetch` is the spotipy method (e.g. spotipy.current_user_saved_tracks);
+    the first page gives the total, after which the remaining offsets are
+    fetched concurrently on green threads, `concurrency` at a time.
+    '''
+    fetch = partial(fetch, limit=limit, **kwargs)
+    first = fetch(offset=0)
+    yield first
+    offsets = xrange(len(first['items']), first['total'], limit)
+    if not first['items'] or not offsets:
+        return
+    pool = eventlet.GreenPool(concurrency)
+    for page in pool.imap(lambda offset: fetch(offset=offset), offsets):
+        yield page
+
+
+def fetch_offset_pages(fetch, limit=50, concurrency=8, **kwargs):
+    '''
+    Yields every item of an offset-paginated Spotify endpoint, in order
+    (see offset_pages).
+    '''
+    for page in offset_pages(fetch, limit, concurrency, **kwargs):
+        for item in page['items']:
+            yield item
+
+
+def saved_track_batches(spotipy, concurrency=8):
+    ''' Yields the artists of the user's saved tracks, a page at a time.'''
+    for page in offset_pages(spotipy.current_user_saved_tracks, limit=50,
+                             concurrency=concurrency):
+        yield [item['track']['artists'][0]['name'] for item in page['items']]
+
+
+def followed_artist_batches(spotipy):
+    ''' Yields the artists followed by the user, a page at a time.'''
+    page = spotipy.current_user_followed_artists(limit=50)['artists']
+    while page:
+        yield [artist['name'] for artist in page['items']]
+        if not page.get('next'):
+            break
+        # the next pages come wrapped in 'artists' too, like the first one
+        page = spotipy.next(page)['artists']
+
+
+def merge_batches(sources):
+    '''
+    Drains every batch generator in `sources` on its own green thread and
+    yields their batches in the order they arrive. A failing source is
+    logged and ends early, the others carry on.
+    '''
+    queue = eventlet.queue.Queue()
+    done = object()
+
+    def drain(source):
+        try:
+            for batch in source:
+                queue.put(batch)
+        except Exception as e:
+            logger.error("Artist harvest source failed: %s", e)
+        finally:
+            queue.put(done)
+
+    for source in sources:
+        eventlet.spawn_n(drain, source)
+    remaining = len(sources)
+    while remaining:
+        batch = queue.get()
+        if batch is done:
+            remaining -= 1
+        elif batch:
+            yield batch
+
+
+def unique_batches(batches):
+    ''' Yields the artists of each batch not seen in an earlier one.'''
+    seen = set()
+    for batch in batches:
+        new = []
+        for name in batch:
+            if name and name not in seen:
+                seen.add(name)
+                new.append(name)
+        if new:
+            yield new
+
+
+class PlaylistHarvester(object):
+    '''
+    Collects the artists found in a Spotify user's playlists.
+
+    The artist set of each playlist is stored in redis alongside the
+    playlist's snapshot_id. On the next harvest only playlists whose
+    snapshot changed (or that are new) have their tracks fetched again;
+    playlists that disappeared are dropped from the store.
+    '''
+
+    track_fields = 'items(track(artists(name))),total'
+
+    def __init__(self, store, ttl=2592000, prefix='playlists', concurrency=8):
+        self.store = store
+        self.ttl = ttl
+        self.prefix = prefix
+        self.concurrency = concurrency
+
+    def _key(self, user_id):
+        return '{}:{}'.format(self.prefix, user_id)
+
+    def _load(self, user_id):
+        try:
+            stored = self.store.hgetall(self._key(user_id))
+        except RedisError:
+            logger.warning("Playlist store unavailable, fetching all playlists.")
+            return {}
+        return {playlist_id: json.loads(entry)
+                for playlist_id, entry in stored.items()}
+
+    def _save(self, user_id, changed, removed):
+        key = self._key(user_id)
+        try:
+            pipe = self.store.pipeline()
+            if changed:
+                pipe.hmset(key, {playlist_id: json.dumps(entry)
+                                 for playlist_id, entry in changed.items()})
+            if removed:
+                pipe.hdel(key, *removed)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+        except RedisError:
+            logger.warning("Playlist store unavailable, snapshots not saved.")
+
+    def playlist_artists(self, spotipy, playlist):
+        ''' Fetches every track of a playlist and returns its artists.'''
+        items = fetch_offset_pages(spotipy.user_playlist_tracks, limit=100,
+                                   concurrency=self.concurrency,
+                                   user=playlist['owner']['id'],
+                                   playlist_id=playlist['id'],
+                                   fields=self.track_fields)
+        artists = set()
+        for item in items:
+            track = item.get('track')
+            if track and track['artists'] and track['artists'][0]['name']:
+                artists.add(track['artists'][0]['name'])
+        return artists
+
+    def harvest(self, spotipy):
+        ''' Returns the set of artists across all of the user's playlists.'''
+        artists = set()
+        for batch in self.batches(spotipy):
+            artists.update(batch)
+        return artists
+
+    def batches(self, spotipy):
+        ''' Yields the artists of the user's playlists, a playlist at a
+        time. Snapshots are saved once every playlist has been seen.'''
+        user_id = spotipy.current_user()['id']
+        stored = self._load(user_id)
+        changed = {}
+        seen = set()
+        playlists = fetch_offset_pages(spotipy.user_playlists, limit=50,
+                                       concurrency=self.concurrency,
+                                       user=user_id)
+        for playlist in playlists:
+            playlist_id = playlist['id']
+            seen.add(playlist_id)
+            entry = stored.get(playlist_id)
+            if not entry or entry['snapshot_id'] != playlist['snapshot_id']:
+                entry = {'snapshot_id': playlist['snapshot_id'],
+                         'artists': sorted(self.playlist_artists(spotipy, playlist))}
+                changed[playlist_id] = entry
+            yield entry['artists']
+
+        removed = [playlist_id for playlist_id in stored if playlist_id not in seen]
+        self._save(user_id, changed, removed)
+        logger.debug('..... %d playlists harvested, %d refetched', len(seen),
+                     len(changed))
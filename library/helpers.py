@@ -1,15 +1,28 @@
 import random
+import socket
+import eventlet
+import threading
 import spotipy
 import spotipy.util as util
 
 from flask import Flask
 from pyechonest import config
-from pyechonest import playlist
 from pyechonest import artist
+from pyechonest import util as echonest_util
 from pyechonest.catalog import Catalog
 
 from celery import group
-from . import celery
+from redis import RedisError
+from . import app, celery, redis_store
+from .spotify_client import user_client
+from .metrics import metrics, instrument, timed_external
+from .futures import TaskHandle, CeleryPart, GreenPart
+from .track_resolver import TrackResolver
+from .artist_index import ArtistIndex, read_seed_list
+from .harvest import (PlaylistHarvester, fetch_offset_pages, merge_batches,
+                      unique_batches, saved_track_batches,
+                      followed_artist_batches)
+from .playlist_engine import PlaylistEngine, TrackFeatureStore
 
 from config import BaseConfig
 import os
@@ -22,182 +35,314 @@ import logging
 
 logger = logging.getLogger('library')
 
+track_resolver = TrackResolver(redis_store, ttl=app.config['TRACK_CACHE_TTL'],
+                               negative_ttl=app.config['TRACK_CACHE_NEGATIVE_TTL'])
+playlist_harvester = PlaylistHarvester(redis_store,
+                                       ttl=app.config['PLAYLIST_CACHE_TTL'],
+                                       concurrency=app.config['SPOTIFY_PAGE_CONCURRENCY'])
+playlist_engine = PlaylistEngine()
+track_features = TrackFeatureStore(redis_store, ttl=app.config['TRACK_FEATURES_TTL'],
+                                   concurrency=app.config['TRACK_FEATURES_CONCURRENCY'])
+
 config.ECHO_NEST_API_KEY = BaseConfig.ECHONEST_API_KEY
+# every pyechonest request goes through util.callm(method, params, ...)
+echonest_util.callm = timed_external('echonest', echonest_util.callm,
+                                     lambda method, *args, **kwargs: method)
+metrics.gauge('spotifest_track_cache', 'Shared track resolver cache.',
+              track_resolver.stats)
 
 suggested_artists = set(['Radiohead', 'Nirvana', 'The Beatles', 'David Bowie',
                         'Aretha Franklin', 'Mogwai', 'Eels', 'Glass Animals',
                         'Grimes', 'Sungrazer', 'Queens of the Stone Age'])
 
+artist_index = ArtistIndex(redis_store, refresh=app.config['ARTIST_INDEX_REFRESH'],
+                           max_names=app.config['ARTIST_INDEX_MAX_NAMES'])
+artist_index.add(suggested_artists, share=False)
+if app.config['ARTIST_SEED_FILE']:
+    artist_index.add(read_seed_list(app.config['ARTIST_SEED_FILE']), share=False)
+
 
 class AsyncAdapter(object):
     '''
     an adapter class that encapsulates helper functions that have asynchronous
     options. The following helpers can be processed in via celery.
-        - process_spotify_ids()
         - get_user_preferences()
+        - populate_catalog()
+
+    Every method returns a futures.TaskHandle right away instead of waiting
+    for the work to finish; callers wait on it (with a timeout, for partial
+    results), poll it or chain on it. With IS_ASYNC off, or when the celery
+    broker can't be reached, the work runs in-process on green threads.
+
+    The spotipy clients given must come from spotify_client.user_client(...):
+    tasks are only sent their user_id or the artist names they work on,
+    all JSON-serializable.
     '''
 
+    # publish once more at most, then fall back to running in-process
+    publish_retry = {'max_retries': 1, 'interval_start': 0, 'interval_step': 0.2}
+
     def __init__(self, app):
         if 'IS_ASYNC' not in app.config:
             raise KeyError("Please set config key 'IS_ASYNC' to True | False.")
         self.is_async = app.config['IS_ASYNC']
 
-    def process_spotify_ids(self, total_items, chunk_size, spotipy, playlist):
-        if not self.is_async:
-            return self.non_async_process_spotify_ids(spotipy, playlist)
-        else:
-            return self.async_process_spotify_ids(total_items, chunk_size,
-                                                  spotipy, playlist)
+    def _dispatch(self, signatures, calls, combine):
+        ''' Sends the task signatures as a celery group, or runs `calls`,
+        (func, args) pairs doing the same work, on green threads.'''
+        if self.is_async:
+            try:
+                result = group(signatures).apply_async(
+                    retry_policy=self.publish_retry)
+                return TaskHandle([CeleryPart(r) for r in result.results],
+                                  combine)
+            except broker_errors() as e:
+                logger.warning("Celery broker unavailable (%s), running "
+                               "in-process.", e)
+        return TaskHandle([GreenPart(func, *args) for func, args in calls],
+                          combine)
 
     def get_user_preferences(self, spotipy):
         '''
-        Returns set of artists gathered from a spotify user's saved tracks,
-        public playlists and followed artists.
+        Handle on the set of artists gathered from a spotify user's saved
+        tracks, public playlists and followed artists.
         '''
-        if not self.is_async:
-            return self.non_async_get_user_preferences(spotipy)
-        else:
-            return self.async_get_user_preferences(spotipy)
-
-    def populate_catalog(self, artists, num_tasks, limit=5, catalog=None):
+        return self._dispatch(
+            [user_preferences.s(source, spotipy.user_id)
+             for source in PREFERENCE_SOURCES],
+            [(func, (spotipy,)) for func in PREFERENCE_SOURCES.values()],
+            lambda values: index_artists(set().union(*values)))
+
+    def populate_catalog(self, artists, limit=15, catalog=None,
+                         sampler=None, common=()):
         '''
-        Populates a given catalog object with a randomized selection of songs.
+        Populates a given catalog object with a randomized selection of
+        `limit` artists, drawn by sampler (a sampler.AliasSampler
+        weighting the artists of every contributor) if given, uniformly
+        from artists otherwise. The `common` artists (the contributors'
+        common ground, see overlap.Overlap) are always part of the
+        selection. Handle on the catalog's ID.
         '''
-        if not self.is_async:
-            return self.non_async_populate_catalog(artists, catalog)
+        artists = list(artists)
+        if not catalog:
+            return TaskHandle.done(random_catalog(artists, limit=limit))
+
+        # sample the whole selection at once, so no artist is picked twice,
+        # and send it as a single bulk update
+        chosen = list(common)[:limit]
+        if sampler:
+            drawn = sampler.sample(limit)
         else:
-            return self.async_populate_catalog(artists, num_tasks,
-                                               limit, catalog)
+            drawn = random.sample(artists, min(limit, len(artists)))
+        chosen += [artist for artist in drawn if artist not in chosen][:limit - len(chosen)]
+        return self._dispatch(
+            [random_catalog.s(chosen, limit=len(chosen), catalog=catalog.id)],
+            [(random_catalog, (chosen, len(chosen), catalog))],
+            lambda values: values[0] if values else None)
 
-    def non_async_process_spotify_ids(self, spotipy, playlist):
-        '''
-        Returns array of spotify song IDs, given an iterable of song names (playlist).
-        '''
-        songs_id = get_songs_id(spotipy, playlist, None)
-        return songs_id
 
-    def async_process_spotify_ids(self, total_items, chunk_size, spotipy, playlist):
-        '''
-        Asynchronous task factory, to run multiple task instances for
-        the .get_songs_id(...) helper function.
-        '''
-        task_ids = []
-        limit = total_items + chunk_size
-        all_ids = group(get_songs_id.s(spotipy, playlist, chunk)
-                        for chunk in xrange(0, limit, chunk_size))()
-        return reduce(lambda x, y: x + y, all_ids.get())
+class CatalogSeeding(object):
+    '''
+    Handles on the catalog updates started for each festival
+    (AsyncAdapter.populate_catalog), so that its playlist jobs wait for
+    them or are chained onto them. A handle is forgotten once done, or
+    after `timeout` seconds.
+    '''
 
-    def non_async_get_user_preferences(self, spotipy):
-        '''
-        Normal wrapper for three helper functions involved in gathering
-        user preferences.
-        '''
-        # artists from saved tracks
-        st = get_user_saved_tracks(spotipy)
-        # artists form user playlists (public)
-        up = get_user_playlists(spotipy)
-        # artists from followed artists
-        fa = get_user_followed(spotipy)
-        return st | up | fa
-
-    def async_get_user_preferences(self, spotipy):
-        '''
-        Asynchronous task factory for three helper functions:
-            - .get_user_saved_tracks(...)
-            - .get_user_playlists(...)
-            - .get_user_followed(...)
-        '''
-        tasks = []
-        pref_funcs = [get_user_saved_tracks,
-                      get_user_playlists,
-                      get_user_followed]
-        # artists from saved tracks
-        preferences = group(func.s(spotipy) for func in pref_funcs)()
-        return reduce(lambda x, y: x | y, preferences.get())
-
-    def async_populate_catalog(self, artists, num_tasks, limit=5, catalog=None):
-        '''
-        Asynchronous task factory for the .populate_catalog(...) helper function.
-        '''
-        artists = list(artists)
-        tasks = []
-        if not catalog:
-            random_catalog(artists, limit=15)
-            return
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self._handles = {}
+        self._lock = threading.Lock()
 
-        populated = group(random_catalog.s(artists, limit=5, catalog=catalog)
-                          for _ in xrange(num_tasks))()
+    def add(self, url_slug, handle):
+        with self._lock:
+            self._handles.setdefault(url_slug, []).append(handle)
+        handle.on_done(lambda _: self._discard(url_slug, handle),
+                       timeout=self.timeout)
+        return handle
 
-        if populated.successful():
-            logger.warning('Catalog now has'
-                           '{} items.'.format(len(catalog.get_item_dicts(results=100))))
-        return
+    def _discard(self, url_slug, handle):
+        with self._lock:
+            handles = self._handles.get(url_slug, [])
+            if handle in handles:
+                handles.remove(handle)
+            if not handles:
+                self._handles.pop(url_slug, None)
+
+    def pending(self, url_slug):
+        ''' Handle on the unfinished catalog updates of the festival at
+        url_slug, None if there are none.'''
+        with self._lock:
+            handles = list(self._handles.get(url_slug, ()))
+        parts = [part for handle in handles for part in handle.parts
+                 if not part.ready()]
+        return TaskHandle(parts) if parts else None
+
+
+catalog_seeding = CatalogSeeding(timeout=app.config['CATALOG_SEED_TIMEOUT'])
 
-    def non_async_populate_catalog(self, artists, catalog):
-        limit = 15
-        return random_catalog(artists, limit, catalog)
+
+_broker_errors = None
+
+
+def broker_errors():
+    ''' Exceptions raised when the celery broker can't be reached.'''
+    global _broker_errors
+    if _broker_errors is None:
+        _broker_errors = (celery.connection().connection_errors +
+                          (socket.error,))
+    return _broker_errors
 
 
-@celery.task(name='saved_tracks')
 def get_user_saved_tracks(spotipy):
     '''
     Returns a set of all artists found
     within the current Spotify user's saved tracks.
     '''
-    offset = 0  # this set will be deleted if later we returns tracks instead of artists
-    artists = set()
-    while True:
-        albums = spotipy.current_user_saved_tracks(limit=50, offset=offset)
-        if not albums['items']:
-            break
-        batch = {item['track']['artists'][0]['name']
-                    for item in albums['items']}
-        artists.update(batch)
-
-        offset += len(albums['items'])
-    return artists
+    items = fetch_offset_pages(spotipy.current_user_saved_tracks, limit=50,
+                               concurrency=app.config['SPOTIFY_PAGE_CONCURRENCY'])
+    return {item['track']['artists'][0]['name'] for item in items}
 
 
-@celery.task(name='saved_playlists')
 def get_user_playlists(spotipy):
     '''
     Returns set of all artists found
     within the current Spotify user's playlists.
     '''
-    def show_tracks(results):
-        '''
-        helper function for get_user_playlists()
-        '''
-        for i, item in enumerate(tracks['items']):
-            track = item['track']
-            playlist_artists_list.append(track['artists'][0]['name'])
-
-    playlist_artists_list = []
-    offset = 0
-    user_id = spotipy.current_user()['id']
-    playlists = spotipy.user_playlists(user_id)
-
-    for playlist in playlists['items']:
-        owner = playlist['owner']['id']
-        results = spotipy.user_playlist(owner, playlist['id'],
-                                        fields="tracks,next")
-        tracks = results['tracks']
-        show_tracks(tracks)
-        while tracks['next']:
-            tracks = spotipy.next(tracks)
-    return set(playlist_artists_list)
+    return playlist_harvester.harvest(spotipy)
 
 
-@celery.task(name='followed_users')
 def get_user_followed(spotipy):
     '''
     Return a set of artists followed by the current user on Spotify.
     '''
-    followed = spotipy.current_user_followed_artists()
-    artists = {artist['name'] for artist in followed['artists']['items']}
+    # followed artists are cursor-paginated, so pages are read in sequence
+    return {name for batch in followed_artist_batches(spotipy)
+            for name in batch}
+
+
+PREFERENCE_SOURCES = {'saved_tracks': get_user_saved_tracks,
+                      'playlists': get_user_playlists,
+                      'followed': get_user_followed}
+
+
+@celery.task(name='user_preferences')
+def user_preferences(source, user_id):
+    '''
+    Returns the artists (a sorted list) found in one of the
+    PREFERENCE_SOURCES of the Spotify user at user_id.
+    '''
+    return sorted(PREFERENCE_SOURCES[source](user_client(user_id)))
+
+
+def stream_user_preferences(spotipy):
+    '''
+    Yields batches of artists from a spotify user's saved tracks, playlists
+    and followed artists as their pages arrive (the three harvested
+    concurrently), each artist only once.
+    '''
+    concurrency = app.config['SPOTIFY_PAGE_CONCURRENCY']
+    batches = unique_batches(merge_batches([
+        saved_track_batches(spotipy, concurrency),
+        playlist_harvester.batches(spotipy),
+        followed_artist_batches(spotipy)]))
+    return (index_artists(batch) for batch in batches)
+
+
+class CatalogSeeder(object):
+    '''
+    Seeds a catalog with up to `budget` artists taken from a stream of
+    artist batches: a random few (at most `per_batch`) of every batch, so
+    that the seed isn't drawn from whichever source answers first. Once
+    the stream ends, finish() fills what is left of the budget from the
+    artists passed over.
+    '''
+
+    def __init__(self, catalog, budget=15, per_batch=3):
+        self.catalog = catalog
+        self.budget = budget
+        self.per_batch = per_batch
+        self.seeded = 0
+        self.passed_over = []
+
+    @property
+    def full(self):
+        return self.seeded >= self.budget
+
+    def feed(self, batch):
+        if self.full:
+            return
+        take = min(self.per_batch, self.budget - self.seeded, len(batch))
+        chosen = random.sample(batch, take)
+        self.passed_over.extend(name for name in batch if name not in chosen)
+        self._seed(chosen)
+
+    def finish(self):
+        take = min(self.budget - self.seeded, len(self.passed_over))
+        if take > 0:
+            self._seed(random.sample(self.passed_over, take))
+        self.passed_over = []
+
+    def _seed(self, artists):
+        if artists:
+            ticket = insert_to_catalog(self.catalog, artists)
+            track_catalog_ticket(self.catalog.id, ticket)
+            self.seeded += len(artists)
+
+
+def stream_preferences(spotipy, catalog, save, first=10, budget=15):
+    '''
+    Harvests a user's artists in streaming mode: every batch of new artists
+    is handed to save(batch) and to a CatalogSeeder for catalog. Returns as
+    soon as `first` artists are seeded (or the harvest is over); the rest
+    of the harvest carries on in a green thread.
+    '''
+    seeder = CatalogSeeder(catalog, budget, per_batch=max(1, budget // 3))
+    batches = stream_user_preferences(spotipy)
+
+    def consume(stop_at):
+        for batch in batches:
+            save(batch)
+            seeder.feed(batch)
+            if seeder.seeded >= stop_at:
+                return False
+        seeder.finish()
+        logger.info('..... Streamed harvest done, catalog seeded with %d '
+                    'artists', seeder.seeded)
+        return True
+
+    def carry_on():
+        try:
+            consume(float('inf'))
+        except Exception as e:
+            logger.error('..... Streamed harvest failed: %s', e)
+
+    if not consume(min(first, budget)):
+        eventlet.spawn_n(carry_on)
+    return seeder.seeded
+
+
+def index_artists(artists):
+    ''' Adds harvested (or found) artists to the artist index, so they
+    can be searched locally. Returns artists.'''
+    if artists:
+        artist_index.add(artists)
     return artists
 
 
+def search_artists(name, limit=None, remote=True):
+    '''
+    Returns artists matching a search query (name prefix or a misspelt
+    name) from the local artist index. Echonest is only searched, with
+    remote, when the index has nothing; what it finds is indexed.
+    False if no artists were found.
+    '''
+    results = artist_index.search(name, limit or app.config['ARTIST_SEARCH_LIMIT'])
+    if results or not remote:
+        return results or False
+    return index_artists(search_artist_echonest(name))
+
+
 def search_artist_echonest(name):
     '''
     Returns array of artists based on search query to Echonest API.
@@ -213,11 +358,11 @@ def search_artist_echonest(name):
 
 def create_playlist(spotipy, user_id, name_playlist):
     '''
-    Creates a spotify playlist for user at user_id.
+    Creates a spotify playlist for user at user_id, returns its ID.
     '''
-    spotipy.user_playlist_create(user_id, name_playlist, public=True)
-    logger.warning("..... Playlist created")
-    return
+    playlist = spotipy.user_playlist_create(user_id, name_playlist, public=True)
+    logger.info("..... Playlist created")
+    return playlist['id']
 
 
 def add_songs_to_playlist(spotipy, user_id, playlist_id, id_songs):
@@ -226,7 +371,7 @@ def add_songs_to_playlist(spotipy, user_id, playlist_id, id_songs):
     into a specified playlist.
     '''
     spotipy.user_playlist_add_tracks(user_id, playlist_id, id_songs)
-    logger.warning("..... All songs added to playlist.")
+    logger.info("..... All songs added to playlist.")
     return
 
 
@@ -244,79 +389,153 @@ def get_id_from_playlist(spotipy, user_id, name_playlist):
     return 
 
 
-def insert_to_catalog(catalog, item):
+def insert_to_catalog(catalog, artists):
     '''
-    Wraps process_to_item funciton, returns catalog status ticket.
+    Wraps process_to_item funciton, sending one or more artists to the
+    catalog as a single bulk update. Returns catalog status ticket.
     '''
-    ready = process_to_item(item)
+    if isinstance(artists, basestring):
+        artists = [artists]
+    ready = [process_to_item(artist)[0] for artist in artists]
     ticket = catalog.update(ready)
+    remember_catalog_artists(catalog.id, artists)
     return ticket
 
 
+def _catalog_artists_key(catalog_id):
+    return 'catalog:{}:artists'.format(catalog_id)
+
+
+def remember_catalog_artists(catalog_id, artists):
+    '''
+    Keeps the names of artists sent to a catalog in redis, for
+    catalog_artists, and starts fetching their tracks for seed_playlist.
+    '''
+    artists = list(artists)
+    if not artists:
+        return
+    key = _catalog_artists_key(catalog_id)
+    try:
+        pipe = redis_store.pipeline(transaction=False)
+        pipe.sadd(key, *[name.encode('utf-8') if isinstance(name, unicode)
+                         else name for name in artists])
+        pipe.expire(key, app.config['CATALOG_ARTISTS_TTL'])
+        pipe.execute()
+    except RedisError:
+        logger.warning("Catalog artists of %s not kept, redis unavailable.",
+                       catalog_id)
+    track_features.prefetch(artists)
+
+
 def process_to_item(artist):
     ''' Converts artist or song object into a formatted
-    item to be inserted into a Catalog object.'''
+    item to be inserted into a Catalog object. The item_id is derived
+    from the artist name, so inserting an artist twice updates the same
+    catalog item instead of adding a duplicate.'''
+    name = artist.encode('utf-8') if isinstance(artist, unicode) else artist
     item = [{}]
     item[0]['action'] = 'update'
     item[0]['item'] = {}
+    item[0]['item']['item_id'] = hashlib.md5(name.lower()).hexdigest()
     item[0]['item']['artist_name'] = artist
     return item
 
 
+def track_catalog_ticket(catalog_id, ticket):
+    '''
+    Follows up on a catalog update ticket in the background.
+    '''
+    if app.config['IS_ASYNC']:
+        catalog_ticket_status.apply_async(args=(catalog_id, ticket),
+                                          countdown=2)
+    return
+
+
+@celery.task(name='catalog_ticket_status', bind=True,
+             max_retries=10, ignore_result=True)
+def catalog_ticket_status(self, catalog_id, ticket):
+    '''
+    Polls Echonest for the status of a catalog update ticket,
+    retrying while the update is still pending.
+    '''
+    status = Catalog(catalog_id).status(ticket)
+    state = status.get('ticket_status')
+    if state == 'pending':
+        raise self.retry(countdown=2)
+    if state == 'complete':
+        logger.debug('..... Catalog %s update %s complete (%s items)',
+                     catalog_id, ticket, status.get('items_updated'))
+    else:
+        logger.error('..... Catalog %s update %s ended as %s', catalog_id,
+                     ticket, state)
+    return
+
+
+def catalog_artists(catalog):
+    '''
+    Returns the artist names stored in a catalog object (or catalog ID),
+    as kept by remember_catalog_artists; the catalog is only read back from
+    Echonest if they aren't.
+    '''
+    catalog_id = catalog if isinstance(catalog, basestring) else catalog.id
+    try:
+        names = redis_store.smembers(_catalog_artists_key(catalog_id))
+    except RedisError:
+        names = None
+    if names:
+        return {name.decode('utf-8') for name in names}
+    if isinstance(catalog, basestring):
+        catalog = Catalog(catalog)
+    names = set()
+    for item in catalog.get_item_dicts(results=1000):
+        name = item.get('artist_name') or item.get('request', {}).get('artist_name')
+        if name:
+            names.add(name)
+    if names:
+        remember_catalog_artists(catalog_id, names)
+    return names
+
+
+def _parameter(value):
+    return 0.5 if value in (None, '') else float(value)
+
+
 def seed_playlist(catalog, danceability=0.5, hotttnesss=0.5,
                   energy=0.5, variety=0.5, adventurousness=0.5,
                   results=50):
     '''
-    Seed playlist and return playlist parameterized by args.
+    Seed playlist and return playlist parameterized by args. Tracks of the
+    catalog's artists are selected locally by the PlaylistEngine.
     '''
-    pl = playlist.static(type='catalog-radio', seed_catalog=catalog,
-                         min_danceability=danceability, artist_min_hotttnesss=hotttnesss,
-                         min_energy=energy, variety=variety, adventurousness=adventurousness,
-                         distribution='focused', artist_pick='song_hotttnesss-desc',
-                         sort='artist_familiarity-desc', results=results)
-    logger.warning('..... Songs in playslist: {}'.format(len(pl)))
+    pool = track_features.tracks(catalog_artists(catalog))
+    pl = playlist_engine.select(pool, danceability=_parameter(danceability),
+                                hotttnesss=_parameter(hotttnesss),
+                                energy=_parameter(energy),
+                                variety=_parameter(variety),
+                                adventurousness=_parameter(adventurousness),
+                                results=results)
+    logger.debug('..... Songs in playlist: %d', len(pl))
     return pl
 
 
 @celery.task(name='random_catalog')
 def random_catalog(artists, limit=15, catalog=None):
     '''
-    Inserts a number of artists into a catalog object based on
-    random selection from iterable of artists.
+    Inserts a number of artists into a catalog object (or catalog ID) based
+    on random selection from iterable of artists. Artists are sampled without
+    replacement and inserted with a single bulk update. Returns the catalog ID.
     '''
     if not catalog:
         catalog = Catalog('your_catalog', 'general')
+    elif isinstance(catalog, basestring):
+        catalog = Catalog(catalog)
     artists = list(artists)
-    for _ in xrange(limit):
-        choice = random.choice(artists)
-        artists.remove(choice)
-        insert_to_catalog(catalog, choice)
-    logger.warning('..... Catalog (or catalog chunk) generated')
-    return catalog
-
-
-@celery.task(name='song_ids')
-def get_songs_id(spotipy, playlist, offset):
-    '''
-    Returns list of song IDs for each song in echonest playlist object.
-    '''
-    songs_id = []
-    # full playlist
-    if offset is None:
-        playlist = playlist
-    # playlist chunk
-    elif isinstance(offset, int):
-        playlist = playlist[offset:offset + 10]
-    for item in playlist:
-        q = "track:{} artist:{}".format(item.title.encode('utf-8'),
-                                        item.artist_name.encode('utf-8'))
-
-        result = spotipy.search(q, type='track', limit=1)
-        if not result['tracks'].get('items'):
-            continue
-        spotify_id = spotipy.search(q, type='track', limit=1)['tracks']['items'][0]['id']
-        songs_id.append(spotify_id)
-    return songs_id
+    chosen = random.sample(artists, min(limit, len(artists)))
+    if chosen:
+        ticket = insert_to_catalog(catalog, chosen)
+        track_catalog_ticket(catalog.id, ticket)
+    logger.debug('..... Catalog (or catalog chunk) generated')
+    return catalog.id
 
 
 def generate_urlslug(user_id):
@@ -339,3 +558,5 @@ def sanitize_url_slug(url_slug):
     sanitized = ''.join(process)
     return sanitized
 
+
+instrument(globals(), 'helpers')
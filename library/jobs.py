@@ -0,0 +1,176 @@
+import uuid
+
+from celery import chord
+from . import app, celery, redis_store
+from .spotify_client import user_client
+from .metrics import instrument
+from . import helpers
+from . import db
+
+
+class JobProgress(object):
+    '''
+    Progress of background playlist generation jobs, kept as a redis hash
+    per job so that any web worker can answer status polls:
+
+        state     -- queued | seeding | resolving | writing | done | failed
+        total     -- number of seeded tracks
+        resolved  -- number of tracks looked up on Spotify so far
+        found     -- number of those that matched a Spotify track
+        playlist_url, error
+    '''
+
+    def __init__(self, store, ttl=3600, prefix='playlist_job'):
+        self.store = store
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, job_id):
+        return '{}:{}'.format(self.prefix, job_id)
+
+    def create(self, url_slug):
+        job_id = uuid.uuid4().hex
+        self.update(job_id, state='queued', url_slug=url_slug,
+                    total=0, resolved=0, found=0)
+        return job_id
+
+    def update(self, job_id, **fields):
+        pipe = self.store.pipeline()
+        pipe.hmset(self._key(job_id), fields)
+        pipe.expire(self._key(job_id), self.ttl)
+        pipe.execute()
+
+    def resolved(self, job_id, looked_up, found):
+        pipe = self.store.pipeline()
+        pipe.hincrby(self._key(job_id), 'resolved', looked_up)
+        pipe.hincrby(self._key(job_id), 'found', found)
+        pipe.execute()
+
+    def get(self, job_id):
+        progress = self.store.hgetall(self._key(job_id))
+        if not progress:
+            return None
+        for field in ('total', 'resolved', 'found'):
+            progress[field] = int(progress.get(field, 0))
+        return progress
+
+
+progress = JobProgress(redis_store, ttl=app.config['PLAYLIST_JOB_TTL'])
+
+
+def start_playlist_job(url_slug, catalog_id, user_id, name, parameters,
+                       playlist_id=None, playlist_url=None):
+    '''
+    Starts generating the playlist of the festival at url_slug and returns
+    the job ID right away. The playlist is seeded from the festival catalog,
+    its track IDs resolved in chunks and written to Spotify - either to a new
+    playlist called name or to the existing playlist_id.
+
+    Every stage is sent user_id only and fetches a current access token
+    from the shared token store (see spotify_client.user_client). The
+    job is seeded once the festival's catalog updates still running
+    (helpers.catalog_seeding) are done, or after CATALOG_SEED_TIMEOUT.
+    '''
+    job_id = progress.create(url_slug)
+    job = (job_id, url_slug, catalog_id, user_id, name,
+           parameters, playlist_id, playlist_url)
+    seeding = helpers.catalog_seeding.pending(url_slug)
+    timeout = app.config['CATALOG_SEED_TIMEOUT']
+    if app.config['IS_ASYNC']:
+        if seeding:
+            seeding.on_done(lambda _: seed_stage.delay(*job), timeout=timeout)
+        else:
+            seed_stage.delay(*job)
+    else:
+        if seeding and not seeding.wait(timeout):
+            app.logger.warning("Job '%s' seeds from a catalog still being "
+                               "updated", job_id)
+        seed_stage(*job)
+    return job_id
+
+
+@celery.task(name='playlist_job_seed', ignore_result=True)
+def seed_stage(job_id, url_slug, catalog_id, user_id, name,
+               parameters, playlist_id=None, playlist_url=None):
+    '''
+    First stage of a playlist job: seeds the playlist, then resolves its
+    tracks in chunks (a chord whose callback writes the playlist).
+    '''
+    progress.update(job_id, state='seeding')
+    try:
+        playlist = helpers.seed_playlist(catalog_id, **parameters)
+    except Exception as e:
+        progress.update(job_id, state='failed', error='Could not seed playlist.')
+        app.logger.error("Job '%s' failed seeding: %s", job_id, e)
+        raise
+    tracks = [[track.title, track.artist_name] for track in playlist]
+    if not tracks:
+        # no empty playlist on Spotify for a festival with nothing to play
+        progress.update(job_id, state='failed',
+                        error='No tracks matched the festival.')
+        app.logger.warning("Job '%s' seeded no tracks", job_id)
+        return
+    progress.update(job_id, state='resolving', total=len(tracks))
+
+    chunk_size = app.config['PLAYLIST_JOB_CHUNK_SIZE']
+    chunks = [tracks[i:i + chunk_size] for i in xrange(0, len(tracks), chunk_size)]
+    write = (job_id, url_slug, user_id, name, playlist_id, playlist_url)
+    if app.config['IS_ASYNC']:
+        chord(resolve_stage.s(chunk, job_id, user_id)
+              for chunk in chunks)(write_stage.s(*write))
+    else:
+        write_stage([resolve_stage(chunk, job_id, user_id)
+                     for chunk in chunks], *write)
+    return
+
+
+@celery.task(name='playlist_job_resolve')
+def resolve_stage(tracks, job_id, user_id):
+    '''
+    Resolves a chunk of (title, artist) pairs to Spotify track IDs.
+    A failing chunk is reported and skipped, not fatal to the job.
+    '''
+    try:
+        songs_id = helpers.track_resolver.resolve(user_client(user_id), tracks)
+    except Exception as e:
+        app.logger.error("Job '%s' could not resolve a chunk: %s", job_id, e)
+        songs_id = []
+    progress.resolved(job_id, len(tracks), len(songs_id))
+    return songs_id
+
+
+@celery.task(name='playlist_job_write', ignore_result=True)
+def write_stage(chunks, job_id, url_slug, user_id, name,
+                playlist_id=None, playlist_url=None):
+    '''
+    Last stage of a playlist job: creates the festival playlist (unless
+    one is given) and adds the resolved songs to it. Fails, writing
+    nothing, if none were found on Spotify.
+    '''
+    songs_id = [song_id for chunk in chunks for song_id in chunk]
+    if not songs_id:
+        progress.update(job_id, state='failed',
+                        error='None of the tracks were found on Spotify.')
+        app.logger.warning("Job '%s' resolved no tracks", job_id)
+        return
+    progress.update(job_id, state='writing')
+    s = user_client(user_id)
+    try:
+        if not playlist_id:
+            playlist_id = helpers.create_playlist(s, user_id, name)
+            playlist_url = ('https://embed.spotify.com/?uri=spotify:user:'
+                            '{}:playlist:{}'.format(user_id, playlist_id))
+            db.update_festival(name, url_slug, playlist_id, playlist_url)
+        helpers.add_songs_to_playlist(s, user_id, playlist_id, songs_id)
+    except Exception as e:
+        progress.update(job_id, state='failed',
+                        error='Could not write the playlist to Spotify.')
+        app.logger.error("Job '%s' failed writing: %s", job_id, e)
+        raise
+    progress.update(job_id, state='done', playlist_url=playlist_url)
+    app.logger.info("Playlist for festival '%s' successfully generated",
+                    url_slug)
+    return
+
+
+instrument(globals(), 'jobs')
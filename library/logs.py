@@ -0,0 +1,138 @@
+'''
+Logging off the request path: BackgroundHandler hands records to a writer
+thread that formats and writes them, so a request only pays for creating
+the records its logger level lets through. Log with lazy arguments
+(logger.debug("... %s", value)) so that nothing is formatted before then.
+Only a record with arguments that may change meanwhile (anything but
+strings and numbers) is formatted by the thread that logs it.
+'''
+import os
+import logging
+import eventlet.patcher
+
+
+# the writer is a real OS thread: neither its queue nor the locks it
+# shares with the green threads may be green
+threading = eventlet.patcher.original('threading')
+Queue = eventlet.patcher.original('Queue')
+
+_tracebacks = logging.Formatter()
+
+# arguments the writer can format later: immutable, the same then as now
+_SAFE_ARGS = (basestring, int, long, float, bool, type(None))
+
+
+class SamplingFilter(logging.Filter):
+    '''
+    Lets one in every[level] records of each call site through, for the
+    levels listed (e.g. {'DEBUG': 10}); records of other levels all pass.
+    '''
+
+    def __init__(self, every):
+        logging.Filter.__init__(self)
+        self.every = {logging.getLevelName(level) if isinstance(level, str)
+                      else level: n for level, n in every.items()}
+        self._seen = {}
+
+    def filter(self, record):
+        every = self.every.get(record.levelno, 1)
+        if every <= 1:
+            return True
+        site = (record.pathname, record.lineno)
+        seen = self._seen.get(site, 0)
+        self._seen[site] = seen + 1
+        return seen % every == 0
+
+
+class BackgroundHandler(logging.Handler):
+    '''
+    Queues records for a writer thread that passes them on to `handlers`.
+    At most `capacity` records wait; more are dropped, and counted in a
+    warning once the writer catches up. The thread is started by the first
+    record each process logs, so forked celery workers get their own.
+    '''
+
+    def __init__(self, handlers, capacity=10000):
+        logging.Handler.__init__(self)
+        self.handlers = list(handlers)
+        self.capacity = capacity
+        self.dropped = 0
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def createLock(self):
+        self.lock = threading.RLock()
+
+    def _start(self):
+        # fresh locks: in a forked process the parent's writer may have
+        # been holding them
+        for handler in self.handlers:
+            handler.lock = threading.RLock()
+        self._pid = os.getpid()
+        self._queue = Queue.Queue(self.capacity)
+        self._thread = threading.Thread(target=self._write, args=(self._queue,),
+                                        name='log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def prepare(self, record):
+        ''' Formats what may change, or not be safe to read, by the time the
+        writer gets to the record: the message, if it has other arguments
+        than strings and numbers, and the traceback, if any.'''
+        # a single dict argument is record.args itself
+        args = record.args or ()
+        if not (isinstance(record.msg, basestring) and
+                isinstance(args, tuple) and
+                all(isinstance(arg, _SAFE_ARGS) for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = _tracebacks.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _write(self, queue):
+        while True:
+            record = queue.get()
+            if record is None:
+                return
+            self._handle(record)
+            if self.dropped and queue.empty():
+                dropped, self.dropped = self.dropped, 0
+                self._handle(logging.LogRecord(
+                    record.name, logging.WARNING, __file__, 0,
+                    "%d log records dropped, the log writer fell behind.",
+                    (dropped,), None))
+
+    def _handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                # an error must not end the writer, and with it the log
+                try:
+                    handler.handle(record)
+                except Exception:
+                    handler.handleError(record)
+
+    def close(self, timeout=5):
+        ''' Writes the records still queued (for at most timeout s).'''
+        if self._thread is not None and self._pid == os.getpid():
+            try:
+                self._queue.put(None, timeout=timeout)
+                self._thread.join(timeout)
+            except Queue.Full:
+                pass
+            self._thread = None
+        for handler in self.handlers:
+            handler.close()
+        logging.Handler.close(self)
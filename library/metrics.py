@@ -0,0 +1,345 @@
+'''
+Instrumentation of the app, served in the Prometheus text format at
+/metrics:
+
+    spotifest_request_seconds            latency per route
+    spotifest_request_external_calls     Spotify / Echonest calls per request
+    spotifest_function_seconds           every db.*, helpers.* function and
+                                         celery task (instrument(...))
+    spotifest_external_call_seconds      every Spotify / Echonest API call
+    spotifest_celery_queue_length        messages waiting in the broker
+
+plus the stats() of the connection pool, rate limiter, track resolver and
+task payloads, registered with Metrics.gauge(...).
+'''
+import json
+import bisect
+import time
+import types
+import inspect
+import logging
+import functools
+
+from collections import defaultdict
+from flask import g, request, has_request_context
+from redis import RedisError
+from celery import Task
+from celery.signals import worker_process_shutdown
+from . import app, redis_store, celery, db_pool
+
+
+logger = logging.getLogger('library')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+CALL_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SERVICES = ('spotify', 'echonest')
+
+
+def _number(value):
+    return '+Inf' if value == '+Inf' else repr(float(value))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (unicode(value).replace('\\', r'\\').replace('"', r'\"')
+               .replace('\n', r'\n') for _, value in labels)
+    return '{' + ','.join('{}="{}"'.format(name, value) for (name, _), value
+                          in zip(labels, escaped)) + '}'
+
+
+class Metrics(object):
+    '''
+    Counters and histograms shared by every web and celery worker. Each
+    process adds its observations up in a dict and flushes the increments
+    to a redis hash at most every `flush_interval` seconds, so recording a
+    value costs a few dict updates; render() reports the totals of every
+    process. Gauges are read when rendering, from the process answering.
+    '''
+
+    def __init__(self, store, key='metrics', flush_interval=10):
+        self.store = store
+        self.key = key
+        self.flush_interval = flush_interval
+        self.families = {}       # name -> (type, help, buckets)
+        self.gauges = []         # (name, help, label names, collect)
+        self._counters = defaultdict(float)     # (name, labels) -> total
+        self._histograms = {}                   # (name, labels) -> counts
+        self._unsent = {}                       # increments redis refused
+        self._flushed = time.time()
+
+    def counter(self, name, help):
+        self.families[name] = ('counter', help, None)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        self.families[name] = ('histogram', help, buckets)
+
+    def gauge(self, name, help, collect, labels=('stat',)):
+        ''' collect() returns {label value(s): value} when rendering.'''
+        self.gauges.append((name, help, labels, collect))
+
+    def _field(self, name, labels):
+        return '{} {}'.format(name, json.dumps(labels))
+
+    def inc(self, name, labels=(), amount=1):
+        ''' labels: tuple of (name, value) pairs.'''
+        self._counters[name, labels] += amount
+        self.maybe_flush()
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            # a count per bucket (+Inf last), then the sum
+            histogram = [0] * (len(self.families[name][2]) + 2)
+            self._histograms[key] = histogram
+        histogram[bisect.bisect_left(self.families[name][2], value)] += 1
+        histogram[-1] += value
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if time.time() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def _increments(self):
+        ''' Takes the pending observations, as {hash field: increment}.'''
+        counters, self._counters = self._counters, defaultdict(float)
+        histograms, self._histograms = self._histograms, {}
+        increments = {self._field(name, labels): amount
+                      for (name, labels), amount in counters.iteritems()}
+        for (name, labels), histogram in histograms.iteritems():
+            bounds = [_number(bound) for bound in self.families[name][2]]
+            for le, count in zip(bounds + ['+Inf'], histogram):
+                if count:
+                    increments[self._field(name + '_bucket',
+                                           labels + (('le', le),))] = count
+            increments[self._field(name + '_count', labels)] = sum(histogram[:-1])
+            increments[self._field(name + '_sum', labels)] = histogram[-1]
+        return increments
+
+    def flush(self):
+        self._flushed = time.time()
+        pending = self._increments()
+        for field, amount in self._unsent.iteritems():
+            pending[field] = pending.get(field, 0) + amount
+        self._unsent = {}
+        if not pending:
+            return
+        try:
+            pipe = self.store.pipeline(transaction=False)
+            for field, amount in pending.iteritems():
+                pipe.hincrbyfloat(self.key, field, amount)
+            pipe.execute()
+        except RedisError:
+            logger.warning("Metrics store unavailable, %d series kept for "
+                           "the next flush.", len(pending))
+            self._unsent = pending
+
+    def _family(self, name):
+        for suffix in ('_bucket', '_count', '_sum'):
+            if name.endswith(suffix) and name[:-len(suffix)] in self.families:
+                return name[:-len(suffix)]
+        return name
+
+    def render(self):
+        self.flush()
+        try:
+            totals = self.store.hgetall(self.key)
+        except RedisError:
+            logger.warning("Metrics store unavailable, only gauges rendered.")
+            totals = {}
+        samples = defaultdict(list)
+        for field, value in totals.iteritems():
+            name, labels = field.split(' ', 1)
+            samples[self._family(name)].append(
+                (name, [tuple(label) for label in json.loads(labels)],
+                 float(value)))
+        lines = []
+        for family in sorted(samples):
+            kind, help, buckets = self.families.get(family, ('untyped', '', None))
+            lines.append('# HELP {} {}'.format(family, help))
+            lines.append('# TYPE {} {}'.format(family, kind))
+            if kind == 'histogram':
+                lines.extend(self._histogram(family, buckets, samples[family]))
+            else:
+                lines.extend('{}{} {}'.format(name, _labels(labels), repr(value))
+                             for name, labels, value in sorted(samples[family]))
+        for name, help, label_names, collect in self.gauges:
+            try:
+                values = collect()
+            except Exception as e:
+                logger.warning("Gauge '%s' failed: %s", name, e)
+                continue
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} gauge'.format(name))
+            for key, value in sorted(values.iteritems()):
+                key = key if isinstance(key, tuple) else (key,)
+                if isinstance(value, (int, long, float)):
+                    lines.append('{}{} {}'.format(
+                        name, _labels(zip(label_names, key)), repr(float(value))))
+        return '\n'.join(lines) + '\n'
+
+    def _histogram(self, family, buckets, samples):
+        ''' Cumulative _bucket lines (every bucket), then _sum and _count,
+        for each label set of a histogram.'''
+        counts = defaultdict(dict)
+        totals = defaultdict(dict)
+        for name, labels, value in samples:
+            if name.endswith('_bucket'):
+                counts[tuple(labels[:-1])][labels[-1][1]] = value
+            else:
+                totals[tuple(labels)][name] = value
+        lines = []
+        for labels in sorted(totals):
+            cumulative = 0.0
+            for le in [_number(b) for b in buckets] + ['+Inf']:
+                cumulative += counts[labels].get(le, 0.0)
+                lines.append('{}_bucket{} {}'.format(
+                    family, _labels(list(labels) + [('le', le)]), repr(cumulative)))
+            for suffix in ('_sum', '_count'):
+                lines.append('{}{}{} {}'.format(family, suffix, _labels(labels),
+                                                repr(totals[labels].get(family + suffix, 0.0))))
+        return lines
+
+
+metrics = Metrics(redis_store, flush_interval=app.config['METRICS_FLUSH_INTERVAL'])
+metrics.histogram('spotifest_request_seconds', 'Time to answer a request, per route.')
+metrics.histogram('spotifest_request_external_calls',
+                  'Spotify / Echonest API calls made while answering a request.',
+                  buckets=CALL_BUCKETS)
+metrics.histogram('spotifest_function_seconds',
+                  'Time spent in db and helper functions and celery tasks.')
+metrics.counter('spotifest_function_errors_total',
+                'Exceptions raised by db and helper functions and celery tasks.')
+metrics.histogram('spotifest_external_call_seconds',
+                  'Spotify / Echonest API calls, throttling and retries included.')
+metrics.counter('spotifest_external_call_errors_total',
+                'Spotify / Echonest API calls that failed.')
+
+
+def timed(name, func):
+    ''' Wraps func to record its duration (and exceptions) as `name`.'''
+    labels = (('function', name),)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.time()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            metrics.inc('spotifest_function_errors_total', labels)
+            raise
+        finally:
+            metrics.observe('spotifest_function_seconds', labels,
+                            time.time() - started)
+    wrapper.timed = True
+    return wrapper
+
+
+def instrument(namespace, component):
+    ''' Times every public function of a module (given its globals()) as
+    "<component>.<name>", and every celery task it defines as
+    "task.<task name>" (whether called directly or run by a worker).
+    Generator functions are left alone: calling them does no work.'''
+    module = namespace['__name__']
+    for name, obj in namespace.items():
+        if name.startswith('_'):
+            continue
+        if isinstance(obj, Task):
+            # obj is a proxy: its own __module__ is celery's
+            if (obj.run.__module__ == module
+                    and not getattr(obj.run, 'timed', False)):
+                obj.run = timed('task.' + obj.name, obj.run)
+        elif (isinstance(obj, types.FunctionType) and obj.__module__ == module
+              and not inspect.isgeneratorfunction(obj)):
+            namespace[name] = timed('{}.{}'.format(component, name), obj)
+
+
+def request_calls():
+    ''' Tally of the external calls of the current request ({service:
+    calls}), None outside of a request.'''
+    if has_request_context():
+        return getattr(g, 'external_calls', None)
+    return None
+
+
+def external_call(service, call, started, error=False, calls=None):
+    ''' Records an API call to service that started at `started`, on the
+    `calls` tally (see request_calls) if given, else the current one.'''
+    labels = (('service', service), ('call', call))
+    metrics.observe('spotifest_external_call_seconds', labels,
+                    time.time() - started)
+    if error:
+        metrics.inc('spotifest_external_call_errors_total', labels)
+    if calls is None:
+        calls = request_calls()
+    if calls is not None:
+        calls[service] += 1
+
+
+def timed_external(service, func, call):
+    ''' Wraps func, an API call to service; call(*args, **kwargs) names it.'''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.time()
+        failed = True
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            external_call(service, call(*args, **kwargs), started, failed)
+    return wrapper
+
+
+@app.before_request
+def start_request():
+    g.request_started = time.time()
+    g.external_calls = defaultdict(int)
+
+
+@app.after_request
+def response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def record_request(exception=None):
+    started = getattr(g, 'request_started', None)
+    if started is None:
+        return
+    route = request.endpoint or 'unknown'
+    metrics.observe('spotifest_request_seconds',
+                    (('route', route), ('method', request.method),
+                     ('status', str(getattr(g, 'response_status', 500)))),
+                    time.time() - started)
+    for service in SERVICES:
+        metrics.observe('spotifest_request_external_calls',
+                        (('route', route), ('service', service)),
+                        g.external_calls.get(service, 0))
+
+
+@worker_process_shutdown.connect
+def flush_on_shutdown(**kwargs):
+    metrics.flush()
+
+
+def celery_queue_lengths():
+    ''' Messages waiting in each of METRICS_CELERY_QUEUES.'''
+    lengths = {}
+    with celery.connection() as connection:
+        connection.ensure_connection(max_retries=1)
+        channel = connection.default_channel
+        for queue in app.config['METRICS_CELERY_QUEUES']:
+            lengths[queue] = channel.queue_declare(queue=queue,
+                                                   passive=True).message_count
+    return lengths
+
+
+metrics.gauge('spotifest_celery_queue_length',
+              'Messages waiting in the celery broker.', celery_queue_lengths,
+              labels=('queue',))
+metrics.gauge('spotifest_db_pool', 'MySQL connection pool of this process.',
+              db_pool.stats)
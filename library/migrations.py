@@ -0,0 +1,253 @@
+'''
+Versioned schema migrations of the spotifest database.
+
+Applied migrations are recorded in the schema_version table, so running
+the migrations again only applies the ones added since:
+
+    python -m library.migrations upgrade
+    python -m library.migrations check      # EXPLAIN the hot queries
+
+Migration 1 is the schema of mysqlScript.sql, so databases created with
+that script are upgraded in place. MySQL commits DDL implicitly, so a
+migration that fails halfway has to be finished by hand.
+'''
+import sys
+import argparse
+import logging
+
+from collections import namedtuple
+from . import db_pool
+
+
+logger = logging.getLogger('library')
+
+
+Migration = namedtuple('Migration', ['version', 'description', 'statements'])
+
+MIGRATIONS = [
+    Migration(1, 'sessions and contributors tables', [
+        '''CREATE TABLE IF NOT EXISTS sessions (
+            festivalId int(10) NOT NULL AUTO_INCREMENT,
+            festivalName varchar(100) NOT NULL,
+            userId varchar(30) NOT NULL,
+            playlistId varchar(30) NOT NULL,
+            playlistURL varchar(512) NOT NULL,
+            catalogId varchar(30) NOT NULL,
+            urlSlug varchar (512) NOT NULL,
+            createTime DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (festivalId)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS contributors (
+            festivalId int (10) NOT NULL,
+            userId varchar(30) NOT NULL,
+            ready boolean DEFAULT 0 NOT NULL,
+            hotness decimal(4,3),
+            danceability decimal(4,3),
+            energy decimal(4,3),
+            variety decimal(4,3),
+            adventurousness decimal(4,3),
+            organizer boolean DEFAULT 0 NOT NULL,
+            CONSTRAINT FOREIGN KEY (festivalId) REFERENCES sessions(festivalId)
+                ON DELETE CASCADE,
+            CONSTRAINT festival_user UNIQUE (festivalId, userId)
+        )''',
+    ]),
+    # url slugs are 7 characters (helpers.generate_urlslug); 64 keeps the
+    # unique index well within InnoDB's key length limit
+    Migration(2, 'index festival lookups, expiry and user festivals', [
+        '''ALTER TABLE sessions
+            MODIFY urlSlug varchar(64) NOT NULL,
+            ADD UNIQUE INDEX sessions_urlSlug (urlSlug),
+            ADD INDEX sessions_createTime (createTime)''',
+        '''ALTER TABLE contributors
+            ADD INDEX contributors_userId (userId)''',
+    ]),
+    # running aggregates of the contributors of each festival, maintained
+    # by db.save_contributor / db.update_parameters in their transaction
+    Migration(3, 'festival_stats table', [
+        '''CREATE TABLE festival_stats (
+            festivalId int(10) NOT NULL,
+            contributors int NOT NULL DEFAULT 0,
+            ready int NOT NULL DEFAULT 0,
+            rated int NOT NULL DEFAULT 0,
+            hotness decimal(12,3) NOT NULL DEFAULT 0,
+            danceability decimal(12,3) NOT NULL DEFAULT 0,
+            energy decimal(12,3) NOT NULL DEFAULT 0,
+            variety decimal(12,3) NOT NULL DEFAULT 0,
+            adventurousness decimal(12,3) NOT NULL DEFAULT 0,
+            PRIMARY KEY (festivalId),
+            CONSTRAINT FOREIGN KEY (festivalId) REFERENCES sessions(festivalId)
+                ON DELETE CASCADE
+        )''',
+        '''INSERT INTO festival_stats
+            SELECT s.festivalId,
+                COALESCE(SUM(c.organizer = 0), 0),
+                COALESCE(SUM(c.organizer = 0 AND c.ready = 1), 0),
+                COUNT(c.hotness),
+                COALESCE(SUM(c.hotness), 0), COALESCE(SUM(c.danceability), 0),
+                COALESCE(SUM(c.energy), 0), COALESCE(SUM(c.variety), 0),
+                COALESCE(SUM(c.adventurousness), 0)
+            FROM sessions as s LEFT JOIN contributors as c
+                on c.festivalId = s.festivalId
+            GROUP BY s.festivalId''',
+    ]),
+    # artist preferences (cache_backends.DatabasePreferenceBackend): names
+    # interned once in artists, one int per artist of a user in a festival.
+    # Rows are written before their festival, so keyed by urlSlug, no FK.
+    # utf8 (3 bytes) keeps the unique name index within 767 bytes.
+    Migration(4, 'artists dictionary and preferences tables', [
+        '''CREATE TABLE artists (
+            artistId int NOT NULL AUTO_INCREMENT,
+            name varchar(255) NOT NULL,
+            PRIMARY KEY (artistId),
+            UNIQUE INDEX artists_name (name)
+        ) DEFAULT CHARSET=utf8 COLLATE=utf8_bin''',
+        '''CREATE TABLE preferences (
+            urlSlug varchar(64) NOT NULL,
+            userId varchar(30) NOT NULL,
+            artistId int NOT NULL,
+            PRIMARY KEY (urlSlug, userId, artistId),
+            INDEX preferences_userId (userId),
+            CONSTRAINT FOREIGN KEY (artistId) REFERENCES artists(artistId)
+        )''',
+    ]),
+    # bumped with every write to a festival's page (db._bump_version): the
+    # festival page's ETag and fragment cache keys
+    Migration(5, 'festival versions', [
+        '''ALTER TABLE sessions
+            ADD version int NOT NULL DEFAULT 0''',
+    ]),
+    # utf8mb4 names up to 1024 characters: too long for an index of their
+    # own, so artists are looked up by the MD5 of their UTF-8 name
+    Migration(6, 'utf8mb4 artist names indexed by hash', [
+        '''ALTER TABLE artists
+            DROP INDEX artists_name,
+            CONVERT TO CHARACTER SET utf8mb4 COLLATE utf8mb4_bin''',
+        '''ALTER TABLE artists
+            MODIFY name varchar(1024) NOT NULL,
+            ADD nameHash char(32) CHARACTER SET ascii NOT NULL''',
+        '''UPDATE artists SET nameHash = MD5(name)''',
+        '''ALTER TABLE artists
+            ADD UNIQUE INDEX artists_nameHash (nameHash)''',
+    ]),
+]
+
+
+# (name, query, args, {table: keys it may use}) of the queries run on
+# every page view and by the hourly cleanup
+HOT_QUERIES = [
+    ('load_festival',
+     "SELECT s.festivalId, c.userId FROM sessions as s LEFT JOIN contributors "
+     "as c on c.festivalId = s.festivalId WHERE s.urlSlug = %s",
+     ('abcdefg',),
+     {'s': ('sessions_urlSlug',), 'c': ('festival_user',)}),
+    ('get_user_festivals',
+     "SELECT c.userId, s.festivalId FROM sessions as s INNER JOIN contributors "
+     "as c on s.festivalId = c.festivalId WHERE c.userId = %s",
+     ('spotify_user',),
+     {'s': ('PRIMARY',), 'c': ('contributors_userId',)}),
+    ('get_contributors',
+     "SELECT c.userId, f.ready FROM sessions as s LEFT JOIN contributors as c "
+     "on c.festivalId = s.festivalId LEFT JOIN festival_stats as f "
+     "on f.festivalId = s.festivalId WHERE s.festivalId = %s",
+     (1,),
+     {'s': ('PRIMARY',), 'c': ('festival_user',), 'f': ('PRIMARY',)}),
+    ('expired_festivals',
+     "SELECT festivalId, catalogId, urlSlug FROM sessions WHERE createTime < %s "
+     "AND festivalId > %s ORDER BY festivalId LIMIT 500",
+     ('2000-01-01 00:00:00', 0),
+     {'sessions': ('sessions_createTime', 'PRIMARY')}),
+    ('preferences',
+     "SELECT artistId FROM preferences WHERE urlSlug = %s AND userId = %s",
+     ('abcdefg', 'spotify_user'),
+     {'preferences': ('PRIMARY',)}),
+    ('artists',
+     "SELECT artistId, name FROM artists WHERE nameHash IN (%s)",
+     ('0' * 32,),
+     {'artists': ('artists_nameHash',)}),
+]
+
+
+def current_version(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version ("
+                   "version int NOT NULL, description varchar(255) NOT NULL, "
+                   "appliedTime DATETIME DEFAULT CURRENT_TIMESTAMP, "
+                   "PRIMARY KEY (version))")
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    return cursor.fetchone()[0] or 0
+
+
+def upgrade(pool=db_pool, target=None):
+    ''' Applies the migrations newer than the database's schema version
+    (up to `target`, if given). Returns the versions applied.'''
+    with pool.cursor() as cursor:
+        version = current_version(cursor)
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        if target is not None and migration.version > target:
+            break
+        with pool.cursor() as cursor:
+            for statement in migration.statements:
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_version (version, description) "
+                           "VALUES (%s, %s)", (migration.version,
+                                               migration.description))
+        logger.warning("DB - applied migration %s: %s", migration.version,
+                       migration.description)
+        applied.append(migration.version)
+    return applied
+
+
+def explain(cursor, query, args):
+    ''' Returns the EXPLAIN output of query as one dict per table.'''
+    cursor.execute('EXPLAIN ' + query, args)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def check_indexes(pool=db_pool):
+    ''' EXPLAINs every query in HOT_QUERIES and returns the problems found:
+    a table read with a full scan or through an index other than the ones
+    expected. Run it against a populated database, on (nearly) empty tables
+    MySQL may prefer a full scan.'''
+    problems = []
+    with pool.cursor() as cursor:
+        for name, query, args, expected in HOT_QUERIES:
+            for row in explain(cursor, query, args):
+                keys = expected.get(row['table'])
+                if keys is None:
+                    continue
+                if row['type'] == 'ALL' or row['key'] not in keys:
+                    problems.append('{}: {} read through {} ({}), expected '
+                                    '{}'.format(name, row['table'], row['key'],
+                                                row['type'], ' or '.join(keys)))
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='spotifest schema migrations')
+    parser.add_argument('command', choices=('upgrade', 'check', 'version'))
+    parser.add_argument('--target', type=int,
+                        help='upgrade up to this version only')
+    args = parser.parse_args(argv)
+
+    if args.command == 'upgrade':
+        applied = upgrade(target=args.target)
+        print 'Applied migrations: {}'.format(applied or 'none')
+    elif args.command == 'version':
+        with db_pool.cursor() as cursor:
+            print 'Schema version: {}'.format(current_version(cursor))
+    else:
+        problems = check_indexes()
+        for problem in problems:
+            print problem
+        if problems:
+            return 1
+        print 'All hot queries use their indexes.'
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import numpy as np
+
+
+def popcount(words):
+    ''' Set bits of every uint64 of words, counted in parallel within each
+    word (SWAR); numpy has no popcount of its own.'''
+    words = words - ((words >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    words = ((words & np.uint64(0x3333333333333333)) +
+             ((words >> np.uint64(2)) & np.uint64(0x3333333333333333)))
+    words = (words + (words >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    return (words * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+class Overlap(object):
+    '''
+    How much the artist sets of a festival's contributors overlap, from
+    their interned artist IDs ({user_id: array of IDs}, see
+    cache_backends.ArtistDictionary); `lookup` turns a list of IDs into
+    their names.
+
+        - ids, counts: the festival's artists and how many contributors
+          like each of them
+        - shared[i, j]: artists contributors users[i] and users[j] share
+        - jaccard[i, j]: shared[i, j] / artists of either of them
+
+    Every contributor's set becomes a row of bits over the festival's
+    artist vocabulary; an artist liked by a single contributor can't be
+    shared, so only the others get a bit. The shared counts of a row with
+    all rows below it are a bitwise AND and a popcount over 64-bit words,
+    so the pairwise matrices take n vectorized steps for n contributors.
+    They are only computed when first read: common_ground() and weights()
+    just count the contributors of each artist.
+    '''
+
+    def __init__(self, preferences, lookup):
+        self.users = sorted(user for user, ids in preferences.iteritems()
+                            if ids is not None and len(ids))
+        self.lookup = lookup
+        arrays = [np.asarray(preferences[user], dtype=np.int64)
+                  for user in self.users]
+        self.sizes = np.array([len(ids) for ids in arrays], dtype=np.int64)
+        if arrays:
+            self.ids, self._columns = np.unique(np.concatenate(arrays),
+                                                return_inverse=True)
+        else:
+            self.ids = self._columns = np.zeros(0, dtype=np.int64)
+        # row (contributor) of every entry of _columns
+        self._rows = np.repeat(np.arange(len(self.users)), self.sizes)
+        self.counts = np.bincount(self._columns, minlength=len(self.ids))
+        self._bits = None
+        self._shared = None
+        self._jaccard = None
+
+    def __len__(self):
+        return len(self.users)
+
+    def names(self):
+        ''' Names of the festival's artists, in the order of ids.'''
+        return self.lookup(self.ids.tolist())
+
+    def weights(self):
+        ''' Sampling weight of each of the festival's artists: every
+        contributor brings the same total weight, spread over their
+        artists, and an artist's weight is multiplied by the number of
+        contributors sharing it (a huge library doesn't drown the others,
+        common ground comes first).'''
+        share = 1.0 / self.sizes
+        return (np.bincount(self._columns, weights=share[self._rows],
+                            minlength=len(self.ids)) * self.counts)
+
+    def common_ground(self, limit=None, min_share=2):
+        ''' Names of the artists at least min_share contributors like, the
+        most shared first.'''
+        candidates = np.flatnonzero(self.counts >= min_share)
+        order = np.argsort(-self.counts[candidates], kind='mergesort')
+        chosen = self.ids[candidates[order][:limit]]
+        return [name for name in self.lookup(chosen.tolist()) if name is not None]
+
+    def _bitsets(self):
+        ''' (contributors, words) uint64 bitsets over the shared artists.'''
+        if self._bits is not None:
+            return self._bits
+        shared = self.counts > 1
+        bit = np.cumsum(shared) - 1
+        keep = shared[self._columns]
+        words = (int(shared.sum()) + 63) // 64
+        bits = np.zeros((len(self.users), words * 64), dtype=bool)
+        bits[self._rows[keep], bit[self._columns[keep]]] = True
+        self._bits = np.packbits(bits, axis=1).view(np.uint64)
+        return self._bits
+
+    @property
+    def shared(self):
+        if self._shared is None:
+            n = len(self.users)
+            bitsets = self._bitsets()
+            shared = np.zeros((n, n), dtype=np.int64)
+            for i in xrange(n):
+                row = popcount(bitsets[i] & bitsets[i:]).sum(axis=1,
+                                                             dtype=np.int64)
+                shared[i, i:] = row
+                shared[i:, i] = row
+            shared[np.diag_indices(n)] = self.sizes
+            self._shared = shared
+        return self._shared
+
+    @property
+    def jaccard(self):
+        if self._jaccard is None:
+            union = self.sizes[:, None] + self.sizes[None, :] - self.shared
+            self._jaccard = np.where(union > 0,
+                                     self.shared / np.maximum(union, 1.0), 0.0)
+        return self._jaccard
+
+    def similarity(self, user):
+        ''' {other contributor: Jaccard similarity with user}. Only user's
+        row is computed, unless the whole matrix already is.'''
+        if user not in self.users:
+            return {}
+        i = self.users.index(user)
+        if self._jaccard is not None:
+            row = self._jaccard[i]
+        else:
+            bitsets = self._bitsets()
+            shared = popcount(bitsets[i] & bitsets).sum(axis=1, dtype=np.int64)
+            union = self.sizes[i] + self.sizes - shared
+            row = np.where(union > 0, shared / np.maximum(union, 1.0), 0.0)
+        return {other: float(row[j])
+                for j, other in enumerate(self.users) if j != i}
+
+    def mean_similarity(self):
+        ''' Mean Jaccard similarity over every pair of contributors.'''
+        n = len(self.users)
+        if n < 2:
+            return 0.0
+        return float(self.jaccard[np.triu_indices(n, 1)].mean())
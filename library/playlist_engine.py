@@ -0,0 +1,175 @@
+import json
+import logging
+import eventlet
+import numpy as np
+
+from collections import namedtuple
+from redis import RedisError
+from eventlet import event
+from pyechonest import song
+
+
+logger = logging.getLogger('library')
+
+Track = namedtuple('Track', ['title', 'artist_name', 'danceability', 'energy',
+                             'song_hotttnesss', 'artist_hotttnesss',
+                             'artist_familiarity'])
+
+FEATURES = Track._fields[2:]
+
+
+class PlaylistEngine(object):
+    '''
+    Selects festival playlists locally from a pool of candidate tracks,
+    mirroring the catalog-radio options seed_playlist used to send to
+    Echonest's playlist.static:
+
+    - min_danceability / artist_min_hotttnesss / min_energy filter tracks.
+    - each artist's tracks are picked by song_hotttnesss (artist_pick), and
+      `variety` caps how many tracks one artist can place: 1 at variety=1,
+      up to `max_per_artist` at variety=0.
+    - `adventurousness` shifts the score from familiar artists towards
+      lesser known ones.
+    - the playlist is sorted by artist_familiarity, descending.
+
+    All of the above is computed with numpy over the whole pool at once.
+    '''
+
+    def __init__(self, max_per_artist=10):
+        self.max_per_artist = max_per_artist
+
+    def features(self, tracks):
+        ''' Returns a (len(tracks), 5) float array of FEATURES.'''
+        matrix = np.array([track[2:] for track in tracks], dtype=float)
+        return np.nan_to_num(matrix.reshape(len(tracks), len(FEATURES)))
+
+    def select(self, tracks, danceability=0.5, hotttnesss=0.5, energy=0.5,
+               variety=0.5, adventurousness=0.5, results=50):
+        ''' Returns up to `results` Track objects from `tracks`.'''
+        if not tracks:
+            return []
+        matrix = self.features(tracks)
+        dance, nrg, song_hot, artist_hot, familiarity = matrix.T
+
+        keep = ((dance >= danceability) & (nrg >= energy) &
+                (artist_hot >= hotttnesss))
+        score = ((1 - adventurousness) * familiarity +
+                 adventurousness * (1 - familiarity) + song_hot)
+
+        # rank each track within its artist by song_hotttnesss
+        _, artists = np.unique([t.artist_name for t in tracks],
+                               return_inverse=True)
+        order = np.lexsort((-song_hot, ~keep, artists))
+        sorted_artists = artists[order]
+        starts = np.r_[0, np.flatnonzero(np.diff(sorted_artists)) + 1]
+        counts = np.diff(np.r_[starts, len(order)])
+        rank = np.empty(len(order), dtype=int)
+        rank[order] = np.arange(len(order)) - np.repeat(starts, counts)
+
+        per_artist = 1 + int(round((1 - variety) * (self.max_per_artist - 1)))
+        candidates = np.flatnonzero(keep & (rank < per_artist))
+        if len(candidates) > results:
+            top = np.argpartition(-score[candidates], results - 1)[:results]
+            candidates = candidates[top]
+        candidates = candidates[np.argsort(-familiarity[candidates], kind='mergesort')]
+        return [tracks[i] for i in candidates]
+
+
+class TrackFeatureStore(object):
+    '''
+    Candidate tracks (with their features) per artist, cached in redis.
+    Artists not cached yet are looked up through Echonest's song.search,
+    `concurrency` at a time, and kept for `ttl` seconds. prefetch() does
+    so in the background as soon as artists join a catalog, so that
+    seeding a playlist from it finds them cached.
+    '''
+
+    buckets = ['audio_summary', 'song_hotttnesss',
+               'artist_hotttnesss', 'artist_familiarity']
+
+    def __init__(self, store, ttl=604800, per_artist=15, prefix='tracks',
+                 concurrency=8):
+        self.store = store
+        self.ttl = ttl
+        self.per_artist = per_artist
+        self.prefix = prefix
+        self.concurrency = concurrency
+        self._pending = {}      # artist key -> Event of the search under way
+
+    def _key(self, artist):
+        name = artist.encode('utf-8') if isinstance(artist, unicode) else artist
+        return '{}:{}'.format(self.prefix, name.lower())
+
+    def _search(self, artist):
+        songs = song.search(artist=artist, buckets=self.buckets,
+                            results=self.per_artist)
+        return [Track(s.title, s.artist_name,
+                      s.audio_summary.get('danceability'),
+                      s.audio_summary.get('energy'),
+                      s.song_hotttnesss, s.artist_hotttnesss,
+                      s.artist_familiarity) for s in songs]
+
+    def _cached(self, keys):
+        try:
+            return self.store.mget(keys) if keys else []
+        except RedisError:
+            return [None] * len(keys)
+
+    def _fetch(self, artists):
+        ''' Searches the tracks of artists concurrently and caches them.
+        Returns {artist: tracks} for the artists found.'''
+        def search(artist):
+            # an artist already being searched (e.g. by a prefetch) is
+            # waited for, not searched twice
+            key = self._key(artist)
+            pending = self._pending.get(key)
+            if pending is not None:
+                return artist, pending.wait()
+            pending = self._pending[key] = event.Event()
+            tracks = None
+            try:
+                tracks = self._search(artist)
+            except Exception:
+                logger.debug("No tracks found for artist '%s'", artist)
+            finally:
+                del self._pending[key]
+                pending.send(tracks)
+            return artist, tracks
+
+        pool = eventlet.GreenPool(self.concurrency)
+        found = {artist: tracks for artist, tracks
+                 in pool.imap(search, artists) if tracks is not None}
+        if found:
+            try:
+                pipe = self.store.pipeline(transaction=False)
+                for artist, tracks in found.items():
+                    pipe.setex(self._key(artist), self.ttl, json.dumps(tracks))
+                pipe.execute()
+            except RedisError:
+                logger.warning("Track feature store unavailable, not cached.")
+        return found
+
+    def tracks(self, artists):
+        ''' Returns the candidate tracks of every artist in `artists`.'''
+        artists = list(artists)
+        cached = self._cached([self._key(artist) for artist in artists])
+        pool = []
+        missing = []
+        for artist, entry in zip(artists, cached):
+            if entry is not None:
+                pool.extend(Track(*t) for t in json.loads(entry))
+            else:
+                missing.append(artist)
+        for tracks in self._fetch(missing).values():
+            pool.extend(tracks)
+        return pool
+
+    def prefetch(self, artists):
+        ''' Fetches the tracks of the artists not cached yet, in a green
+        thread.'''
+        artists = list(artists)
+        cached = self._cached([self._key(artist) for artist in artists])
+        missing = [artist for artist, entry in zip(artists, cached)
+                   if entry is None]
+        if missing:
+            eventlet.spawn_n(self._fetch, missing)
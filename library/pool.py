@@ -0,0 +1,199 @@
+import os
+import time
+import threading
+import logging
+
+from contextlib import contextmanager
+
+
+logger = logging.getLogger('library')
+
+
+class PoolTimeout(Exception):
+    ''' Raised when no connection could be checked out of the pool
+    within the configured timeout.'''
+    pass
+
+
+class ConnectionPool(object):
+    '''
+    Bounded pool of MySQL connections shared by the Flask request path
+    and the celery tasks. At most `size` connections are ever opened per
+    process; callers beyond that wait (up to `timeout` seconds) for a
+    connection to be returned, or for the slot of a broken one.
+
+    Connections that sat idle for longer than `idle_check` seconds are
+    pinged before being handed out, and replaced if the ping fails.
+
+        with db_pool.cursor() as cursor:
+            cursor.execute(...)
+
+    commits on success and rolls back on error.
+    '''
+
+    def __init__(self, mysql, size=10, timeout=5, idle_check=30):
+        self.mysql = mysql
+        self.size = size
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self._lock = threading.Lock()
+        # notified whenever a connection is returned or a slot freed
+        self._available = threading.Condition(self._lock)
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._opened = 0
+        self._in_use = 0
+        self._metrics = {'checkouts': 0, 'waits': 0, 'wait_time': 0.0,
+                         'max_wait': 0.0, 'timeouts': 0, 'opened': 0,
+                         'health_failures': 0}
+
+    def _check_pid(self):
+        ''' Connections must not be shared across a fork (celery prefork
+        workers), so a child process starts with an empty pool.'''
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+
+    def _count(self, metric):
+        with self._lock:
+            self._metrics[metric] += 1
+
+    def _open(self):
+        connection = self.mysql.connect()
+        self._count('opened')
+        return connection
+
+    def _release_slot(self):
+        with self._available:
+            self._opened -= 1
+            self._available.notify()
+
+    def _healthy(self, connection, last_used):
+        if time.time() - last_used < self.idle_check:
+            return True
+        try:
+            connection.ping(True)
+        except Exception:
+            self._count('health_failures')
+            logger.warning("DB pool -- idle connection failed health check.")
+            return False
+        return True
+
+    def _acquire(self, deadline):
+        ''' An idle (connection, last used) pair, or (None, None) once a
+        slot for a new connection is reserved, waiting until `deadline`
+        for either.'''
+        waited = False
+        with self._available:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._opened < self.size:
+                    self._opened += 1
+                    return None, None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    raise PoolTimeout("No MySQL connection available "
+                                      "after {}s.".format(self.timeout))
+                if not waited:
+                    self._metrics['waits'] += 1
+                    waited = True
+                self._available.wait(remaining)
+
+    def checkout(self):
+        ''' Returns a connection from the pool, opening a new one if the
+        pool is not yet full, otherwise waiting for one to be returned or
+        for a broken one's slot to be freed.'''
+        self._check_pid()
+        started = time.time()
+        while True:
+            connection, last_used = self._acquire(started + self.timeout)
+            if connection is None:
+                try:
+                    connection = self._open()
+                except Exception:
+                    self._release_slot()
+                    raise
+                break
+            if self._healthy(connection, last_used):
+                break
+            self._close(connection)
+
+        waited = time.time() - started
+        with self._lock:
+            self._in_use += 1
+            self._metrics['checkouts'] += 1
+            self._metrics['wait_time'] += waited
+            self._metrics['max_wait'] = max(self._metrics['max_wait'], waited)
+        return connection
+
+    def checkin(self, connection, broken=False):
+        ''' Returns a connection to the pool. Broken connections are closed
+        and their slot freed for a fresh connection.'''
+        with self._lock:
+            self._in_use -= 1
+        if broken:
+            self._close(connection)
+            return
+        with self._available:
+            self._idle.append((connection, time.time()))
+            self._available.notify()
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        self._release_slot()
+
+    @contextmanager
+    def connection(self):
+        ''' Checks out a connection for the duration of the block.'''
+        connection = self.checkout()
+        broken = False
+        try:
+            yield connection
+        except Exception:
+            try:
+                connection.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self.checkin(connection, broken=broken)
+
+    @contextmanager
+    def cursor(self):
+        ''' Yields a cursor on a pooled connection, committing when the
+        block exits cleanly and rolling back otherwise.'''
+        with self.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+                connection.commit()
+            finally:
+                cursor.close()
+
+    def stats(self):
+        ''' Pool occupancy and checkout wait metrics.'''
+        with self._lock:
+            stats = dict(self._metrics)
+            stats.update({'size': self.size, 'open': self._opened,
+                          'in_use': self._in_use, 'idle': len(self._idle)})
+        if stats['checkouts']:
+            stats['avg_wait'] = stats['wait_time'] / stats['checkouts']
+        else:
+            stats['avg_wait'] = 0.0
+        return stats
+
+    def close_all(self):
+        ''' Closes every idle connection (e.g. on worker shutdown).'''
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._close(connection)
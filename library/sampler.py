@@ -0,0 +1,112 @@
+import random
+import logging
+import threading
+
+from collections import OrderedDict
+from .overlap import Overlap
+
+
+logger = logging.getLogger('library')
+
+
+class AliasSampler(object):
+    '''
+    Draws items at random in proportion to their weights in O(1) per draw,
+    from an alias table built in O(n) (Vose's method): every slot of the
+    table holds one item with probability prob[slot], its alias otherwise.
+    '''
+
+    def __init__(self, weights, rng=random):
+        self.rng = rng
+        self.items = [item for item, weight in weights.iteritems() if weight > 0]
+        n = len(self.items)
+        total = float(sum(weights[item] for item in self.items))
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+        scaled = [weights[item] * n / total for item in self.items]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # what is left is 1.0 give or take rounding errors
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def __len__(self):
+        return len(self.items)
+
+    def draw(self):
+        slot = int(self.rng.random() * len(self.items))
+        if self.rng.random() < self.prob[slot]:
+            return self.items[slot]
+        return self.items[self.alias[slot]]
+
+    def sample(self, k, max_tries=20):
+        ''' k distinct items. Draws that repeat an item are rejected; if the
+        weights are so skewed that k * max_tries draws don't get k items,
+        the rest are picked uniformly among the items not drawn.'''
+        if k >= len(self.items):
+            chosen = list(self.items)
+            self.rng.shuffle(chosen)
+            return chosen
+        chosen = set()
+        for _ in xrange(k * max_tries):
+            chosen.add(self.draw())
+            if len(chosen) == k:
+                return list(chosen)
+        rest = [item for item in self.items if item not in chosen]
+        return list(chosen) + self.rng.sample(rest, k - len(chosen))
+
+
+class FestivalSamplers(object):
+    '''
+    AliasSamplers over the merged artists of each festival's contributors
+    (weighted by overlap.Overlap.weights), kept together with the
+    festival's Overlap for the `size` most recently used festivals. Both
+    are only rebuilt when a contributor joins or leaves, or the preference
+    backend reports that one of the festival's artist sets changed.
+    '''
+
+    def __init__(self, backend, size=256):
+        self.backend = backend
+        self.size = size
+        self._festivals = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _build(self, url_slug, contributors):
+        preferences = {user_id: self.backend.get_ids(str(user_id), url_slug)
+                       for user_id in contributors}
+        overlap = Overlap(preferences, self.backend.dictionary.lookup)
+        weights = {name: weight for name, weight in
+                   zip(overlap.names(), overlap.weights()) if name is not None}
+        sampler = AliasSampler(weights) if weights else None
+        logger.debug("Artist sampler built for festival '%s' (%d artists, %d "
+                     "contributors)", url_slug, len(weights), len(contributors))
+        return sampler, overlap
+
+    def _get(self, url_slug, contributors):
+        signature = (tuple(sorted(contributors)), self.backend.version(url_slug))
+        with self._lock:
+            cached = self._festivals.pop(url_slug, None)
+            if cached and cached[0] == signature:
+                self._festivals[url_slug] = cached
+                return cached[1]
+        built = self._build(url_slug, contributors)
+        with self._lock:
+            self._festivals[url_slug] = (signature, built)
+            while len(self._festivals) > self.size:
+                self._festivals.popitem(last=False)
+        return built
+
+    def get(self, url_slug, contributors):
+        ''' Sampler for the festival at url_slug, None if its contributors
+        have no artists.'''
+        return self._get(url_slug, contributors)[0]
+
+    def overlap(self, url_slug, contributors):
+        ''' overlap.Overlap of the festival's contributors.'''
+        return self._get(url_slug, contributors)[1]
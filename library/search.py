@@ -4,12 +4,11 @@ from flask import render_template, request, redirect, url_for, session, g
 
 from . import app
 from frontend_helpers import SearchForm, SuggestedPlaylistButton, ArtistSelect
-from helpers import search_artist_echonest
+from helpers import search_artists
 
 
 class User():
     artists = ['a', 'b']
-    search_results = 0
 
 User()
 
@@ -19,24 +18,24 @@ def search(s_results=None):
     searchform = SearchForm()
     suggest_pl_but = SuggestedPlaylistButton()
     art_select = ArtistSelect(request.form)
+    # results are per request: the chosen artist is posted by name
+    search_results = list()
 
     if searchform.validate_on_submit():
         # if request.form.get('artist_search'):
         new_artist = searchform.artist_search.data
-        User.search_results = search_artist_echonest(new_artist)
-        art_select.artist_display.choices = User.search_results
+        search_results = search_artists(new_artist) or list()
+        art_select.artist_display.choices = list(enumerate(search_results))
 
-    if art_select.artist_display.data:
-        if art_select.is_submitted():
-            option_n = int(art_select.artist_display.data) + 1
-            chosen_art = User.search_results[option_n][1]
-            User.artists.append(chosen_art)
+    if request.form.get('selectartist'):
+        User.artists.append(request.form.get('selectartist'))
 
     if suggest_pl_but.validate_on_submit():
         if request.form.get('add_button'):
             User.artists.append(["DO 1"])
     return render_template('search.html', searchform=searchform,
                             art_select=art_select,
+                            s_results=search_results,
                             suggest_pl_but=suggest_pl_but,
                             artists=User.artists)
 
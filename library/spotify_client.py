@@ -0,0 +1,247 @@
+import re
+import json
+import time
+import random
+import hashlib
+import logging
+import spotipy
+
+from redis import RedisError
+from spotipy.client import SpotifyException
+from config import BaseConfig
+from . import app, redis_store
+from .tokens import token_manager
+from .metrics import metrics, external_call, request_calls
+
+
+logger = logging.getLogger('library')
+
+IDS = re.compile(r'(users|playlists|artists|albums|tracks)/[^/?]+')
+
+
+class RateLimitTimeout(SpotifyException):
+    ''' Raised when the rate limiter would hold a request back for longer
+    than its max_wait.'''
+
+    def __init__(self, waited):
+        SpotifyException.__init__(self, 429, -1, "Spotify request held back "
+                                  "by the rate limiter for {:.1f}s.".format(waited))
+
+
+def endpoint(url):
+    ''' Metric label of a Spotify API url: "/v1/users/{id}/playlists".'''
+    path = url.split('?', 1)[0].split('api.spotify.com', 1)[-1]
+    return IDS.sub(r'\1/{id}', path)
+
+
+# Takes a token from every bucket in KEYS[2:] at once, or none of them.
+# KEYS[1] holds the time until which Spotify asked us to back off.
+# ARGV: now, then (rate, capacity) for each bucket.
+# Returns the number of seconds to wait before trying again ('0' = go).
+TOKEN_BUCKET_SCRIPT = '''
+local now = tonumber(ARGV[1])
+local blocked = tonumber(redis.call('GET', KEYS[1]) or '0')
+if blocked > now then
+    return tostring(blocked - now)
+end
+local wait = 0
+local tokens = {}
+for i = 2, #KEYS do
+    local rate = tonumber(ARGV[i * 2 - 2])
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local bucket = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local available = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + math.max(0, now - ts) * rate)
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+    tokens[i] = available
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i = 2, #KEYS do
+    local rate = tonumber(ARGV[i * 2 - 2])
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    redis.call('HMSET', KEYS[i], 'tokens', tokens[i] - 1, 'ts', now)
+    redis.call('EXPIRE', KEYS[i], math.ceil(capacity / rate) + 1)
+end
+return '0'
+'''
+
+
+class RateLimiter(object):
+    '''
+    Redis-backed token buckets shared by every web and celery worker:
+    one per app credential and one per user access token. A 429 answer
+    from Spotify blocks the app's bucket for the Retry-After period.
+    A request that would wait for more than `max_wait` seconds in all
+    raises RateLimitTimeout instead.
+
+    If redis is unavailable, requests are let through unthrottled.
+    '''
+
+    def __init__(self, store, client_id, app_rate=20, app_burst=40,
+                 user_rate=5, user_burst=10, max_wait=30, prefix='spotify'):
+        self.store = store
+        self.max_wait = max_wait
+        self.client_id = client_id
+        self.app_limit = (app_rate, app_burst)
+        self.user_limit = (user_rate, user_burst)
+        self.prefix = prefix
+        self._script = store.register_script(TOKEN_BUCKET_SCRIPT)
+        self.metrics = {'requests': 0, 'throttled': 0, 'throttled_time': 0.0,
+                        'rate_limited': 0, 'retries': 0, 'errors': 0,
+                        'timeouts': 0}
+
+    def _keys(self, access_token):
+        user = hashlib.md5(access_token or '').hexdigest()[:16]
+        return ['{}:blocked:{}'.format(self.prefix, self.client_id),
+                '{}:bucket:app:{}'.format(self.prefix, self.client_id),
+                '{}:bucket:user:{}'.format(self.prefix, user)]
+
+    def acquire(self, access_token):
+        ''' Blocks (green-thread friendly) until a request may be sent, for
+        at most max_wait seconds.'''
+        keys = self._keys(access_token)
+        args = list(self.app_limit) + list(self.user_limit)
+        waited = 0.0
+        while True:
+            try:
+                wait = float(self._script(keys=keys, args=[time.time()] + args))
+            except RedisError:
+                logger.warning("Rate limiter unavailable, request not throttled.")
+                break
+            if wait <= 0:
+                break
+            wait += random.uniform(0, 0.1 + wait / 10)
+            if waited + wait > self.max_wait:
+                self.metrics['timeouts'] += 1
+                raise RateLimitTimeout(waited + wait)
+            time.sleep(wait)
+            waited += wait
+        self.metrics['requests'] += 1
+        if waited:
+            self.metrics['throttled'] += 1
+            self.metrics['throttled_time'] += waited
+
+    def block(self, seconds):
+        ''' Holds every worker's requests back for `seconds`.'''
+        self.metrics['rate_limited'] += 1
+        key = self._keys(None)[0]
+        try:
+            self.store.set(key, time.time() + seconds,
+                           ex=int(seconds) + 1)
+        except RedisError:
+            pass
+
+    def stats(self):
+        return dict(self.metrics)
+
+
+class RateLimitedSpotify(spotipy.Spotify):
+    '''
+    spotipy.Spotify client that takes a token from the shared rate limiter
+    before every call, honours Spotify's Retry-After on 429 answers and
+    retries server errors with jittered exponential backoff. Every request
+    times out after `requests_timeout` seconds (default_timeout unless
+    given), through `proxies` if any.
+    '''
+
+    limiter = None
+    max_retries = 5
+    default_timeout = 10
+    calls = None    # external call tally of the request using the client
+
+    def __init__(self, auth=None, requests_timeout=None, proxies=None, **kwargs):
+        spotipy.Spotify.__init__(self, auth=auth, **kwargs)
+        self.requests_timeout = requests_timeout or self.default_timeout
+        self.proxies = proxies
+
+    def _internal_call(self, method, url, payload, params):
+        if not url.startswith('http'):
+            url = self.prefix + url
+        started = time.time()
+        failed = True
+        try:
+            result = self._send(method, url, payload, params)
+            failed = False
+            return result
+        finally:
+            external_call('spotify', '{} {}'.format(method, endpoint(url)),
+                          started, failed, self.calls)
+
+    def _send(self, method, url, payload, params):
+        args = dict(params=params)
+        headers = self._auth_headers()
+        headers['Content-Type'] = 'application/json'
+        if payload:
+            args['data'] = json.dumps(payload)
+
+        for attempt in xrange(self.max_retries + 1):
+            self.limiter.acquire(self._auth)
+            r = self._session.request(method, url, headers=headers,
+                                      timeout=self.requests_timeout,
+                                      proxies=self.proxies, **args)
+            if r.status_code == 429 and attempt < self.max_retries:
+                retry_after = float(r.headers.get('Retry-After', 1))
+                self.limiter.block(retry_after)
+                self.limiter.metrics['retries'] += 1
+                logger.warning("Spotify rate limit hit, backing off %ss",
+                               retry_after)
+                continue
+            if r.status_code >= 500 and attempt < self.max_retries:
+                self.limiter.metrics['retries'] += 1
+                time.sleep(2 ** attempt * random.uniform(0.5, 1.5))
+                continue
+            break
+
+        if r.status_code >= 400:
+            self.limiter.metrics['errors'] += 1
+            try:
+                message = r.json()['error']['message']
+            except Exception:
+                message = r.text
+            raise SpotifyException(r.status_code, -1,
+                                   '{}:\n {}'.format(r.url, message))
+        if len(r.text) > 0:
+            return r.json()
+        return None
+
+    def _get(self, url, args=None, payload=None, **kwargs):
+        # retries are handled by _internal_call
+        if args:
+            kwargs.update(args)
+        return self._internal_call('GET', url, payload, kwargs)
+
+
+RateLimitedSpotify.limiter = RateLimiter(
+    redis_store, BaseConfig.CLIENT_ID,
+    app_rate=app.config['SPOTIFY_APP_RATE'],
+    app_burst=app.config['SPOTIFY_APP_BURST'],
+    user_rate=app.config['SPOTIFY_USER_RATE'],
+    user_burst=app.config['SPOTIFY_USER_BURST'],
+    max_wait=app.config['SPOTIFY_MAX_WAIT'])
+RateLimitedSpotify.max_retries = app.config['SPOTIFY_MAX_RETRIES']
+RateLimitedSpotify.default_timeout = app.config['SPOTIFY_REQUEST_TIMEOUT']
+metrics.gauge('spotifest_spotify_limiter', 'Spotify rate limiter of this process.',
+              RateLimitedSpotify.limiter.stats)
+
+
+def spotify_client(access_token):
+    ''' Returns a rate limited Spotify client for access_token. Its calls
+    are counted for the current request, if any, even when made from
+    another green thread.'''
+    client = RateLimitedSpotify(auth=access_token)
+    client.calls = request_calls()
+    return client
+
+
+def user_client(user_id):
+    ''' Returns a rate limited Spotify client for the user at user_id, with
+    a current access token from the shared token store. Celery tasks are
+    sent the client's user_id rather than the client (or its token).'''
+    client = spotify_client(token_manager.access_token(user_id))
+    client.user_id = user_id
+    return client
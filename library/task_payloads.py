@@ -0,0 +1,68 @@
+import time
+import logging
+
+from celery.signals import before_task_publish
+from kombu.serialization import dumps
+from . import app
+from .metrics import metrics
+
+
+logger = logging.getLogger('library')
+
+
+class PayloadStats(object):
+    '''
+    Size and serialization time of the task messages published by this
+    process, per task name. One in every `sample_every` messages of each
+    task has its body serialized once more with the configured serializer
+    to be measured: 'bytes', 'max_bytes' and 'seconds' add up the
+    'sampled' messages, 'messages' counts them all. Sampled messages
+    larger than `warn_bytes` are logged.
+    '''
+
+    def __init__(self, serializer='json', warn_bytes=65536, sample_every=10):
+        self.serializer = serializer
+        self.warn_bytes = warn_bytes
+        self.sample_every = sample_every
+        self.tasks = {}
+
+    def record(self, task, body):
+        stats = self.tasks.get(task)
+        if stats is None:
+            stats = self.tasks[task] = {'messages': 0, 'sampled': 0, 'bytes': 0,
+                                        'max_bytes': 0, 'seconds': 0.0}
+        stats['messages'] += 1
+        if (stats['messages'] - 1) % self.sample_every:
+            return None
+        started = time.time()
+        payload = dumps(body, serializer=self.serializer)[2]
+        elapsed = time.time() - started
+        stats['sampled'] += 1
+        stats['bytes'] += len(payload)
+        stats['max_bytes'] = max(stats['max_bytes'], len(payload))
+        stats['seconds'] += elapsed
+        if len(payload) > self.warn_bytes:
+            logger.warning("Task '%s' sent a %d bytes message", task, len(payload))
+        return len(payload)
+
+    def stats(self):
+        return {task: dict(stats) for task, stats in self.tasks.items()}
+
+
+payload_stats = PayloadStats(app.config['CELERY_TASK_SERIALIZER'],
+                             warn_bytes=app.config['TASK_PAYLOAD_WARN_BYTES'],
+                             sample_every=app.config['TASK_PAYLOAD_SAMPLE_EVERY'])
+metrics.gauge('spotifest_task_payloads',
+              'Task messages published by this process.',
+              lambda: {(task, stat): value
+                       for task, stats in payload_stats.stats().iteritems()
+                       for stat, value in stats.iteritems()},
+              labels=('task', 'stat'))
+
+
+@before_task_publish.connect
+def record_payload(sender=None, body=None, **kwargs):
+    try:
+        payload_stats.record(sender, body)
+    except Exception as e:
+        logger.error("Could not measure '%s' task payload: %s", sender, e)
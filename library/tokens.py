@@ -0,0 +1,139 @@
+import time
+import base64
+import logging
+import requests
+import spotipy.oauth2
+
+from redis import RedisError
+from config import BaseConfig
+from . import app, redis_store
+
+
+logger = logging.getLogger('library')
+
+
+class TokenManager(object):
+    '''
+    Keeps every user's Spotify OAuth tokens in redis, shared by the web
+    and celery workers, together with the time the access token expires.
+
+    access_token(...) only exchanges the refresh token for a new access
+    token when the current one expires within `margin` seconds. Concurrent
+    refreshes for the same user are collapsed: one worker takes a short
+    redis lock and refreshes, the others wait for its result. If Spotify's
+    token endpoint can't be reached or answers with an error of its own,
+    the current access token is used for as long as it is valid.
+
+    Tokens are dropped `ttl` seconds after they were last saved.
+    '''
+
+    def __init__(self, store, client_id, client_secret, token_url,
+                 margin=300, lock_timeout=10, ttl=604800, timeout=10,
+                 prefix='oauth'):
+        self.store = store
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = token_url
+        self.margin = margin
+        self.lock_timeout = lock_timeout
+        self.ttl = ttl
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def _key(self, user_id):
+        return '{}:{}'.format(self.prefix, user_id)
+
+    def _lock(self, user_id):
+        return '{}:lock:{}'.format(self.prefix, user_id)
+
+    def save(self, user_id, access_token, refresh_token=None, expires_in=3600):
+        tokens = {'access': access_token,
+                  'expires_at': time.time() + int(expires_in)}
+        if refresh_token:
+            tokens['refresh'] = refresh_token
+        pipe = self.store.pipeline()
+        pipe.hmset(self._key(user_id), tokens)
+        pipe.expire(self._key(user_id), self.ttl)
+        pipe.execute()
+
+    def get(self, user_id):
+        tokens = self.store.hgetall(self._key(user_id))
+        if not tokens:
+            return None
+        tokens['expires_at'] = float(tokens.get('expires_at', 0))
+        return tokens
+
+    def delete(self, user_id):
+        self.store.delete(self._key(user_id))
+
+    def access_token(self, user_id):
+        ''' Returns a valid access token for user_id, refreshing it first
+        if it is about to expire. None if the user has no (valid) tokens.'''
+        try:
+            tokens = self.get(user_id)
+            if not tokens:
+                return None
+            if tokens['expires_at'] - time.time() > self.margin:
+                return tokens['access']
+            return self._refresh_once(user_id, tokens)
+        except RedisError:
+            logger.error("Token store unavailable.")
+            return None
+
+    def _refresh_once(self, user_id, tokens):
+        lock = self._lock(user_id)
+        if self.store.set(lock, 1, ex=self.lock_timeout, nx=True):
+            try:
+                return self.refresh(user_id, tokens)
+            finally:
+                self.store.delete(lock)
+        # another worker is refreshing, wait for its token
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(0.1)
+            current = self.get(user_id)
+            if not current:
+                return None
+            if current['expires_at'] > tokens['expires_at']:
+                return current['access']
+        return tokens['access']
+
+    def refresh(self, user_id, tokens):
+        ''' Exchanges the refresh token of tokens (as returned by get) for a
+        new access token and stores it. Tokens Spotify refuses to refresh
+        are dropped; if the refresh fails otherwise, the current access
+        token is returned until it expires.'''
+        credentials = base64.b64encode(self.client_id + ':' + self.client_secret)
+        headers = {'Authorization': 'Basic {}'.format(credentials)}
+        payload = {'grant_type': 'refresh_token',
+                   'refresh_token': tokens.get('refresh')}
+        try:
+            r = requests.post(self.token_url, data=payload, headers=headers,
+                              timeout=self.timeout)
+            response = r.json() if r.status_code < 500 else {}
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("Token refresh failed for user '%s': %s", user_id, e)
+            r, response = None, {}
+        if 'access_token' not in response:
+            if r is not None and 400 <= r.status_code < 500:
+                logger.warning("Token refresh refused for user '%s'", user_id)
+                self.delete(user_id)
+                return None
+            logger.warning("Token endpoint unavailable, keeping the access "
+                           "token of user '%s'", user_id)
+            if tokens['expires_at'] > time.time():
+                return tokens['access']
+            return None
+        self.save(user_id, response['access_token'],
+                  response.get('refresh_token'), response.get('expires_in', 3600))
+        logger.debug("Access token refreshed for user '%s'", user_id)
+        return response['access_token']
+
+
+token_manager = TokenManager(
+    redis_store, BaseConfig.CLIENT_ID, BaseConfig.CLIENT_SECRET,
+    spotipy.oauth2.SpotifyOAuth.OAUTH_TOKEN_URL,
+    margin=app.config['TOKEN_REFRESH_MARGIN'],
+    lock_timeout=app.config['TOKEN_REFRESH_LOCK_TIMEOUT'],
+    ttl=app.config['TOKEN_STORE_TTL'],
+    timeout=app.config['TOKEN_REFRESH_TIMEOUT'])
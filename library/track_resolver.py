@@ -0,0 +1,113 @@
+import hashlib
+import logging
+
+from collections import OrderedDict
+from redis import RedisError
+
+
+logger = logging.getLogger('library')
+
+
+class TrackResolver(object):
+    '''
+    Resolves (title, artist) pairs to Spotify track IDs.
+
+    - each distinct pair is searched at most once per call, and the id is
+      read from that one search response.
+    - results are kept in redis for `ttl` seconds; pairs Spotify has no
+      match for are remembered for `negative_ttl` seconds, so they aren't
+      searched again on every regeneration of a festival playlist.
+    - hit / miss counters are kept in redis as well, see .stats().
+
+    If redis is unavailable, every pair is simply searched.
+    '''
+
+    NOT_FOUND = '-'
+
+    def __init__(self, store, ttl=604800, negative_ttl=86400, prefix='track'):
+        self.store = store
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.prefix = prefix
+
+    def _key(self, title, artist):
+        pair = u'{}\x00{}'.format(title.strip().lower(), artist.strip().lower())
+        digest = hashlib.md5(pair.encode('utf-8')).hexdigest()
+        return '{}:{}'.format(self.prefix, digest)
+
+    def _cached(self, keys):
+        if not keys:
+            return []
+        try:
+            return self.store.mget(keys)
+        except RedisError:
+            logger.warning("Track cache unavailable, searching all tracks.")
+            return [None] * len(keys)
+
+    def _search(self, spotipy, title, artist):
+        q = "track:{} artist:{}".format(title.encode('utf-8'),
+                                        artist.encode('utf-8'))
+        items = spotipy.search(q, type='track', limit=1)['tracks'].get('items')
+        if not items:
+            return None
+        return items[0]['id']
+
+    def resolve(self, spotipy, tracks):
+        '''
+        Returns the Spotify IDs for an iterable of (title, artist) pairs,
+        in order. Pairs without a match on Spotify are left out.
+        '''
+        tracks = list(tracks)
+        keys = [self._key(title, artist) for title, artist in tracks]
+        unique = OrderedDict()
+        for key, track in zip(keys, tracks):
+            unique.setdefault(key, track)
+
+        resolved = dict(zip(unique, self._cached(list(unique))))
+        counts = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+        fresh = {}
+        for key, (title, artist) in unique.items():
+            if resolved[key] == self.NOT_FOUND:
+                counts['negative_hits'] += 1
+            elif resolved[key] is not None:
+                counts['hits'] += 1
+            else:
+                counts['misses'] += 1
+                fresh[key] = self._search(spotipy, title, artist)
+                resolved[key] = fresh[key] or self.NOT_FOUND
+        self._store(fresh, counts)
+
+        logger.debug('..... Resolved %d tracks (%d distinct, %d searched)',
+                     len(tracks), len(unique), counts['misses'])
+        return [resolved[key] for key in keys
+                if resolved[key] != self.NOT_FOUND]
+
+    def _store(self, fresh, counts):
+        try:
+            pipe = self.store.pipeline(transaction=False)
+            for key, spotify_id in fresh.items():
+                if spotify_id:
+                    pipe.setex(key, self.ttl, spotify_id)
+                else:
+                    pipe.setex(key, self.negative_ttl, self.NOT_FOUND)
+            for name, count in counts.items():
+                if count:
+                    pipe.hincrby(self.prefix + ':stats', name, count)
+            pipe.execute()
+        except RedisError:
+            logger.warning("Track cache unavailable, results not cached.")
+
+    def stats(self):
+        ''' Returns hit / miss counters and the overall hit rate.'''
+        try:
+            raw = self.store.hgetall(self.prefix + ':stats')
+        except RedisError:
+            raw = {}
+        stats = {name: int(raw.get(name, 0))
+                 for name in ('hits', 'negative_hits', 'misses')}
+        lookups = sum(stats.values())
+        if lookups:
+            stats['hit_rate'] = (stats['hits'] + stats['negative_hits']) / float(lookups)
+        else:
+            stats['hit_rate'] = 0.0
+        return stats
@@ -0,0 +1,10 @@
+'''
+Unit tests of the library's building blocks, with redis and MySQL
+replaced by the fakes in benchmarks.fakes.
+
+Run from the repository root (config.py still reads credentials.txt,
+placeholder values are fine):
+
+    python -m unittest discover tests
+
+'''
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from benchmarks.fakes import FakeRedis, Recorder, SQLiteMySQL
+from library.pool import ConnectionPool
+from library.cache_backends import (ArtistDictionary, RedisArtistDictionary,
+                                    RedisPreferenceBackend,
+                                    LRUPreferenceBackend,
+                                    DatabasePreferenceBackend)
+
+
+class ArtistDictionaryTest(unittest.TestCase):
+
+    def test_interns_names_once(self):
+        dictionary = ArtistDictionary()
+        ids = dictionary.ids([u'a', 'b', u'a'])
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(dictionary.ids([u'b', u'a']), ids)
+        self.assertEqual(dictionary.lookup(list(ids) + [99]), [u'a', u'b', None])
+
+    def test_forgets_names_no_set_holds(self):
+        dictionary = ArtistDictionary()
+        first = dictionary.ids([u'a', u'b'])
+        second = dictionary.ids([u'b'])
+        dictionary.retain(first)
+        dictionary.retain(second)
+        dictionary.release(first)
+        self.assertEqual(dictionary.names(first), {u'b'})
+        dictionary.release(second)
+        self.assertEqual((len(dictionary), dictionary.bytes), (0, 0))
+
+
+class RedisArtistDictionaryTest(unittest.TestCase):
+
+    def test_workers_share_ids(self):
+        store = FakeRedis()
+        one = RedisArtistDictionary(store, cache_size=2)
+        other = RedisArtistDictionary(store, cache_size=2)
+        ids = one.ids([u'Sigur R\xf3s', u'a', u'b'])
+        self.assertEqual(other.ids([u'b', u'a', u'Sigur R\xf3s']), ids)
+        self.assertLessEqual(len(one), 2)
+        self.assertEqual(one.names(ids), {u'Sigur R\xf3s', u'a', u'b'})
+
+    def test_keeps_the_names_used_last(self):
+        dictionary = RedisArtistDictionary(FakeRedis(), cache_size=2)
+        a, b, c = (dictionary.ids([name])[0] for name in (u'a', u'b', u'c'))
+        # b was looked up since c was interned: c is the one out
+        dictionary.lookup([b])
+        d = dictionary.ids([u'd'])[0]
+        self.assertEqual(sorted(dictionary._names), [b, d])
+        dictionary.ids([u'b'])
+        dictionary.lookup([a])
+        self.assertEqual(sorted(dictionary._names), [a, b])
+
+    def test_concurrent_interning_keeps_one_id(self):
+        store = FakeRedis()
+        one = RedisArtistDictionary(store)
+        other = RedisArtistDictionary(store)
+        incrby = store.incrby
+
+        def racing(key, amount):
+            store.incrby = incrby
+            other.ids([u'a'])
+            return incrby(key, amount)
+
+        store.incrby = racing
+        self.assertEqual(one.ids([u'a']), other.ids([u'a']))
+        self.assertEqual(len(store.data['artists:names']), 1)
+
+
+class PreferenceBackendTests(object):
+    ''' What every preference backend does, run by the TestCases below.'''
+
+    def test_set_get_add(self):
+        self.assertIsNone(self.backend.get('u1', 'fest'))
+        self.backend.set('u1', 'fest', {u'a', u'Sigur R\xf3s'})
+        self.backend.add('u1', 'fest', {u'b'})
+        self.assertEqual(self.backend.get('u1', 'fest'),
+                         {u'a', u'b', u'Sigur R\xf3s'})
+
+    def test_ids_are_interned(self):
+        self.backend.set('u1', 'fest', {u'a', u'\U0001f525'})
+        ids = self.backend.get_ids('u1', 'fest')
+        self.assertEqual(list(ids), sorted(ids))
+        self.assertEqual(self.backend.dictionary.names(ids),
+                         {u'a', u'\U0001f525'})
+
+    def test_delete(self):
+        self.backend.set('u1', 'fest', {u'a'})
+        self.backend.set('u1', 'other', {u'b'})
+        self.backend.set('u2', 'fest', {u'c'})
+        self.backend.delete('u1')
+        self.assertIsNone(self.backend.get('u1', 'fest'))
+        self.assertIsNone(self.backend.get('u1', 'other'))
+        self.assertEqual(self.backend.get('u2', 'fest'), {u'c'})
+
+    def test_version_changes_with_every_write(self):
+        versions = [self.backend.version('fest')]
+        self.backend.set('u1', 'fest', {u'a', u'd'})
+        versions.append(self.backend.version('fest'))
+        # same number of artists, same sum of their IDs
+        self.backend.set('u1', 'fest', {u'b', u'c'})
+        versions.append(self.backend.version('fest'))
+        self.backend.add('u2', 'fest', {u'a'})
+        versions.append(self.backend.version('fest'))
+        self.backend.delete('u2')
+        versions.append(self.backend.version('fest'))
+        self.assertEqual(len(set(versions)), len(versions))
+
+
+class RedisPreferenceBackendTest(PreferenceBackendTests, unittest.TestCase):
+
+    def setUp(self):
+        self.backend = RedisPreferenceBackend(FakeRedis())
+
+    def test_stores_names_once(self):
+        name = u'Sigur R\xf3s'
+        self.backend.set('u1', 'fest', {name})
+        self.backend.set('u2', 'fest', {name})
+        data = self.backend.store.data
+        ids = list(self.backend.get_ids('u1', 'fest'))
+        for user in ('u1', 'u2'):
+            members = data[self.backend._key(user, 'fest')]
+            self.assertEqual([int(member) for member in members], ids)
+        self.assertEqual(data['artists:names'].values(),
+                         [name.encode('utf-8')])
+
+
+class LRUPreferenceBackendTest(PreferenceBackendTests, unittest.TestCase):
+
+    def setUp(self):
+        self.backend = LRUPreferenceBackend()
+
+    def test_evicts_least_recently_used(self):
+        backend = LRUPreferenceBackend(max_bytes=4000)
+        backend.set('u1', 'fest', {u'a%d' % i for i in range(5)})
+        backend.set('u2', 'fest', {u'b%d' % i for i in range(5)})
+        backend.get('u1', 'fest')
+        backend.set('u3', 'fest', {u'c%d' % i for i in range(5)})
+        self.assertIsNone(backend.get('u2', 'fest'))
+        self.assertIsNotNone(backend.get('u1', 'fest'))
+        self.assertLessEqual(backend.total_bytes, 4000)
+
+    def test_counts_the_dictionary_and_forgets_evicted_names(self):
+        backend = LRUPreferenceBackend(max_bytes=10 ** 6)
+        backend.set('u1', 'fest', {u'a%d' % i for i in range(100)})
+        self.assertGreater(backend.dictionary.bytes, backend.bytes)
+        self.assertEqual(backend.total_bytes,
+                         backend.bytes + backend.dictionary.bytes +
+                         backend.festival_bytes)
+        backend.set('u1', 'fest', {u'a0'})
+        self.assertEqual(len(backend.dictionary), 1)
+        backend.delete('u1')
+        self.assertEqual((backend.total_bytes, len(backend.dictionary)), (0, 0))
+
+    def test_entries_expire(self):
+        backend = LRUPreferenceBackend(ttl=-1)
+        backend.set('u1', 'fest', {u'a'})
+        self.assertIsNone(backend.get('u1', 'fest'))
+        self.assertEqual(len(backend.dictionary), 0)
+
+    def test_add_does_not_merge_expired_artists(self):
+        backend = LRUPreferenceBackend(ttl=-1)
+        backend.set('u1', 'fest', {u'a', u'b'})
+        backend.ttl = 60
+        backend.add('u1', 'fest', {u'b', u'c'})
+        self.assertEqual(backend.get('u1', 'fest'), {u'b', u'c'})
+
+    def test_versions_are_dropped_with_the_festival(self):
+        backend = LRUPreferenceBackend()
+        backend.set('u1', 'fest', {u'a'})
+        backend.set('u2', 'fest', {u'b'})
+        first = backend.version('fest')
+        backend.delete('u1')
+        self.assertNotIn(backend.version('fest'), (0, first))
+        self.assertEqual(backend.version('unknown'), 0)
+        backend.delete('u2')
+        self.assertEqual(backend.version('fest'), 0)
+        self.assertEqual((backend._festivals, backend.total_bytes), ({}, 0))
+        backend.set('u1', 'fest', {u'a'})
+        self.assertNotIn(backend.version('fest'), (0, first))
+
+
+class DatabasePreferenceBackendTest(PreferenceBackendTests, unittest.TestCase):
+
+    def setUp(self):
+        self.database = SQLiteMySQL(Recorder())
+        self.pool = ConnectionPool(self.database)
+        self.backend = DatabasePreferenceBackend(self.pool)
+        with self.pool.cursor() as cursor:
+            cursor.execute("INSERT INTO sessions (userId, catalogId, urlSlug) "
+                           "VALUES ('u1', 'catalog', 'fest')")
+
+    def tearDown(self):
+        self.database.close()
+
+    def test_version_is_the_festival_version(self):
+        self.backend.set('u1', 'fest', {u'a'})
+        with self.pool.cursor() as cursor:
+            cursor.execute("SELECT version FROM sessions WHERE urlSlug = 'fest'")
+            self.assertEqual(self.backend.version('fest'), cursor.fetchone()[0])
+        self.assertEqual(self.backend.version('unknown'), 0)
+
+    def test_long_names_are_left_out(self):
+        long_name = u'x' * (self.backend.dictionary.max_name_length + 1)
+        self.backend.set('u1', 'fest', {u'a' * 300, long_name})
+        self.assertEqual(self.backend.get('u1', 'fest'), {u'a' * 300})
+
+    def test_workers_share_ids(self):
+        ids = self.backend.dictionary.ids([u'a', u'\U0001f525'])
+        other = DatabasePreferenceBackend(self.pool)
+        self.assertEqual(other.dictionary.ids([u'\U0001f525', u'a']), ids)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+import eventlet
+
+from eventlet import debug
+from eventlet.event import Event
+from library.futures import TaskHandle, GreenPart, DonePart, TaskTimeout
+from library.helpers import CatalogSeeding
+
+
+def fail():
+    raise ValueError('failed')
+
+
+# the failures are the handles' to report
+debug.hub_exceptions(False)
+
+
+class TaskHandleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.blocker = Event()
+
+    def tearDown(self):
+        if not self.blocker.ready():
+            self.blocker.send(None)
+
+    def test_merges_the_values_of_its_parts(self):
+        handle = TaskHandle([DonePart(1), GreenPart(lambda: 2)])
+        self.assertEqual(handle.get(timeout=1), [1, 2])
+        self.assertEqual(handle.then(sum).get(timeout=1), 3)
+        self.assertEqual(TaskHandle.done('x').get(), 'x')
+
+    def test_times_out(self):
+        handle = TaskHandle([DonePart(1), GreenPart(self.blocker.wait)])
+        self.assertRaises(TaskTimeout, handle.get, timeout=0.05)
+        self.assertEqual(handle.progress(), (1, 2))
+
+    def test_partial_leaves_out_unfinished_and_failed_parts(self):
+        handle = TaskHandle([DonePart(1), GreenPart(self.blocker.wait),
+                             GreenPart(fail)])
+        self.assertEqual(handle.get(timeout=0.05, partial=True), [1])
+
+    def test_failure_raises_unless_partial(self):
+        handle = TaskHandle([GreenPart(fail)])
+        self.assertRaises(ValueError, handle.get, timeout=1)
+
+    def test_on_done_calls_back_with_the_result(self):
+        results = []
+        handle = TaskHandle([GreenPart(self.blocker.wait), DonePart(1)])
+        handle.on_done(results.append)
+        eventlet.sleep(0.05)
+        self.assertEqual(results, [])
+        self.blocker.send(2)
+        eventlet.sleep(0.15)
+        self.assertEqual(results, [[2, 1]])
+
+    def test_on_done_timeout_gives_the_partial_result(self):
+        results = []
+        TaskHandle([GreenPart(self.blocker.wait), DonePart(1)]).on_done(
+            results.append, timeout=0.05)
+        eventlet.sleep(0.2)
+        self.assertEqual(results, [[1]])
+
+
+class CatalogSeedingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.blocker = Event()
+        self.seeding = CatalogSeeding(timeout=0.1)
+
+    def tearDown(self):
+        if not self.blocker.ready():
+            self.blocker.send(None)
+
+    def test_pending_until_done(self):
+        self.seeding.add('fest', TaskHandle([GreenPart(self.blocker.wait)]))
+        self.seeding.add('fest', TaskHandle.done(None))
+        self.assertIsNone(self.seeding.pending('other'))
+        pending = self.seeding.pending('fest')
+        self.assertEqual(pending.progress(), (0, 1))
+        self.blocker.send('catalog')
+        self.assertEqual(pending.get(timeout=1), ['catalog'])
+        eventlet.sleep(0.1)
+        self.assertIsNone(self.seeding.pending('fest'))
+        self.assertEqual(self.seeding._handles, {})
+
+    def test_forgets_handles_after_timeout(self):
+        self.seeding.add('fest', TaskHandle([GreenPart(self.blocker.wait)]))
+        eventlet.sleep(0.25)
+        self.assertIsNone(self.seeding.pending('fest'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import mock
+
+from collections import namedtuple
+from benchmarks.fakes import FakeRedis
+from library import app, jobs
+
+
+Track = namedtuple('Track', ['title', 'artist_name'])
+
+
+class PlaylistJobTest(unittest.TestCase):
+
+    def setUp(self):
+        self.helpers = mock.Mock()
+        self.db = mock.Mock()
+        patchers = [mock.patch.dict(app.config, IS_ASYNC=False),
+                    mock.patch.object(jobs.progress, 'store', FakeRedis()),
+                    mock.patch.object(jobs, 'helpers', self.helpers),
+                    mock.patch.object(jobs, 'db', self.db),
+                    mock.patch.object(jobs, 'user_client', mock.Mock())]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.helpers.catalog_seeding.pending.return_value = None
+        self.helpers.create_playlist.return_value = 'playlist'
+
+    def start(self):
+        job_id = jobs.start_playlist_job('fest', 'catalog', 'user', 'Fest', {})
+        return jobs.progress.get(job_id)
+
+    def test_writes_the_resolved_tracks(self):
+        self.helpers.seed_playlist.return_value = [Track('Song', 'Band')]
+        self.helpers.track_resolver.resolve.return_value = ['id']
+        job = self.start()
+        self.assertEqual((job['state'], job['total'], job['found']),
+                         ('done', 1, 1))
+        self.helpers.add_songs_to_playlist.assert_called_once_with(
+            mock.ANY, 'user', 'playlist', ['id'])
+        self.assertTrue(self.db.update_festival.called)
+
+    def test_fails_without_tracks(self):
+        self.helpers.seed_playlist.return_value = []
+        self.assertEqual(self.start()['state'], 'failed')
+        self.assertFalse(self.helpers.create_playlist.called)
+        self.assertFalse(self.db.update_festival.called)
+
+    def test_fails_when_no_track_is_found(self):
+        self.helpers.seed_playlist.return_value = [Track('Song', 'Band')]
+        self.helpers.track_resolver.resolve.return_value = []
+        self.assertEqual(self.start()['state'], 'failed')
+        self.assertFalse(self.helpers.create_playlist.called)
+        self.assertFalse(self.db.update_festival.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import sys
+import logging
+import unittest
+
+from library.logs import BackgroundHandler
+
+
+def record(msg, *args):
+    return logging.LogRecord('test', logging.WARNING, __file__, 1, msg,
+                             args, None)
+
+
+class BackgroundHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = BackgroundHandler([])
+
+    def test_leaves_strings_and_numbers_to_the_writer(self):
+        prepared = self.handler.prepare(record("%s has %d artists", 'u1', 3))
+        self.assertEqual(prepared.args, ('u1', 3))
+        self.assertEqual(prepared.getMessage(), 'u1 has 3 artists')
+
+    def test_formats_arguments_that_may_change(self):
+        artists = ['a']
+        prepared = self.handler.prepare(record("artists %s", artists))
+        artists.append('b')
+        self.assertIsNone(prepared.args)
+        self.assertEqual(prepared.getMessage(), "artists ['a']")
+
+    def test_formats_a_dict_argument(self):
+        user = {'artists': 1}
+        prepared = self.handler.prepare(record("%(artists)d artists", user))
+        user['artists'] = 2
+        self.assertEqual(prepared.getMessage(), '1 artists')
+
+    def test_formats_tracebacks(self):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            failed = logging.LogRecord('test', logging.ERROR, __file__, 1,
+                                       'failed', (), sys.exc_info())
+        prepared = self.handler.prepare(failed)
+        self.assertIsNone(prepared.exc_info)
+        self.assertIn('ValueError: boom', prepared.exc_text)
+
+
+if __name__ == '__main__':
+    unittest.main()
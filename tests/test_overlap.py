@@ -0,0 +1,81 @@
+import random
+import unittest
+import numpy as np
+
+from library.overlap import Overlap, popcount
+
+
+def lookup(ids):
+    return [u'artist%d' % i for i in ids]
+
+
+class PopcountTest(unittest.TestCase):
+
+    def test_matches_bin_count(self):
+        rng = random.Random(1)
+        values = [0, 1, 2 ** 63, 2 ** 64 - 1] + [rng.getrandbits(64)
+                                                 for _ in range(1000)]
+        counts = popcount(np.array(values, dtype=np.uint64))
+        self.assertEqual(counts.tolist(),
+                         [bin(value).count('1') for value in values])
+
+
+class OverlapTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(2)
+        # more shared artists than one 64-bit word holds
+        self.sets = {'user%d' % u: set(rng.sample(range(400), rng.randint(1, 200)))
+                     for u in range(6)}
+        preferences = {user: sorted(ids) for user, ids in self.sets.items()}
+        preferences.update(empty=[], missing=None)
+        self.overlap = Overlap(preferences, lookup)
+
+    def test_contributors_without_artists_are_left_out(self):
+        self.assertEqual(self.overlap.users, sorted(self.sets))
+
+    def test_shared_and_jaccard(self):
+        users = self.overlap.users
+        for i, a in enumerate(users):
+            for j, b in enumerate(users):
+                shared = len(self.sets[a] & self.sets[b])
+                self.assertEqual(self.overlap.shared[i, j], shared)
+                self.assertAlmostEqual(
+                    self.overlap.jaccard[i, j],
+                    shared / float(len(self.sets[a] | self.sets[b])))
+
+    def test_similarity_is_the_jaccard_row(self):
+        similarity = self.overlap.similarity('user0')
+        jaccard = self.overlap.jaccard
+        self.assertEqual(sorted(similarity), self.overlap.users[1:])
+        for j, other in enumerate(self.overlap.users[1:], 1):
+            self.assertAlmostEqual(similarity[other], jaccard[0, j])
+        self.assertEqual(self.overlap.similarity('user0'), similarity)
+        self.assertEqual(self.overlap.similarity('nobody'), {})
+
+    def test_counts_and_weights(self):
+        counts = dict(zip(self.overlap.ids.tolist(),
+                          self.overlap.counts.tolist()))
+        for artist, count in counts.items():
+            self.assertEqual(count, sum(artist in ids
+                                        for ids in self.sets.values()))
+        # every contributor brings a total weight of one, before sharing
+        self.assertAlmostEqual(
+            (self.overlap.weights() / self.overlap.counts).sum(), len(self.sets))
+
+    def test_common_ground(self):
+        overlap = Overlap({'a': [1, 2, 3], 'b': [2, 3], 'c': [3, 4]}, lookup)
+        self.assertEqual(overlap.common_ground(), [u'artist3', u'artist2'])
+        self.assertEqual(overlap.common_ground(limit=1), [u'artist3'])
+        self.assertAlmostEqual(overlap.mean_similarity(),
+                               (2 / 3.0 + 1 / 4.0 + 1 / 3.0) / 3)
+
+    def test_no_contributors(self):
+        overlap = Overlap({}, lookup)
+        self.assertEqual(overlap.common_ground(), [])
+        self.assertEqual(overlap.shared.shape, (0, 0))
+        self.assertEqual(overlap.mean_similarity(), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
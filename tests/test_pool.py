@@ -0,0 +1,151 @@
+import unittest
+import eventlet
+
+from library.pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.closed = False
+        self.healthy = True
+        self.commits = 0
+        self.rollbacks = 0
+
+    def ping(self, reconnect):
+        if not self.healthy:
+            raise IOError('gone away')
+
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCursor(object):
+
+    def close(self):
+        pass
+
+
+class FakeMySQL(object):
+
+    def __init__(self):
+        self.connections = []
+        self.fail = False
+
+    def connect(self):
+        if self.fail:
+            raise IOError("can't connect")
+        connection = FakeConnection()
+        self.connections.append(connection)
+        return connection
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mysql = FakeMySQL()
+        self.pool = ConnectionPool(self.mysql, size=2, timeout=0.05)
+
+    def test_reuses_returned_connections(self):
+        for _ in range(3):
+            with self.pool.connection():
+                pass
+        self.assertEqual(len(self.mysql.connections), 1)
+        stats = self.pool.stats()
+        self.assertEqual((stats['checkouts'], stats['open'], stats['idle'],
+                          stats['in_use']), (3, 1, 1, 0))
+
+    def test_waits_then_times_out_when_full(self):
+        self.pool.checkout()
+        self.pool.checkout()
+        self.assertRaises(PoolTimeout, self.pool.checkout)
+        stats = self.pool.stats()
+        self.assertEqual(len(self.mysql.connections), 2)
+        self.assertEqual((stats['waits'], stats['timeouts'], stats['in_use']),
+                         (1, 1, 2))
+
+    def test_waiter_gets_the_connection_returned(self):
+        first = self.pool.checkout()
+        self.pool.checkout()
+        eventlet.spawn_after(0.01, self.pool.checkin, first)
+        self.assertIs(self.pool.checkout(), first)
+        self.assertEqual(self.pool.stats()['waits'], 1)
+
+    def test_waiter_gets_the_slot_of_a_broken_connection(self):
+        pool = ConnectionPool(self.mysql, size=2, timeout=1)
+        first = pool.checkout()
+        pool.checkout()
+        eventlet.spawn_after(0.01, pool.checkin, first, broken=True)
+        self.assertNotIn(pool.checkout(), (first, None))
+        stats = pool.stats()
+        self.assertEqual((stats['waits'], stats['timeouts'], stats['open']),
+                         (1, 0, 2))
+
+    def test_broken_and_failed_connections_free_their_slot(self):
+        connection = self.pool.checkout()
+        self.pool.checkin(connection, broken=True)
+        self.assertTrue(connection.closed)
+        self.mysql.fail = True
+        self.assertRaises(IOError, self.pool.checkout)
+        self.mysql.fail = False
+        self.pool.checkout()
+        self.pool.checkout()
+        self.assertEqual(self.pool.stats()['open'], 2)
+
+    def test_replaces_idle_connections_failing_their_ping(self):
+        pool = ConnectionPool(self.mysql, size=2, idle_check=0)
+        connection = pool.checkout()
+        pool.checkin(connection)
+        connection.healthy = False
+        self.assertIsNot(pool.checkout(), connection)
+        self.assertTrue(connection.closed)
+        stats = pool.stats()
+        self.assertEqual((stats['health_failures'], stats['opened'],
+                          stats['open']), (1, 2, 1))
+
+    def test_cursor_commits_or_rolls_back(self):
+        with self.pool.cursor():
+            pass
+        with self.assertRaises(ValueError):
+            with self.pool.cursor():
+                raise ValueError
+        connection, = self.mysql.connections
+        self.assertEqual((connection.commits, connection.rollbacks), (1, 1))
+        self.assertEqual(self.pool.stats()['in_use'], 0)
+
+    def test_forked_process_starts_with_an_empty_pool(self):
+        with self.pool.connection():
+            pass
+        self.pool._pid = -1
+        stats = self.pool.stats()
+        self.pool.checkout()
+        after = self.pool.stats()
+        self.assertEqual(stats['open'], 1)
+        self.assertEqual((after['open'], after['checkouts'], after['idle']),
+                         (1, 1, 0))
+        self.assertEqual(len(self.mysql.connections), 2)
+
+    def test_concurrent_checkouts_are_all_counted(self):
+        pool = ConnectionPool(self.mysql, size=3, timeout=5)
+
+        def work(_):
+            with pool.connection():
+                eventlet.sleep(0)
+
+        list(eventlet.GreenPool(20).imap(work, range(200)))
+        stats = pool.stats()
+        self.assertEqual((stats['checkouts'], stats['in_use']), (200, 0))
+        self.assertLessEqual(len(self.mysql.connections), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
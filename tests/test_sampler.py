@@ -0,0 +1,75 @@
+import random
+import unittest
+
+from collections import Counter
+from library.sampler import AliasSampler, FestivalSamplers
+from library.cache_backends import LRUPreferenceBackend
+
+
+class AliasSamplerTest(unittest.TestCase):
+
+    def test_draws_in_proportion_to_weights(self):
+        weights = {'a': 1, 'b': 2, 'c': 7, 'd': 0}
+        sampler = AliasSampler(weights, rng=random.Random(1))
+        draws = 50000
+        counts = Counter(sampler.draw() for _ in xrange(draws))
+        self.assertNotIn('d', counts)
+        self.assertEqual(len(sampler), 3)
+        for item in 'abc':
+            self.assertAlmostEqual(counts[item] / float(draws),
+                                   weights[item] / 10.0, delta=0.01)
+
+    def test_sample_is_distinct(self):
+        sampler = AliasSampler({i: i + 1 for i in range(100)},
+                               rng=random.Random(2))
+        chosen = sampler.sample(30)
+        self.assertEqual(len(chosen), 30)
+        self.assertEqual(len(set(chosen)), 30)
+
+    def test_sample_of_every_item(self):
+        sampler = AliasSampler({'a': 1, 'b': 1}, rng=random.Random(3))
+        self.assertEqual(sorted(sampler.sample(5)), ['a', 'b'])
+
+    def test_skewed_weights_fall_back_to_uniform(self):
+        sampler = AliasSampler({'a': 1e9, 'b': 1, 'c': 1, 'd': 1},
+                               rng=random.Random(4))
+        chosen = sampler.sample(3, max_tries=1)
+        self.assertEqual(len(set(chosen)), 3)
+        self.assertIn('a', chosen)
+
+
+class FestivalSamplersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = LRUPreferenceBackend()
+        self.backend.set('1', 'fest', {u'a', u'b'})
+        self.backend.set('2', 'fest', {u'b', u'c'})
+        self.samplers = FestivalSamplers(self.backend, size=1)
+
+    def test_cached_until_preferences_change(self):
+        sampler = self.samplers.get('fest', [1, 2])
+        self.assertEqual(sorted(sampler.items), [u'a', u'b', u'c'])
+        self.assertIs(self.samplers.get('fest', [2, 1]), sampler)
+        self.backend.add('1', 'fest', {u'd'})
+        rebuilt = self.samplers.get('fest', [1, 2])
+        self.assertIsNot(rebuilt, sampler)
+        self.assertIn(u'd', rebuilt.items)
+
+    def test_rebuilt_when_contributors_change(self):
+        sampler = self.samplers.get('fest', [1, 2])
+        self.assertEqual(sorted(self.samplers.get('fest', [1]).items),
+                         [u'a', u'b'])
+        self.assertIsNot(self.samplers.get('fest', [1, 2]), sampler)
+
+    def test_no_artists(self):
+        self.assertIsNone(self.samplers.get('other', [1]))
+
+    def test_keeps_size_festivals(self):
+        self.backend.set('1', 'other', {u'x'})
+        sampler = self.samplers.get('fest', [1])
+        self.samplers.get('other', [1])
+        self.assertIsNot(self.samplers.get('fest', [1]), sampler)
+
+
+if __name__ == '__main__':
+    unittest.main()